@@ -0,0 +1,328 @@
+"""
+In-process prefix index for search-box autocomplete.
+
+Tool names and pickup cities are normalized (lowercased, accents stripped,
+whitespace collapsed) and stored in a sorted list of ``(key, kind, term)``
+tuples, where every word-start suffix of a term is a key so "dri" finds both
+"Drill Set" and "Cordless Drill". Lookups are a bisect plus a scan of the
+matching keys; results are ranked by popularity (listings + rentals for
+tools, listings for cities). Short prefixes match a large share of the
+index, so their ranked top MAX_LIMIT is kept per prefix and adjusted in
+place as popularity changes, only falling back to a rescan when a term
+leaves a full list.
+
+The WSGI/ASGI entry points call ``start()``, which builds the index in a
+background thread and rebuilds it every AUTOCOMPLETE_REBUILD_SECONDS, so
+requests only ever read an index that is already built (an empty one until
+the first build finishes). Between rebuilds it is updated incrementally
+from Tool/RentalTransaction signals; updates that arrive while a rebuild is
+running are replayed onto the new index. Each worker process holds its own
+copy and only sees its own signals, so the rebuilds are also what picks up
+other workers' writes.
+
+AUTOCOMPLETE_MAX_TERMS bounds the searchable terms and their keys.
+``tool_entries`` is not bounded: it keeps one (name, city, weight) tuple per
+tool so an edit or delete can take the tool's old name back out, and so
+grows with the number of tools rather than with distinct names.
+"""
+import bisect
+import heapq
+import logging
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count
+
+from .models import Tool
+
+TOOL = 'tool'
+CITY = 'city'
+
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 25
+# Prefixes up to this length are hot and match too many keys to scan per lookup
+CACHED_PREFIX_LENGTH = 3
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text):
+    """Lowercase, strip accents and collapse whitespace"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.lower().split())
+
+
+class PrefixIndex:
+    """Sorted-array prefix index with popularity-ranked, bounded lookups"""
+
+    def __init__(self, max_terms=None):
+        self.max_terms = max_terms or getattr(settings, 'AUTOCOMPLETE_MAX_TERMS', 200000)
+        self._lock = threading.RLock()
+        self._keys = []    # sorted [(key, kind, term)]
+        self._terms = {}   # (kind, term) -> [display text, popularity]
+        self._top = {}     # short prefix -> ranked [(kind, term)], its top MAX_LIMIT matches
+        self.tool_entries = {}  # tool id -> (name, city, weight) this index holds for it; one per tool
+
+    def __len__(self):
+        return len(self._terms)
+
+    @staticmethod
+    def _suffixes(term):
+        words = term.split(' ')
+        return [' '.join(words[i:]) for i in range(len(words))]
+
+    def _rank(self, item):
+        kind, term = item
+        return (-self._terms[item][1], len(term), kind, term)
+
+    def _prefixes(self, term):
+        """Memoizable prefixes of every word-start suffix of ``term``"""
+        return {key[:length] for key in self._suffixes(term) for length in range(1, min(len(key), CACHED_PREFIX_LENGTH) + 1)}
+
+    def load(self, entries):
+        """Bulk-add ``(kind, text, weight)`` entries, sorting the keys once at the end"""
+        with self._lock:
+            added = []
+            for kind, text, weight in entries:
+                term = normalize(text)
+                if not term or weight <= 0:
+                    continue
+                entry = self._terms.get((kind, term))
+                if entry is not None:
+                    entry[1] += weight
+                elif len(self._terms) < self.max_terms:
+                    self._terms[(kind, term)] = [text.strip(), weight]
+                    added.extend((key, kind, term) for key in self._suffixes(term))
+            self._keys.extend(added)
+            self._keys.sort()
+            self._top.clear()
+
+    def add(self, kind, text, weight=1):
+        term = normalize(text)
+        if not term or weight <= 0:
+            return
+        with self._lock:
+            entry = self._terms.get((kind, term))
+            if entry is None:
+                if len(self._terms) >= self.max_terms:
+                    return
+                self._terms[(kind, term)] = [text.strip(), weight]
+                for key in self._suffixes(term):
+                    bisect.insort(self._keys, (key, kind, term))
+            else:
+                entry[1] += weight
+            self._promote((kind, term))
+
+    def remove(self, kind, text, weight=1):
+        term = normalize(text)
+        with self._lock:
+            entry = self._terms.get((kind, term))
+            if entry is None:
+                return
+            entry[1] -= weight
+            removed = entry[1] <= 0
+            if removed:
+                del self._terms[(kind, term)]
+                for key in self._suffixes(term):
+                    position = bisect.bisect_left(self._keys, (key, kind, term))
+                    if position < len(self._keys) and self._keys[position] == (key, kind, term):
+                        del self._keys[position]
+            self._demote((kind, term), removed)
+
+    def _promote(self, item):
+        """A term gained popularity: it can only move up, or into, the lists it matches"""
+        for prefix in self._prefixes(item[1]):
+            top = self._top.get(prefix)
+            if top is not None:
+                if item not in top:
+                    top.append(item)
+                top.sort(key=self._rank)
+                del top[MAX_LIMIT:]
+
+    def _demote(self, item, removed):
+        """A term lost popularity or is gone: a full list it was in may now miss a better term"""
+        for prefix in self._prefixes(item[1]):
+            top = self._top.get(prefix)
+            if top is None or item not in top:
+                continue
+            if len(top) >= MAX_LIMIT:
+                del self._top[prefix]  # Rescanned on the next lookup
+            elif removed:
+                top.remove(item)
+            else:
+                top.sort(key=self._rank)
+
+    def _scan(self, prefix, limit):
+        """Top ``limit`` (kind, term) over every key starting with ``prefix``"""
+        matches = set()
+        position = bisect.bisect_left(self._keys, (prefix,))
+        while position < len(self._keys):
+            key, kind, term = self._keys[position]
+            if not key.startswith(prefix):
+                break
+            matches.add((kind, term))
+            position += 1
+        return heapq.nsmallest(limit, matches, key=self._rank)
+
+    def lookup(self, prefix, limit=DEFAULT_LIMIT):
+        """Return up to ``limit`` suggestions whose words start with ``prefix``"""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            if len(prefix) <= CACHED_PREFIX_LENGTH:
+                top = self._top.get(prefix)
+                if top is None:
+                    top = self._top[prefix] = self._scan(prefix, MAX_LIMIT)
+                best = top[:limit]
+            else:
+                best = self._scan(prefix, limit)
+            suggestions = []
+            for kind, term in best:
+                display, popularity = self._terms[(kind, term)]
+                suggestions.append({'text': display, 'type': kind, 'popularity': popularity})
+            return suggestions
+
+
+_index = None
+_built_at = 0.0
+_build_lock = threading.Lock()
+# Signal updates made while a rebuild runs, replayed onto the new index before it goes live
+_pending = None
+_updates_lock = threading.Lock()
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def _add_tool(index, tool_id, name, city, weight):
+    index.add(TOOL, name, weight)
+    if city:
+        index.add(CITY, city)
+    index.tool_entries[tool_id] = (name, city, weight)
+
+
+def _remove_tool(index, tool_id):
+    previous = index.tool_entries.pop(tool_id, None)
+    if previous is None:
+        return
+    name, city, weight = previous
+    index.remove(TOOL, name, weight)
+    if city:
+        index.remove(CITY, city)
+
+
+def build_index():
+    """Build a fresh index from the database and install it"""
+    global _index, _built_at, _pending
+    with _build_lock:
+        with _updates_lock:
+            _pending = []
+        try:
+            index = PrefixIndex()
+            entries = []
+            tools = Tool.objects.annotate(rental_count=Count('rentals')).values_list('id', 'name', 'pickup_city', 'rental_count')
+            for tool_id, name, city, rental_count in tools.iterator():
+                entries.append((TOOL, name, 1 + rental_count))
+                if city:
+                    entries.append((CITY, city, 1))
+                index.tool_entries[tool_id] = (name, city, 1 + rental_count)
+            index.load(entries)
+        except BaseException:
+            with _updates_lock:
+                _pending = None
+            raise
+        with _updates_lock:
+            # The snapshot may already include some of these; saves and deletes are
+            # idempotent, a rental can be counted twice until the next rebuild
+            for update, args in _pending:
+                update(index, *args)
+            _index = index
+            _pending = None
+            _built_at = time.monotonic()
+    return index
+
+
+def _refresh_forever():
+    while True:
+        try:
+            build_index()
+        except Exception:
+            logger.exception('Could not build the autocomplete index')
+        finally:
+            # This thread's own connection; the next build opens a fresh one
+            connections.close_all()
+        time.sleep(settings.AUTOCOMPLETE_REBUILD_SECONDS)
+
+
+def start():
+    """Build the index in a background thread and rebuild it every AUTOCOMPLETE_REBUILD_SECONDS"""
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None or not _refresher.is_alive():
+            _refresher = threading.Thread(target=_refresh_forever, name='autocomplete-refresh', daemon=True)
+            _refresher.start()
+
+
+def get_index():
+    """The last index built, or an empty one until the first build finishes; requests never build it"""
+    if _refresher is not None and not _refresher.is_alive():
+        # Started before a fork (gunicorn --preload): the child needs its own thread
+        start()
+    return _index if _index is not None else PrefixIndex()
+
+
+def suggest(prefix, limit=DEFAULT_LIMIT):
+    return get_index().lookup(prefix, min(max(1, limit), MAX_LIMIT))
+
+
+def _record(update, *args):
+    """Apply a signal update to the live index, and queue it for an index being built"""
+    with _updates_lock:
+        if _pending is not None:
+            _pending.append((update, args))
+        index = _index
+    if index is not None:
+        update(index, *args)
+
+
+def _tool_saved(index, tool_id, name, city):
+    with index._lock:
+        previous = index.tool_entries.get(tool_id)
+        weight = previous[2] if previous else 1
+        if previous and previous[:2] == (name, city):
+            return
+        _remove_tool(index, tool_id)
+        _add_tool(index, tool_id, name, city, weight)
+
+
+def _tool_deleted(index, tool_id):
+    with index._lock:
+        _remove_tool(index, tool_id)
+
+
+def _rental_created(index, tool_id):
+    with index._lock:
+        previous = index.tool_entries.get(tool_id)
+        if previous is None:
+            return
+        name, city, weight = previous
+        index.add(TOOL, name)
+        index.tool_entries[tool_id] = (name, city, weight + 1)
+
+
+def tool_saved(tool):
+    """Signal hook: re-index a created or edited tool"""
+    _record(_tool_saved, tool.id, tool.name, tool.pickup_city)
+
+
+def tool_deleted(tool_id):
+    _record(_tool_deleted, tool_id)
+
+
+def rental_created(tool_id):
+    """Signal hook: a new rental makes the tool's name more popular"""
+    _record(_rental_created, tool_id)
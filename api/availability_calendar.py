@@ -0,0 +1,265 @@
+"""
+Server-side merged availability calendar.
+
+The calendar sources (active rentals, availability records, flexible and
+recurring availability, hourly slots) are loaded with one query per table
+for any number of tools and merged into a single status per day or per
+hour. Statuses are ordered by precedence and the strongest one wins:
+
+    available < closed < partial < blocked < booked
+
+``closed`` means outside every active recurring pattern, ``partial`` a day
+with some booked hourly slots, ``blocked`` an owner-declared unavailable
+period. Sequences are returned run-length encoded as ``[status, count]``
+pairs and cached per tool under a version number.
+
+Saving or deleting a source row bumps the tool's version through signals
+once the write commits, so every process using the same cache stops
+serving the old calendars. With the default per-process LocMemCache other
+workers keep theirs for up to CALENDAR_CACHE_TTL; set CACHE_REDIS_URL to
+share one cache. Writes that skip signals (QuerySet.update, bulk_create,
+raw SQL) must call ``bump_version`` for the tools they touch.
+"""
+import math
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from . import db_router
+from .models import RentalTransaction, Availability, FlexibleAvailability, RecurringAvailability, HourlyAvailability
+
+AVAILABLE = 0
+CLOSED = 1
+PARTIAL = 2
+BLOCKED = 3
+BOOKED = 4
+STATUS_NAMES = ['available', 'closed', 'partial', 'blocked', 'booked']
+
+DAY = 'day'
+HOUR = 'hour'
+MAX_DAYS = {DAY: 366, HOUR: 31}
+
+
+def parse_window(start_date, end_date, resolution=DAY):
+    """Validate a calendar window and return it as (date, date)"""
+    if resolution not in MAX_DAYS:
+        raise ValueError('resolution must be "day" or "hour"')
+    start_date = date.fromisoformat(start_date) if isinstance(start_date, str) else start_date
+    end_date = date.fromisoformat(end_date) if isinstance(end_date, str) else end_date
+    if end_date < start_date:
+        raise ValueError('end_date must not be before start_date')
+    if (end_date - start_date).days + 1 > MAX_DAYS[resolution]:
+        raise ValueError(f'{resolution} calendars are limited to {MAX_DAYS[resolution]} days')
+    return start_date, end_date
+
+
+def load_sources(tool_ids, start_date, end_date, resolution=DAY):
+    """
+    Fetch every calendar source for ``tool_ids`` overlapping the window.
+
+    Issues one query per source table regardless of how many tools are
+    asked for and returns ``{tool_id: {source: [rows]}}``.
+    """
+    sources = {tool_id: defaultdict(list) for tool_id in tool_ids}
+
+    rentals = RentalTransaction.objects.filter(
+        tool_id__in=tool_ids,
+        status='active',
+        start_date__lte=end_date,
+        end_date__gte=start_date
+    ).values_list('tool_id', 'start_date', 'end_date', 'start_time', 'end_time')
+    for tool_id, *row in rentals:
+        sources[tool_id]['rentals'].append(row)
+
+    booked_records = Availability.objects.filter(
+        tool_id__in=tool_ids,
+        is_booked=True,
+        start_date__lte=end_date,
+        end_date__gte=start_date
+    ).values_list('tool_id', 'start_date', 'end_date')
+    for tool_id, *row in booked_records:
+        sources[tool_id]['booked'].append(row)
+
+    flexible = FlexibleAvailability.objects.filter(
+        tool_id__in=tool_ids,
+        start_date__lte=end_date,
+        end_date__gte=start_date
+    ).values_list('tool_id', 'start_date', 'end_date', 'is_available')
+    for tool_id, start, end, is_available in flexible:
+        sources[tool_id]['open' if is_available else 'blocked'].append((start, end))
+
+    recurring = RecurringAvailability.objects.filter(
+        Q(end_date__isnull=True) | Q(end_date__gte=start_date),
+        tool_id__in=tool_ids,
+        is_active=True,
+        start_date__lte=end_date
+    ).values_list('tool_id', 'pattern_type', 'start_date', 'end_date', 'days_of_week', 'start_time', 'end_time')
+    for tool_id, *row in recurring:
+        sources[tool_id]['recurring'].append(row)
+
+    hourly = HourlyAvailability.objects.filter(
+        Q(is_booked=True) | Q(is_available=False),
+        tool_id__in=tool_ids,
+        date__range=[start_date, end_date]
+    )
+    if resolution == DAY:
+        # Day views only need per-day totals, so let the database count the slots
+        per_day = hourly.values('tool_id', 'date').annotate(
+            booked=Count('id', filter=Q(is_booked=True)),
+            unavailable=Count('id', filter=Q(is_available=False, is_booked=False))
+        ).order_by()
+        for row in per_day:
+            sources[row['tool_id']]['hourly_days'].append((row['date'], row['booked'], row['unavailable']))
+    else:
+        for tool_id, day, hour, is_booked in hourly.values_list('tool_id', 'date', 'hour', 'is_booked'):
+            sources[tool_id]['hourly'].append((day, hour, is_booked))
+
+    return sources
+
+
+def _paint(codes, start, end, code):
+    """Raise codes[start:end] to ``code`` where it has lower precedence"""
+    for index in range(max(start, 0), min(end, len(codes))):
+        if codes[index] < code:
+            codes[index] = code
+
+
+def _day_span(start_date, range_start, range_end):
+    """Indexes [first, last + 1) of a date range relative to start_date"""
+    return (range_start - start_date).days, (range_end - start_date).days + 1
+
+
+def _recurring_matches(pattern, day):
+    pattern_type, start, end, days_of_week, _, _ = pattern
+    if day < start or (end is not None and day > end):
+        return False
+    return pattern_type == 'daily' or day.weekday() in (days_of_week or [])
+
+
+def day_spans(tool_sources):
+    """
+    (first day, last day, status) for every source that overrides the base
+    calendar at day resolution. This is the one mapping from sources to day
+    statuses; callers raise each span to its status, so the precedence order
+    decides overlaps.
+    """
+    for day, booked, unavailable in tool_sources.get('hourly_days', []):
+        if booked >= 24:
+            yield day, day, BOOKED
+        elif booked:
+            yield day, day, PARTIAL
+        elif unavailable >= 24:
+            yield day, day, BLOCKED
+    for blocked_start, blocked_end in tool_sources.get('blocked', []):
+        yield blocked_start, blocked_end, BLOCKED
+    for booked_start, booked_end in tool_sources.get('booked', []):
+        yield booked_start, booked_end, BOOKED
+    for rental_start, rental_end, _, _ in tool_sources.get('rentals', []):
+        yield rental_start, rental_end, BOOKED
+
+
+def merge_days(tool_sources, start_date, end_date):
+    """One status code per day of the window"""
+    days = (end_date - start_date).days + 1
+    recurring = tool_sources.get('recurring', [])
+    if recurring:
+        codes = [CLOSED] * days
+        for index in range(days):
+            day = start_date + timedelta(days=index)
+            if any(_recurring_matches(pattern, day) for pattern in recurring):
+                codes[index] = AVAILABLE
+        for open_start, open_end in tool_sources.get('open', []):
+            first, last = _day_span(start_date, open_start, open_end)
+            for index in range(max(first, 0), min(last, days)):
+                if codes[index] == CLOSED:
+                    codes[index] = AVAILABLE
+    else:
+        codes = [AVAILABLE] * days
+
+    for range_start, range_end, code in day_spans(tool_sources):
+        _paint(codes, *_day_span(start_date, range_start, range_end), code)
+    return codes
+
+
+def merge_hours(tool_sources, start_date, end_date):
+    """One status code per hour of the window (24 per day)"""
+    days = (end_date - start_date).days + 1
+    recurring = tool_sources.get('recurring', [])
+    if recurring:
+        codes = [CLOSED] * (days * 24)
+        for index in range(days):
+            day = start_date + timedelta(days=index)
+            for pattern in recurring:
+                if _recurring_matches(pattern, day):
+                    start_time, end_time = pattern[4], pattern[5]
+                    first_hour = start_time.hour
+                    last_hour = end_time.hour + (1 if end_time.minute or end_time.second else 0)
+                    for hour in range(first_hour, min(last_hour, 24)):
+                        codes[index * 24 + hour] = AVAILABLE
+        for open_start, open_end in tool_sources.get('open', []):
+            first, last = _day_span(start_date, open_start, open_end)
+            for index in range(max(first, 0) * 24, min(last, days) * 24):
+                if codes[index] == CLOSED:
+                    codes[index] = AVAILABLE
+    else:
+        codes = [AVAILABLE] * (days * 24)
+
+    for day, hour, is_booked in tool_sources.get('hourly', []):
+        index = (day - start_date).days * 24 + hour
+        _paint(codes, index, index + 1, BOOKED if is_booked else BLOCKED)
+    for blocked_start, blocked_end in tool_sources.get('blocked', []):
+        first, last = _day_span(start_date, blocked_start, blocked_end)
+        _paint(codes, first * 24, last * 24, BLOCKED)
+    for booked_start, booked_end in tool_sources.get('booked', []):
+        first, last = _day_span(start_date, booked_start, booked_end)
+        _paint(codes, first * 24, last * 24, BOOKED)
+    for rental_start, rental_end, start_time, end_time in tool_sources.get('rentals', []):
+        first, last = _day_span(start_date, rental_start, rental_end)
+        first_hour = first * 24 + (start_time.hour if start_time else 0)
+        last_hour = last * 24
+        if end_time:
+            last_hour = (last - 1) * 24 + min(24, math.ceil(end_time.hour + end_time.minute / 60))
+        _paint(codes, first_hour, last_hour, BOOKED)
+    return codes
+
+
+def run_length_encode(codes):
+    """Collapse a status sequence into [[status name, run length], ...]"""
+    runs = []
+    previous = None
+    for code in codes:
+        if code == previous:
+            runs[-1][1] += 1
+        else:
+            runs.append([STATUS_NAMES[code], 1])
+            previous = code
+    return runs
+
+
+def _version_key(tool_id):
+    return f'calendar-version:{tool_id}'
+
+
+def bump_version(tool_id):
+    """Invalidate every cached calendar of a tool"""
+    try:
+        cache.incr(_version_key(tool_id))
+    except ValueError:
+        cache.set(_version_key(tool_id), 1, None)
+
+
+def get_status_calendar(tool_id, start_date, end_date, resolution=DAY):
+    """Merged, run-length encoded calendar for one tool, cached per source version"""
+    start_date, end_date = parse_window(start_date, end_date, resolution)
+    version = cache.get(_version_key(tool_id), 0)
+    key = f'calendar:{tool_id}:{version}:{resolution}:{start_date.isoformat()}:{end_date.isoformat()}'
+    runs = None if db_router.fresh_reads() else cache.get(key)
+    if runs is None:
+        tool_sources = load_sources([tool_id], start_date, end_date, resolution)[tool_id]
+        merge = merge_days if resolution == DAY else merge_hours
+        runs = run_length_encode(merge(tool_sources, start_date, end_date))
+        cache.set(key, runs, getattr(settings, 'CALENDAR_CACHE_TTL', 300))
+    return runs
@@ -0,0 +1,108 @@
+"""
+Primary/replica routing with read-your-writes stickiness.
+
+Writes always go to ``default``. Reads go to the ``replica`` alias only while
+a view marked with ``@replica_reads`` handles a GET/HEAD request, so booking,
+payment and approval paths never see replica lag. Everything else, including
+reads inside a transaction on the primary, stays on ``default``.
+
+After a request writes (or uses an unsafe method), ReplicaMiddleware sets a
+short-lived cookie so the same client reads from the primary for the next
+REPLICA_STICKY_SECONDS and sees its own changes. A write in the middle of a
+replica-routed request pins the rest of that request to the primary too.
+
+Cached results (calendars, facets, tool cards, near-me candidates) may have
+been computed from the lagging replica, so while a request is pinned
+``fresh_reads()`` is true: those caches skip their lookup, read the primary
+and store the fresh result for everyone else.
+
+Without a ``replica`` entry in DATABASES the router is a no-op.
+"""
+import contextvars
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_ALIAS = 'replica'
+PIN_COOKIE = 'db_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Per-request routing state: whether reads may use the replica, and whether anything was written
+_use_replica = contextvars.ContextVar('use_replica', default=False)
+_wrote = contextvars.ContextVar('wrote', default=False)
+_pinned = contextvars.ContextVar('pinned', default=False)
+
+
+def replica_available():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+def fresh_reads():
+    """True while the current request must see its own writes and so must not trust cached reads"""
+    return (_pinned.get() or _wrote.get()) and replica_available()
+
+
+def replica_reads(view):
+    """Mark a read-heavy view (function or view class) as safe to serve from the replica"""
+    view.replica_reads = True
+    return view
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not _use_replica.get() or _wrote.get():
+            return None
+        # select_for_update and reads that follow writes in a transaction must see the primary
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return REPLICA_ALIAS
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica's schema arrives through replication
+        return db != REPLICA_ALIAS
+
+
+class ReplicaMiddleware:
+    """Enable replica reads for marked views and pin recent writers to the primary"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        use_token = _use_replica.set(False)
+        wrote_token = _wrote.set(False)
+        pinned_token = _pinned.set(self.pinned(request))
+        try:
+            response = self.get_response(request)
+            wrote = _wrote.get() or request.method not in SAFE_METHODS
+        finally:
+            _use_replica.reset(use_token)
+            _wrote.reset(wrote_token)
+            _pinned.reset(pinned_token)
+        if wrote and replica_available():
+            sticky = settings.REPLICA_STICKY_SECONDS
+            response.set_cookie(PIN_COOKIE, str(int(time.time()) + sticky), max_age=sticky, httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in ('GET', 'HEAD') or not replica_available() or _pinned.get():
+            return None
+        view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+        if getattr(view_func, 'replica_reads', False) or getattr(view_class, 'replica_reads', False):
+            _use_replica.set(True)
+        return None
+
+    def pinned(self, request):
+        try:
+            return int(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
@@ -0,0 +1,68 @@
+"""
+Dispute moderation queue and dispute message threads.
+
+Both lists are keyset-paginated newest first (api.pagination) and projected
+with ``values()``: the initiator's username and the sender's username come
+from a JOIN in the same query instead of a lazy load per row. A page
+therefore costs one query however large the backlog is. The
+idx_dispute_status_created, idx_dispute_created and idx_dispute_msg_thread
+indexes keep the filtered orderings to range scans.
+"""
+from django.db.models import F, Q
+
+from .models import Dispute, DisputeMessage
+from .pagination import DEFAULT_PAGE_SIZE, keyset_page
+
+LIST_FIELDS = ['id', 'title', 'dispute_type', 'status', 'created_at', 'resolved_at']
+MESSAGE_FIELDS = ['id', 'sender_id', 'message', 'attachments', 'created_at']
+
+STATUSES = {value for value, _ in Dispute.DISPUTE_STATUS_CHOICES}
+TYPES = {value for value, _ in Dispute.DISPUTE_TYPE_CHOICES}
+
+
+def _choices(raw, allowed, name):
+    values = [value.strip() for value in raw.split(',') if value.strip()]
+    unknown = [value for value in values if value not in allowed]
+    if unknown:
+        raise ValueError(f'Unknown {name}: {", ".join(unknown)}')
+    return values
+
+
+def filtered(status='', dispute_type='', user_id=None):
+    """
+    Disputes matching comma-separated ``status`` and ``dispute_type`` lists
+    and, with ``user_id``, those the user opened or is a party to
+    """
+    disputes = Dispute.objects.all()
+    statuses = _choices(status or '', STATUSES, 'status')
+    if statuses:
+        disputes = disputes.filter(status__in=statuses)
+    types = _choices(dispute_type or '', TYPES, 'dispute_type')
+    if types:
+        disputes = disputes.filter(dispute_type__in=types)
+    if user_id not in (None, ''):
+        user_id = int(user_id)
+        disputes = disputes.filter(
+            Q(initiator_id=user_id)
+            | Q(rental_transaction__owner_id=user_id)
+            | Q(rental_transaction__borrower_id=user_id)
+        )
+    return disputes
+
+
+def dispute_page(status='', dispute_type='', user_id=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """One page of matching disputes as dicts, with the cursor for the next page"""
+    rows = filtered(status, dispute_type, user_id).values(
+        *LIST_FIELDS,
+        initiator_username=F('initiator__username'),
+        rental_id=F('rental_transaction_id'),
+    )
+    return keyset_page(rows, cursor, limit)
+
+
+def message_page(dispute_id, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """One page of a dispute's messages as dicts, newest first"""
+    rows = DisputeMessage.objects.filter(dispute_id=dispute_id).values(
+        *MESSAGE_FIELDS, sender_username=F('sender__username'),
+    )
+    return keyset_page(rows, cursor, limit)
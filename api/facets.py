@@ -0,0 +1,124 @@
+"""
+Facet counts for tool search filter chips.
+
+All four facets (pricing type, price bucket, pickup city, delivery) come out
+of one GROUP BY over the filtered tool set and are rolled up in Python, so
+the frontend gets every chip count from a single query. Results are cached
+per normalized filter set for TOOL_FACETS_CACHE_TTL seconds.
+"""
+import hashlib
+import json
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, CharField, Count, Value, When
+
+from .models import Tool
+from . import db_router, search
+
+# (label, lower bound inclusive, upper bound exclusive) on price_per_day
+PRICE_BUCKETS = [
+    ('0-10', 0, 10),
+    ('10-25', 10, 25),
+    ('25-50', 25, 50),
+    ('50-100', 50, 100),
+    ('100+', 100, None),
+]
+UNPRICED = 'unpriced'
+
+FILTER_NAMES = ['q', 'lat', 'lng', 'radius', 'start_date', 'end_date', 'pricing_type', 'max_price', 'min_rating']
+NUMERIC_FILTERS = {'lat', 'lng', 'radius', 'max_price', 'min_rating'}
+DATE_FILTERS = {'start_date', 'end_date'}
+
+
+def normalize_filters(filters):
+    """Drop empty values and canonicalize the rest so equivalent requests share a cache key"""
+    normalized = {}
+    for name in FILTER_NAMES:
+        value = filters.get(name)
+        if value in (None, ''):
+            continue
+        if name in NUMERIC_FILTERS:
+            normalized[name] = '%.5f' % float(value)
+        elif name in DATE_FILTERS:
+            try:
+                normalized[name] = date.fromisoformat(str(value).strip()).isoformat()
+            except ValueError:
+                raise ValueError(f'{name} must be a date in YYYY-MM-DD format')
+        elif name == 'q':
+            tokens = search.tokenize(value)
+            if tokens:
+                normalized[name] = ' '.join(tokens)
+        else:
+            normalized[name] = str(value).strip().lower()
+    return normalized
+
+
+def cache_key(normalized):
+    digest = hashlib.sha1(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+    return f'tool-facets:{digest}'
+
+
+def _price_bucket_expression():
+    whens = [When(price_per_day__isnull=True, then=Value(UNPRICED))]
+    for label, _, upper in PRICE_BUCKETS:
+        if upper is not None:
+            whens.append(When(price_per_day__lt=upper, then=Value(label)))
+    return Case(*whens, default=Value(PRICE_BUCKETS[-1][0]), output_field=CharField())
+
+
+def compute_facets(normalized):
+    """Run the grouped aggregate for a normalized filter set"""
+    tools = search.filter_tools(
+        Tool.objects.filter(available=True),
+        lat=normalized.get('lat'),
+        lng=normalized.get('lng'),
+        radius=float(normalized.get('radius', 10)),
+        start_date=normalized.get('start_date'),
+        end_date=normalized.get('end_date'),
+        pricing_type=normalized.get('pricing_type'),
+        max_price=float(normalized['max_price']) if 'max_price' in normalized else None,
+        min_rating=float(normalized['min_rating']) if 'min_rating' in normalized else None,
+    )
+    if 'q' in normalized:
+        if not search.is_supported():
+            raise ValueError('Full-text search is not available on this database')
+        tools = search.apply_text_match(tools, normalized['q'].split(' '))
+
+    rows = (
+        tools.annotate(price_bucket=_price_bucket_expression())
+        .values('pricing_type', 'price_bucket', 'pickup_city', 'delivery_available')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+
+    facets = {
+        'pricing_type': {},
+        'price_bucket': {label: 0 for label, _, _ in PRICE_BUCKETS},
+        'pickup_city': {},
+        'delivery_available': {'true': 0, 'false': 0},
+    }
+    total = 0
+    for row in rows:
+        count = row['count']
+        total += count
+        facets['pricing_type'][row['pricing_type']] = facets['pricing_type'].get(row['pricing_type'], 0) + count
+        facets['price_bucket'][row['price_bucket']] = facets['price_bucket'].get(row['price_bucket'], 0) + count
+        city = row['pickup_city'] or ''
+        facets['pickup_city'][city] = facets['pickup_city'].get(city, 0) + count
+        facets['delivery_available']['true' if row['delivery_available'] else 'false'] += count
+
+    facets['pickup_city'] = dict(sorted(facets['pickup_city'].items(), key=lambda item: (-item[1], item[0])))
+    return {'total': total, 'facets': facets}
+
+
+def get_facets(filters):
+    """Return facet counts for ``filters``, served from cache when fresh"""
+    normalized = normalize_filters(filters)
+    key = cache_key(normalized)
+    result = None if db_router.fresh_reads() else cache.get(key)
+    if result is None:
+        result = compute_facets(normalized)
+        cache.set(key, result, getattr(settings, 'TOOL_FACETS_CACHE_TTL', 60))
+    return result
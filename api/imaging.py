@@ -0,0 +1,55 @@
+"""
+Image resizing for api.thumbnails.
+
+Pool workers run ``render``. It takes and returns bytes and imports nothing
+from Django, so a freshly spawned worker can import it without settings or
+app setup. Storage reads and writes stay in the parent process.
+"""
+import io
+
+from PIL import Image, ImageOps
+
+# Format name -> (Pillow format, save options, file extension)
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}, 'webp'),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}, 'jpg'),
+}
+
+
+def _flatten(image):
+    """RGB copy of ``image``, with any transparency composited onto white"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render(source, sizes):
+    """
+    Resize image bytes to every size in ``sizes`` ({name: (width, height, crop)})
+    and encode each in every format. Returns {name: {format: bytes}}.
+
+    ``crop`` sizes are filled exactly (center crop, as for cards and avatars);
+    the others fit inside the box. Images are never scaled up.
+    """
+    longest = max(max(width, height) for width, height, _ in sizes.values())
+    with Image.open(io.BytesIO(source)) as original:
+        # JPEGs decode straight at a reduced scale, much cheaper than a full-size decode
+        original.draft('RGB', (longest, longest))
+        image = _flatten(ImageOps.exif_transpose(original))
+
+    rendered = {}
+    for name, (width, height, crop) in sizes.items():
+        if crop and image.width >= width and image.height >= height:
+            resized = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        else:
+            resized = image.copy()
+            resized.thumbnail((width, height), Image.LANCZOS)
+        rendered[name] = {}
+        for format_name, (pil_format, options, _) in FORMATS.items():
+            buffer = io.BytesIO()
+            resized.save(buffer, pil_format, **options)
+            rendered[name][format_name] = buffer.getvalue()
+    return rendered
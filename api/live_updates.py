@@ -0,0 +1,267 @@
+"""
+Live availability deltas for Server-Sent Events subscribers.
+
+Signals on rentals, borrow requests and the availability tables call
+``publish`` once the writing transaction commits. The in-process Broker
+hands each event to the SSE streams subscribed to that tool: every
+subscriber owns an asyncio queue on its server event loop, and delivery
+crosses from the request thread with ``call_soon_threadsafe``, so
+publishing never blocks a writer.
+
+With several worker processes, set LIVE_UPDATES_REDIS_URL. Events are then
+published to a Redis channel, and a listener thread in every process feeds
+them to its local broker. Redis is imported only when configured.
+
+Event ids are ``<process boot id>-<sequence>``. A reconnecting client that
+sends Last-Event-ID gets the missed events replayed from a short in-memory
+history. When those events are gone (another process, or too far behind),
+it gets a ``resync`` event and should refetch the calendar once.
+"""
+import asyncio
+import json
+import logging
+import threading
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+logger = logging.getLogger(__name__)
+
+# Fields copied into a delta when the changed model has them
+DELTA_FIELDS = ['status', 'start_date', 'end_date', 'start_time', 'end_time', 'date', 'hour', 'is_available', 'is_booked']
+
+
+def build_delta(instance, action):
+    """Availability delta for a saved or deleted row, or None when the row has no tool"""
+    # Only read loaded values: touching a deferred field after a delete would query a missing row
+    loaded = vars(instance)
+    tool_id = loaded.get('tool_id')
+    if tool_id is None:
+        return None
+    delta = {
+        'tool_id': tool_id,
+        'source': instance._meta.model_name,
+        'action': action,
+        'id': instance.pk,
+    }
+    for field in DELTA_FIELDS:
+        if field in loaded:
+            delta[field] = loaded[field]
+    return json.loads(json.dumps(delta, cls=DjangoJSONEncoder))
+
+
+class Subscription:
+    def __init__(self, broker, tool_ids, loop, maxsize):
+        self.broker = broker
+        self.tool_ids = frozenset(tool_ids)
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def deliver(self, event):
+        # Runs on the subscriber's loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too slow to keep up: stop queueing and tell the client to resync once
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self, timeout):
+        """Next event, None after an overflow, or raises asyncio.TimeoutError"""
+        event = await asyncio.wait_for(self.queue.get(), timeout)
+        if event is None:
+            self.overflowed = False
+        return event
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    """Per-process fan-out of tool events to SSE subscriptions"""
+
+    def __init__(self, history_size=1000):
+        self.boot_id = uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+        self._by_tool = {}
+        self._sequence = 0
+        self._history = deque(maxlen=history_size)
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self, tool_ids, loop=None, maxsize=None):
+        subscription = Subscription(
+            self, tool_ids, loop or asyncio.get_running_loop(),
+            maxsize or settings.LIVE_UPDATES_QUEUE_SIZE,
+        )
+        with self._lock:
+            for tool_id in subscription.tool_ids:
+                self._by_tool.setdefault(tool_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for tool_id in subscription.tool_ids:
+                subscribers = self._by_tool.get(tool_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._by_tool[tool_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({subscription for subscribers in self._by_tool.values() for subscription in subscribers})
+
+    def event_id(self, sequence):
+        return f'{self.boot_id}-{sequence}'
+
+    def current_event_id(self):
+        return self.event_id(self._sequence)
+
+    def dispatch(self, delta):
+        """Number an event and hand it to every local subscriber of its tool"""
+        with self._lock:
+            self._sequence += 1
+            self._history.append((self._sequence, delta))
+            event = (self.event_id(self._sequence), delta)
+            subscribers = list(self._by_tool.get(delta['tool_id'], ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+                self.delivered += 1
+            except RuntimeError:
+                # The subscriber's loop has shut down
+                self.unsubscribe(subscription)
+                self.dropped += 1
+
+    def replay(self, last_event_id, tool_ids):
+        """
+        Events after ``last_event_id`` for ``tool_ids``, or None when they
+        cannot be recovered and the client must resync
+        """
+        boot_id, _, sequence = (last_event_id or '').rpartition('-')
+        if boot_id != self.boot_id or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        with self._lock:
+            history = list(self._history)
+            current = self._sequence
+        oldest = history[0][0] if history else current + 1
+        if sequence > current or sequence + 1 < oldest:
+            return None
+        return [
+            (self.event_id(number), delta) for number, delta in history
+            if number > sequence and delta['tool_id'] in tool_ids
+        ]
+
+
+class RedisBackend:
+    """Relay events through a Redis channel so every worker process sees them"""
+
+    def __init__(self, broker, url, channel):
+        import redis
+
+        self.broker = broker
+        self.channel = channel
+        self.client = redis.Redis.from_url(url)
+        self._listener = None
+        self._start_lock = threading.Lock()
+
+    def publish(self, delta):
+        self.ensure_listening()
+        self.client.publish(self.channel, json.dumps(delta))
+
+    def ensure_listening(self):
+        if self._listener is not None and self._listener.is_alive():
+            return
+        with self._start_lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='live-updates-redis', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        try:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(self.channel)
+            for message in pubsub.listen():
+                try:
+                    self.broker.dispatch(json.loads(message['data']))
+                except (ValueError, KeyError, TypeError):
+                    logger.warning('Ignoring malformed live update from Redis')
+        except Exception:
+            # The next publish or subscribe starts a new listener
+            logger.exception('Redis live update listener stopped')
+
+
+broker = Broker()
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def backend():
+    """The Redis relay when LIVE_UPDATES_REDIS_URL is set, else None (events stay in-process)"""
+    global _backend
+    if not settings.LIVE_UPDATES_REDIS_URL:
+        return None
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = RedisBackend(broker, settings.LIVE_UPDATES_REDIS_URL, settings.LIVE_UPDATES_REDIS_CHANNEL)
+    return _backend
+
+
+def publish(delta):
+    relay = backend()
+    if relay is None:
+        broker.dispatch(delta)
+        return
+    try:
+        relay.publish(delta)
+    except Exception:
+        # Other workers miss this event; at least this process's clients still get it
+        logger.warning('Redis publish failed; delivering live update locally only', exc_info=True)
+        broker.dispatch(delta)
+
+
+def subscribe(tool_ids):
+    relay = backend()
+    if relay is not None:
+        relay.ensure_listening()
+    return broker.subscribe(tool_ids)
+
+
+def format_event(event_id, delta, event='availability'):
+    return f'id: {event_id}\nevent: {event}\ndata: {json.dumps(delta)}\n\n'
+
+
+async def stream(tool_ids, last_event_id=None):
+    """SSE body for a subscription to ``tool_ids``; runs until the client disconnects"""
+    subscription = subscribe(tool_ids)
+    try:
+        yield f'retry: {settings.LIVE_UPDATES_RETRY_MS}\n\n'
+        if last_event_id:
+            missed = broker.replay(last_event_id, subscription.tool_ids)
+            if missed is None:
+                yield format_event(last_event_id, {'tool_ids': sorted(tool_ids)}, event='resync')
+            else:
+                for event_id, delta in missed:
+                    yield format_event(event_id, delta)
+        while True:
+            try:
+                event = await subscription.get(settings.LIVE_UPDATES_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if event is None:
+                yield format_event(broker.current_event_id(), {'tool_ids': sorted(tool_ids)}, event='resync')
+            else:
+                yield format_event(*event)
+    finally:
+        subscription.close()
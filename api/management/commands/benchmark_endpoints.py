@@ -0,0 +1,242 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import Client
+from django.utils import timezone
+from api.models import UserProfile, Tool, RentalTransaction, BorrowRequest, Deposit
+from api.metrics import QueryTimer
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import date, timedelta
+import json
+import math
+import random
+import subprocess
+import threading
+import time
+
+# Hot endpoints, in report order: name -> (method, needs the benchmark owner logged in)
+ENDPOINTS = {
+    'near_location': ('GET', False),
+    'search': ('GET', False),
+    'availability_conflict': ('POST', False),
+    'advanced_availability_conflict': ('POST', False),
+    'calendar_status': ('GET', False),
+    'approve_borrow_request': ('POST', True),
+    'deposit_payment': ('POST', False),
+}
+# The test client's default host (testserver) is not in ALLOWED_HOSTS and would get 400 on every request
+CLIENT_HOST = 'localhost'
+SEARCH_TERMS = ['drill', 'saw', 'ladder', 'mower', 'sander', 'pressure washer', 'generator', 'cordless drill']
+
+class Command(BaseCommand):
+    help = 'Benchmark the hot API endpoints in-process and report latency percentiles, throughput and query counts as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per endpoint before timing')
+        parser.add_argument('--concurrency', type=int, default=4, help='Threads issuing requests')
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='Comma-separated subset of endpoints to run')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for request parameters')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stderr')
+        parser.add_argument('--baseline', help='Earlier JSON report to print p50/p95/p99 changes against')
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['endpoints'].split(',') if name.strip()]
+        unknown = [name for name in names if name not in ENDPOINTS]
+        if unknown:
+            self.stderr.write(self.style.ERROR(f'Unknown endpoints: {", ".join(unknown)}'))
+            return
+
+        sample = list(Tool.objects.filter(latitude__isnull=False).order_by('id').values_list('id', 'latitude', 'longitude')[:5000])
+        if not sample:
+            self.stderr.write(self.style.ERROR('No tools with coordinates; run generate_dataset first'))
+            return
+
+        rng = random.Random(options['seed'])
+        per_endpoint = options['warmup'] + options['requests']
+        fixtures = self.create_fixtures(per_endpoint)
+        try:
+            results = {}
+            for name in names:
+                plan = [self.build_request(name, rng, sample, fixtures, index) for index in range(per_endpoint)]
+                self.stderr.write(f'Benchmarking {name}...')
+                results[name] = self.run_endpoint(name, plan, options)
+                if results[name]['errors']:
+                    self.stderr.write(self.style.WARNING(
+                        f'{name}: {results[name]["errors"]} of {results[name]["requests"]} requests failed ({results[name]["statuses"]})'
+                    ))
+        finally:
+            self.remove_fixtures(fixtures)
+
+        report = {
+            'commit': self.git_commit(),
+            'database': connection.vendor,
+            'dataset': {
+                'users': UserProfile.objects.count(),
+                'tools': Tool.objects.count(),
+                'rentals': RentalTransaction.objects.count(),
+            },
+            'settings': {key: options[key] for key in ('requests', 'warmup', 'concurrency', 'seed')},
+            'endpoints': results,
+        }
+        rendered = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(rendered + '\n')
+            self.stderr.write(self.style.SUCCESS(f'Report written to {options["output"]}'))
+        else:
+            # stdout carries the JSON request log lines, which would interleave with the report
+            self.stderr.write(rendered)
+
+        if options['baseline']:
+            self.compare(report, options['baseline'])
+
+    def create_fixtures(self, count):
+        """Private owner, tool, pending borrow requests and deposits for the endpoints that write"""
+        owner, _ = UserProfile.objects.get_or_create(
+            username='benchmark_owner',
+            defaults={'email': 'benchmark_owner@example.com', 'is_owner': True}
+        )
+        borrower, _ = UserProfile.objects.get_or_create(
+            username='benchmark_borrower',
+            defaults={'email': 'benchmark_borrower@example.com'}
+        )
+        tool = Tool.objects.create(
+            name='Benchmark fixture tool', description='Created by benchmark_endpoints and removed afterwards',
+            pricing_type='daily', price_per_day=20, owner=owner, available=True
+        )
+        today = date.today()
+        expires_at = timezone.now() + timedelta(days=1)
+        requests = BorrowRequest.objects.bulk_create([
+            BorrowRequest(
+                tool=tool, borrower=borrower, owner=owner, expires_at=expires_at,
+                start_date=today + timedelta(days=index), end_date=today + timedelta(days=index + 2)
+            )
+            for index in range(count)
+        ])
+        rental = RentalTransaction.objects.create(
+            tool=tool, borrower=borrower, owner=owner, start_date=today, end_date=today, status='completed'
+        )
+        deposits = Deposit.objects.bulk_create([Deposit(rental_transaction=rental) for _ in range(count)])
+        return {
+            'owner': owner,
+            'tool': tool,
+            'borrow_requests': [borrow_request.pk for borrow_request in requests],
+            'deposits': [deposit.pk for deposit in deposits],
+        }
+
+    def remove_fixtures(self, fixtures):
+        # Deleting the tool cascades to its requests, the rentals approval created and their deposits
+        Tool.objects.filter(pk=fixtures['tool'].pk).delete()
+
+    def build_request(self, name, rng, sample, fixtures, index):
+        """(method path, payload) for request ``index`` of an endpoint"""
+        tool_id, lat, lng = rng.choice(sample)
+        start = date.today() + timedelta(days=rng.randint(0, 60))
+        end = start + timedelta(days=rng.randint(1, 7))
+        if name == 'near_location':
+            return f'/api/tools/near-location/?lat={lat}&lng={lng}&radius=5', None
+        if name == 'search':
+            return f'/api/tools/search/?q={rng.choice(SEARCH_TERMS)}&lat={lat}&lng={lng}&radius=10', None
+        if name == 'availability_conflict':
+            return '/api/check-availability-conflict/', {
+                'tool_id': tool_id, 'start_date': start.isoformat(), 'end_date': end.isoformat()
+            }
+        if name == 'advanced_availability_conflict':
+            return '/api/check-advanced-availability-conflict/', {
+                'tool_id': tool_id, 'start_date': start.isoformat(), 'end_date': start.isoformat(),
+                'start_time': '09:00', 'end_time': '13:00'
+            }
+        if name == 'calendar_status':
+            return f'/api/tools/{tool_id}/calendar-status/?start_date={start.isoformat()}&end_date={(start + timedelta(days=30)).isoformat()}', None
+        if name == 'approve_borrow_request':
+            return f'/api/borrow-requests/{fixtures["borrow_requests"][index]}/approve/', {'owner_response': 'Benchmark approval'}
+        return f'/api/deposits/{fixtures["deposits"][index]}/process-payment/', {'processed_by': 'benchmark'}
+
+    def run_endpoint(self, name, plan, options):
+        method, authenticated = ENDPOINTS[name]
+        state = threading.local()
+        owner = UserProfile.objects.get(username='benchmark_owner')
+
+        def issue(request):
+            path, payload = request
+            if not hasattr(state, 'client'):
+                state.client = Client(HTTP_HOST=CLIENT_HOST)
+                if authenticated:
+                    state.client.force_login(owner)
+            timer = QueryTimer(slow_seconds=math.inf)
+            started = time.perf_counter()
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(timer))
+                if method == 'GET':
+                    response = state.client.get(path)
+                else:
+                    response = state.client.post(path, payload, content_type='application/json')
+            return time.perf_counter() - started, timer.count, response.status_code
+
+        def close_connections(_):
+            connections.close_all()
+
+        warmup, measured = plan[:options['warmup']], plan[options['warmup']:]
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            list(pool.map(issue, warmup))
+            started = time.perf_counter()
+            samples = list(pool.map(issue, measured))
+            elapsed = time.perf_counter() - started
+            list(pool.map(close_connections, range(options['concurrency'])))
+
+        latencies = sorted(sample[0] * 1000 for sample in samples)
+        queries = sorted(sample[1] for sample in samples)
+        statuses = {}
+        for _, _, status in samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return {
+            'requests': len(samples),
+            'errors': sum(1 for _, _, status in samples if status >= 400),
+            'statuses': statuses,
+            'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+            'latency_ms': {
+                'mean': round(sum(latencies) / len(latencies), 2),
+                'p50': round(percentile(latencies, 50), 2),
+                'p95': round(percentile(latencies, 95), 2),
+                'p99': round(percentile(latencies, 99), 2),
+                'max': round(latencies[-1], 2),
+            },
+            'queries': {
+                'mean': round(sum(queries) / len(queries), 2),
+                'p50': percentile(queries, 50),
+                'max': queries[-1],
+            },
+        }
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def compare(self, report, baseline_path):
+        with open(baseline_path) as handle:
+            baseline = json.load(handle)
+        self.stderr.write(f'\nChange vs {baseline_path} (commit {baseline.get("commit")}):')
+        for name, result in report['endpoints'].items():
+            previous = baseline.get('endpoints', {}).get(name)
+            if not previous:
+                self.stderr.write(f'{name:<32} (not in baseline)')
+                continue
+            changes = []
+            for key in ('p50', 'p95', 'p99'):
+                before, after = previous['latency_ms'][key], result['latency_ms'][key]
+                changes.append(f'{key} {before:8.2f} -> {after:8.2f}ms ({(after - before) / before * 100 if before else 0:+6.1f}%)')
+            changes.append(f'queries {previous["queries"]["mean"]} -> {result["queries"]["mean"]}')
+            self.stderr.write(f'{name:<32} ' + '  '.join(changes))
+
+
+def percentile(ordered, percent):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
@@ -0,0 +1,110 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, RequestFactory
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from api import availability_calendar, renderers, search
+from api.models import Tool
+from api.serializers import ToolSerializer
+from datetime import date, timedelta
+import io
+import json
+import statistics
+import time
+
+# The test client's default host (testserver) is not in ALLOWED_HOSTS and would get 400 on every request
+CLIENT_HOST = 'localhost'
+
+
+class Command(BaseCommand):
+    help = 'Compare DRF\'s stdlib JSON renderer/parser with the orjson ones on calendar and search payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tools', type=int, default=5, help='Tools whose calendars are rendered')
+        parser.add_argument('--days', type=int, default=365, help='Calendar range in days')
+        parser.add_argument('--page-size', type=int, default=50, help='Results in the search payload')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed renders and parses per payload')
+
+    def handle(self, *args, **options):
+        if renderers.orjson is None:
+            self.stdout.write(self.style.WARNING('orjson is not installed; the fast classes fall back to the stdlib ones'))
+
+        payloads = self.calendar_payloads(options) + [self.search_payload(options)]
+        if not any(data for _, data in payloads):
+            self.stdout.write(self.style.ERROR('No tools found; run generate_dataset first'))
+            return
+
+        self.stdout.write('=' * 50)
+        self.stdout.write(f'{"payload":<28}{"KB":>8}  {"render":<24}{"parse":<24}')
+        mismatches = 0
+        for name, data in payloads:
+            if data is None:
+                continue
+            stock = JSONRenderer().render(data)
+            fast = renderers.FastJSONRenderer().render(data)
+            if stock != fast:
+                if json.loads(stock) != json.loads(fast):
+                    self.stdout.write(self.style.ERROR(f'{name}: fast renderer output differs from JSONRenderer'))
+                    mismatches += 1
+                    continue
+            render = [self.time_op(lambda: cls().render(data), options['iterations']) for cls in (JSONRenderer, renderers.FastJSONRenderer)]
+            parse = [self.time_op(lambda: cls().parse(io.BytesIO(stock)), options['iterations']) for cls in (JSONParser, renderers.FastJSONParser)]
+            self.stdout.write(
+                f'{name:<28}{len(stock) / 1024:>8.1f}  '
+                f'{self.speedup(*render):<24}{self.speedup(*parse):<24}'
+            )
+        self.stdout.write('=' * 50)
+        self.stdout.write('Times are median milliseconds: stdlib -> orjson (speedup)')
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f'{mismatches} payloads rendered differently'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Every payload rendered to the same JSON values'))
+
+    def calendar_payloads(self, options):
+        """response.data of both calendar endpoints for the first few tools"""
+        client = Client(HTTP_HOST=CLIENT_HOST)
+        start = date.today()
+        days = min(options['days'], availability_calendar.MAX_DAYS[availability_calendar.DAY])
+        hours = min(days, availability_calendar.MAX_DAYS[availability_calendar.HOUR])
+        payloads = []
+        for tool_id in Tool.objects.order_by('id').values_list('id', flat=True)[:options['tools']]:
+            path = f'/api/tools/{tool_id}/calendar-%s/?start_date={start.isoformat()}&end_date=%s'
+            for name, url in (
+                ('calendar_availability', path % ('availability', start + timedelta(days=days - 1))),
+                ('calendar_status', path % ('status', start + timedelta(days=days - 1))),
+                ('calendar_status_hourly', path % ('status', start + timedelta(days=hours - 1)) + '&resolution=hour'),
+            ):
+                payloads.append((f'{name}[{tool_id}]', self.fetch(client, url)))
+        return payloads
+
+    def search_payload(self, options):
+        """response.data of a search page, or the same shape built from plain tools when full-text search is unsupported or finds nothing"""
+        if search.is_supported():
+            data = self.fetch(Client(HTTP_HOST=CLIENT_HOST), f'/api/tools/search/?q=drill&page_size={options["page_size"]}')
+            if data['results']:
+                return 'search', data
+        request = RequestFactory().get('/api/tools/search/')
+        tools = Tool.objects.select_related('owner').order_by('id')[:options['page_size']]
+        results = [
+            {'tool': ToolSerializer(tool, context={'request': request}).data, 'rank': 0.5, 'distance': None, 'quote': None}
+            for tool in tools
+        ]
+        return 'search_shaped', {'query': 'drill', 'results': results, 'total': len(results), 'page': 1, 'page_size': len(results)} if results else None
+
+    def fetch(self, client, url):
+        """response.data of a GET, failing rather than benchmarking without the payload"""
+        response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f'GET {url} returned {response.status_code}: {response.content[:200]!r}')
+        return response.data
+
+    def time_op(self, op, iterations):
+        op()
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            op()
+            samples.append(time.perf_counter() - started)
+        return statistics.median(samples) * 1000
+
+    def speedup(self, stock_ms, fast_ms):
+        return f'{stock_ms:.3f} -> {fast_ms:.3f} ({stock_ms / fast_ms:.1f}x)'
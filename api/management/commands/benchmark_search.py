@@ -0,0 +1,99 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from api.models import UserProfile, Tool
+from api import search
+from datetime import date, timedelta
+import random
+import statistics
+import time
+
+TOOL_KINDS = ['drill', 'saw', 'ladder', 'mower', 'sander', 'grinder', 'hammer', 'wrench',
+              'pressure washer', 'trimmer', 'compressor', 'generator', 'tile cutter', 'router',
+              'nail gun', 'leaf blower', 'chainsaw', 'shop vac', 'jigsaw', 'welder']
+ADJECTIVES = ['cordless', 'electric', 'gas', 'heavy duty', 'compact', 'professional',
+              'aluminum', 'rotary', 'orbital', 'hydraulic', 'portable', 'industrial']
+BRANDS = ['DeWalt', 'Makita', 'Bosch', 'Ryobi', 'Milwaukee', 'Craftsman', 'Honda', 'Stihl']
+# (lat, lng) of a few metro areas so location filters see realistic density
+CITIES = [(30.2672, -97.7431), (29.8833, -97.9414), (29.4241, -98.4936), (32.7767, -96.7970)]
+
+class RollbackBenchmark(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = 'Benchmark full-text tool search latency against a synthetic catalogue (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tools', type=int, default=100000, help='Number of synthetic tools to create')
+        parser.add_argument('--queries', type=int, default=200, help='Number of searches per scenario')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the dataset and queries')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic tools instead of rolling back')
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            self.stdout.write(self.style.ERROR(f'Full-text search is not supported on {connection.vendor}'))
+            return
+
+        try:
+            with transaction.atomic():
+                self.run(options)
+                if not options['keep']:
+                    raise RollbackBenchmark()
+        except RollbackBenchmark:
+            self.stdout.write('Synthetic data rolled back.')
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        owner, _ = UserProfile.objects.get_or_create(
+            username='benchmark_owner',
+            defaults={'email': 'benchmark_owner@example.com', 'is_owner': True}
+        )
+
+        self.stdout.write(f'Creating {options["tools"]} synthetic tools...')
+        started = time.perf_counter()
+        batch = []
+        for _ in range(options['tools']):
+            kind = rng.choice(TOOL_KINDS)
+            city_lat, city_lng = rng.choice(CITIES)
+            batch.append(Tool(
+                name=f'{rng.choice(BRANDS)} {rng.choice(ADJECTIVES)} {kind}',
+                description=f'{rng.choice(ADJECTIVES).capitalize()} {kind} in good condition, '
+                            f'comes with {rng.choice(ADJECTIVES)} {rng.choice(TOOL_KINDS)} accessories',
+                pricing_type='daily',
+                price_per_day=rng.randint(5, 120),
+                owner=owner,
+                latitude=round(rng.gauss(city_lat, 0.15), 6),
+                longitude=round(rng.gauss(city_lng, 0.15), 6),
+            ))
+            if len(batch) == 5000:
+                Tool.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Tool.objects.bulk_create(batch)
+        search.rebuild_index()
+        self.stdout.write(f'Dataset ready in {time.perf_counter() - started:.1f}s')
+
+        today = date.today()
+        scenarios = {
+            'text only': lambda q: search.search_tools(q),
+            'text + location': lambda q: search.search_tools(q, *rng.choice(CITIES), radius=10),
+            'text + location + dates': lambda q: search.search_tools(
+                q, *rng.choice(CITIES), radius=10,
+                start_date=today, end_date=today + timedelta(days=3)
+            ),
+            'text, page 5': lambda q: search.search_tools(q, page=5),
+        }
+
+        for name, scenario in scenarios.items():
+            timings = []
+            for _ in range(options['queries']):
+                query = rng.choice(TOOL_KINDS) + ' ' + rng.choice(['', rng.choice(ADJECTIVES)])
+                started = time.perf_counter()
+                scenario(query)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            self.stdout.write(
+                f'{name:<26} p50={statistics.median(timings):7.2f}ms '
+                f'p95={timings[int(len(timings) * 0.95) - 1]:7.2f}ms '
+                f'p99={timings[int(len(timings) * 0.99) - 1]:7.2f}ms '
+                f'max={timings[-1]:7.2f}ms'
+            )
@@ -0,0 +1,150 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from api.models import Tool, RentalTransaction, BorrowRequest, UserProfile
+from api import query_plans
+from datetime import date, timedelta
+import io
+
+# Hot path -> groups of indexes; each group must have one member used by some query.
+# Foreign-key indexes are named by prefix (table_column) since Django appends a hash.
+HOT_PATHS = {
+    'availability_conflict': [
+        ('idx_availability_check',),
+        ('idx_borrow', 'api_borrowrequest_tool_id'),
+    ],
+    'advanced_availability_conflict': [
+        ('idx_availability_check',),
+        ('idx_hourly_tool_date_state', 'api_hourlyavailability_tool_id', 'sqlite_autoindex_api_hourlyavailability'),
+    ],
+    'near_location': [
+        ('idx_tools_location_available',),
+    ],
+    'calendar_status': [
+        ('idx_availability_check', 'idx_rental_tool_dates'),
+    ],
+    'user_borrow_requests': [
+        ('idx_borrow_owner_status_exp', 'api_borrowrequest_owner_id'),
+        ('api_borrowrequest_borrower_id',),
+    ],
+    'overdue_sweep': [
+        ('idx_rental_status_dates',),
+    ],
+}
+
+# The test client's default host (testserver) is not in ALLOWED_HOSTS and would get 400 on every request
+CLIENT_HOST = 'localhost'
+# Plans are checked for the SQL a cold cache runs, not for what happens to be cached
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the SQL behind the hot API paths and fail if an expected index is unused or a large table is fully scanned'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paths', default=','.join(HOT_PATHS), help='Comma-separated subset of hot paths to check')
+        parser.add_argument('--show-plans', action='store_true', help='Print every captured query with its plan')
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['paths'].split(',') if name.strip()]
+        unknown = [name for name in names if name not in HOT_PATHS]
+        if unknown:
+            raise CommandError(f'Unknown paths: {", ".join(unknown)}')
+
+        subjects = self.pick_subjects()
+        if subjects is None:
+            raise CommandError('Need tools with coordinates and rentals; run generate_dataset first')
+
+        self.stdout.write(f'Checking query plans on {connection.vendor} '
+                          f'(tool {subjects["tool"].pk}, user {subjects["user"].pk})')
+        failed = []
+        for name in names:
+            queries, problems = self.check_path(name, subjects)
+            if problems:
+                failed.append(name)
+                self.stdout.write(self.style.ERROR(f'FAIL {name} ({len(queries)} distinct queries)'))
+                for problem in problems:
+                    self.stdout.write(f'  - {problem}')
+            else:
+                self.stdout.write(self.style.SUCCESS(f'ok   {name} ({len(queries)} distinct queries)'))
+            if options['show_plans']:
+                for query in queries:
+                    self.stdout.write(f'    {query.sql}')
+                    for step in query.plan:
+                        self.stdout.write(f'      {step.detail}')
+
+        self.stdout.write('=' * 50)
+        if failed:
+            raise CommandError(f'Query plan regressions in: {", ".join(failed)}')
+        self.stdout.write(self.style.SUCCESS(f'All {len(names)} hot paths use their indexes'))
+
+    def check_path(self, name, subjects):
+        """(distinct queries, problems) of one hot path"""
+        with override_settings(CACHES=NO_CACHE), query_plans.capture_queries() as captured:
+            getattr(self, f'run_{name}')(subjects)
+        queries = self.unique(captured)
+        return queries, query_plans.check(queries, HOT_PATHS[name])
+
+    def pick_subjects(self):
+        """The busiest located tool and the owner with the most borrow requests"""
+        busiest = (RentalTransaction.objects.filter(tool__latitude__isnull=False)
+                   .values('tool').annotate(n=Count('id')).order_by('-n').first())
+        owner = (BorrowRequest.objects.filter(owner__isnull=False)
+                 .values('owner').annotate(n=Count('id')).order_by('-n').first())
+        if busiest is None:
+            return None
+        tool = Tool.objects.get(pk=busiest['tool'])
+        user = UserProfile.objects.get(pk=owner['owner']) if owner else tool.owner
+        start = date.today()
+        return {'tool': tool, 'user': user, 'start': start, 'end': start + timedelta(days=30)}
+
+    def unique(self, captured):
+        seen = {}
+        for query in captured:
+            seen.setdefault(query.sql, query)
+        return list(seen.values())
+
+    def request(self, method, path, data=None, user=None):
+        """Issue a request and fail unless it succeeded, since an error response skips the queries being checked"""
+        client = Client(HTTP_HOST=CLIENT_HOST)
+        if user is not None:
+            client.force_login(user)
+        if method == 'GET':
+            response = client.get(path, data)
+        else:
+            response = client.post(path, data, content_type='application/json')
+        if response.status_code >= 400:
+            raise CommandError(f'{method} {path} returned {response.status_code}: {response.content[:200]!r}')
+        return response
+
+    def run_availability_conflict(self, subjects):
+        self.request('POST', '/api/check-availability-conflict/', {
+            'tool_id': subjects['tool'].pk,
+            'start_date': subjects['start'].isoformat(), 'end_date': subjects['end'].isoformat(),
+        })
+
+    def run_advanced_availability_conflict(self, subjects):
+        self.request('POST', '/api/check-advanced-availability-conflict/', {
+            'tool_id': subjects['tool'].pk,
+            'start_date': subjects['start'].isoformat(), 'end_date': subjects['start'].isoformat(),
+            'start_time': '09:00', 'end_time': '13:00',
+        })
+
+    def run_near_location(self, subjects):
+        tool = subjects['tool']
+        self.request('GET', '/api/tools/near-location/', {
+            'lat': tool.latitude, 'lng': tool.longitude, 'radius': 5,
+            'start_date': subjects['start'].isoformat(), 'end_date': subjects['end'].isoformat(),
+        })
+
+    def run_calendar_status(self, subjects):
+        self.request('GET', f'/api/tools/{subjects["tool"].pk}/calendar-status/', {
+            'start_date': subjects['start'].isoformat(), 'end_date': subjects['end'].isoformat(),
+        })
+
+    def run_user_borrow_requests(self, subjects):
+        self.request('GET', '/api/borrow-requests/my-requests/', user=subjects['user'])
+
+    def run_overdue_sweep(self, subjects):
+        call_command('process_overdue_rentals', dry_run=True, stdout=io.StringIO())
@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api import uploads
+
+class Command(BaseCommand):
+    help = 'Delete chunked uploads that were abandoned or never attached, with their files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=settings.UPLOAD_EXPIRY_HOURS, help='Age in hours after which an unattached upload is removed')
+
+    def handle(self, *args, **options):
+        removed = uploads.clean_expired(options['hours'])
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} expired uploads'))
@@ -0,0 +1,121 @@
+from collections import Counter
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from api import storage, thumbnails
+from api.models import MediaBlob, Dispute
+import os
+import time
+
+class Command(BaseCommand):
+    help = 'Recount references to content-addressed media blobs and delete the ones nothing refers to'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without deleting or updating anything')
+        parser.add_argument('--grace-hours', type=float, default=24, help='Keep unreferenced blobs younger than this (uploads still being saved)')
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, storage.ContentAddressedStorage):
+            raise CommandError('Default storage is not api.storage.ContentAddressedStorage')
+        dry_run = options['dry_run']
+        cutoff = time.time() - options['grace_hours'] * 3600
+        if dry_run:
+            self.stdout.write('DRY RUN MODE - No changes will be made')
+
+        # Counts are read before references; a blob whose count moves after this was
+        # touched by a concurrent save or delete and is left for the next run
+        snapshot = dict(MediaBlob.objects.values_list('name', 'refcount'))
+        references = self.count_references()
+        on_disk = self.blob_files()
+
+        deleted = freed = recounted = skipped = 0
+        for name in sorted(set(snapshot) | set(on_disk)):
+            actual = references.get(name, 0)
+            if actual == 0:
+                mtime, size = on_disk.get(name, (0, 0))
+                if mtime > cutoff:
+                    continue
+                if dry_run or self.delete_blob(name, snapshot.get(name)):
+                    deleted += 1
+                    freed += size
+                else:
+                    skipped += 1
+            elif name in snapshot and snapshot[name] != actual:
+                if dry_run or MediaBlob.objects.filter(name=name, refcount=snapshot[name]).update(refcount=actual):
+                    recounted += 1
+                else:
+                    skipped += 1
+
+        missing = sorted(name for name in references if name not in on_disk)
+        for name in missing:
+            self.stdout.write(self.style.ERROR(f'Referenced but missing: {name}'))
+        removed_temp = self.clean_temp(cutoff, dry_run)
+
+        self.stdout.write('=' * 50)
+        self.stdout.write(f'Blobs on disk: {len(on_disk)}, referenced: {len(references)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted} unreferenced blobs ({freed / 1024 / 1024:.1f} MB), '
+            f'corrected {recounted} reference counts, removed {removed_temp} stale temp files'
+        ))
+        if skipped:
+            self.stdout.write(self.style.WARNING(f'{skipped} blobs changed during the run and were left alone'))
+
+    def count_references(self):
+        """How many times each blob name is referenced by file fields and JSON lists of names or URLs"""
+        references = Counter()
+        for model in apps.get_models():
+            for field in model._meta.get_fields():
+                if isinstance(field, models.FileField) and field.concrete:
+                    names = model._default_manager.exclude(**{field.name: ''}).exclude(**{f'{field.name}__isnull': True})
+                    references.update(name for name in names.values_list(field.name, flat=True).iterator() if storage.is_blob(name))
+        for model, (_, variants_field, _) in thumbnails.IMAGE_FIELDS.items():
+            for variants in model._default_manager.values_list(variants_field, flat=True).iterator():
+                references.update(name for name in thumbnails.variant_names(variants or {}) if storage.is_blob(name))
+        prefix = settings.MEDIA_URL
+        for urls in Dispute.objects.exclude(evidence_files=[]).values_list('evidence_files', flat=True).iterator():
+            for url in urls or []:
+                name = url.split(prefix, 1)[-1] if prefix in url else url
+                if storage.is_blob(name):
+                    references[name] += 1
+        return references
+
+    def blob_files(self):
+        """{name: (mtime, size)} of every blob file in storage"""
+        root = default_storage.path(storage.BLOB_DIR)
+        files = {}
+        for directory, subdirectories, filenames in os.walk(root):
+            if directory == root and 'tmp' in subdirectories:
+                subdirectories.remove('tmp')
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, default_storage.location).replace(os.sep, '/')
+                stat = os.stat(path)
+                files[name] = (stat.st_mtime, stat.st_size)
+        return files
+
+    def delete_blob(self, name, expected_refcount):
+        """Delete a blob unless its count changed since the snapshot (a save may be re-using it)"""
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if (blob.refcount if blob else None) != expected_refcount:
+                return False
+            if blob is not None:
+                blob.delete()
+            path = default_storage.path(name)
+            if os.path.exists(path):
+                os.remove(path)
+        return True
+
+    def clean_temp(self, cutoff, dry_run):
+        temp_dir = default_storage.path(f'{storage.BLOB_DIR}/tmp')
+        removed = 0
+        if os.path.isdir(temp_dir):
+            for filename in os.listdir(temp_dir):
+                path = os.path.join(temp_dir, filename)
+                if os.path.getmtime(path) < cutoff:
+                    if not dry_run:
+                        os.remove(path)
+                    removed += 1
+        return removed
@@ -0,0 +1,393 @@
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from api.models import UserProfile, Tool, RentalTransaction, Deposit, DepositTransaction, Feedback, HourlyAvailability
+from api.management.commands.benchmark_search import TOOL_KINDS, ADJECTIVES, BRANDS
+from api import search, rollups
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+import math
+import random
+import time
+
+# (name, state, lat, lng, relative population) - users and tools cluster around these
+CITIES = [
+    ('Austin', 'TX', 30.2672, -97.7431, 10),
+    ('San Antonio', 'TX', 29.4241, -98.4936, 14),
+    ('Dallas', 'TX', 32.7767, -96.7970, 13),
+    ('Houston', 'TX', 29.7604, -95.3698, 23),
+    ('San Marcos', 'TX', 29.8833, -97.9414, 1),
+    ('Denver', 'CO', 39.7392, -104.9903, 7),
+    ('Phoenix', 'AZ', 33.4484, -112.0740, 16),
+    ('Seattle', 'WA', 47.6062, -122.3321, 7),
+    ('Portland', 'OR', 45.5152, -122.6784, 6),
+    ('Chicago', 'IL', 41.8781, -87.6298, 27),
+    ('Atlanta', 'GA', 33.7490, -84.3880, 5),
+    ('Boston', 'MA', 42.3601, -71.0589, 7),
+]
+FIRST_NAMES = ['James', 'Maria', 'Robert', 'Linda', 'Michael', 'Priya', 'David', 'Sofia', 'Wei', 'Aisha',
+               'Daniel', 'Emma', 'Carlos', 'Olivia', 'Kenji', 'Fatima', 'Lucas', 'Grace', 'Omar', 'Hannah']
+LAST_NAMES = ['Smith', 'Garcia', 'Johnson', 'Nguyen', 'Brown', 'Patel', 'Miller', 'Lopez', 'Kim', 'Davis',
+              'Martinez', 'Chen', 'Wilson', 'Ahmed', 'Taylor', 'Silva', 'Moore', 'Khan', 'Clark', 'Lee']
+PRICING_TYPES = ['daily', 'hourly', 'weekly']
+# Business hours that hourly tools publish slots for
+SLOT_HOURS = range(8, 20)
+
+# Per-process copy of the dataset plan, set directly or by the pool initializer
+_plan = None
+
+
+def _init_worker(plan):
+    global _plan
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    _plan = plan
+
+
+def _rng(table, chunk):
+    # String seeds are hashed with SHA-512, so every process derives the same stream
+    return random.Random(f'{_plan["seed"]}:{table}:{chunk}')
+
+
+def _user_rows(rng, start, stop):
+    users = []
+    for index in range(start, stop):
+        name, state, lat, lng, _ = CITIES[_plan['user_city'][index]]
+        user_id = _plan['user_base'] + index
+        users.append(UserProfile(
+            id=user_id,
+            username=f'user{user_id}',
+            email=f'user{user_id}@example.com',
+            password=_plan['password'],
+            first_name=rng.choice(FIRST_NAMES),
+            last_name=rng.choice(LAST_NAMES),
+            city=name,
+            state=state,
+            zip_code=f'{rng.randint(10000, 99999)}',
+            is_owner=bool(_plan['is_owner'][index]),
+            latitude=round(rng.gauss(lat, 0.1), 6),
+            longitude=round(rng.gauss(lng, 0.1), 6),
+        ))
+    return {UserProfile: users}
+
+
+def _tool_rows(rng, start, stop):
+    tools = []
+    for index in range(start, stop):
+        owner_index = _plan['tool_owner'][index]
+        name, state, lat, lng, _ = CITIES[_plan['user_city'][owner_index]]
+        pricing_type = PRICING_TYPES[_plan['tool_kind'][index]]
+        daily = _plan['tool_price'][index]
+        kind = rng.choice(TOOL_KINDS)
+        tool_lat = round(rng.gauss(lat, 0.08), 6)
+        tool_lng = round(rng.gauss(lng, 0.08), 6)
+        delivery = rng.random() < 0.3
+        tools.append(Tool(
+            id=_plan['tool_base'] + index,
+            name=f'{rng.choice(BRANDS)} {rng.choice(ADJECTIVES)} {kind}',
+            description=f'{rng.choice(ADJECTIVES).capitalize()} {kind} in good condition, '
+                        f'comes with {rng.choice(ADJECTIVES)} {rng.choice(TOOL_KINDS)} accessories',
+            pricing_type=pricing_type,
+            price_per_hour=(Decimal(daily) / 6).quantize(Decimal('0.01')) if pricing_type == 'hourly' else None,
+            price_per_day=daily,
+            price_per_week=daily * 5 if pricing_type == 'weekly' else None,
+            replacement_value=daily * rng.randint(8, 20),
+            available=rng.random() < 0.95,
+            owner_id=_plan['user_base'] + owner_index,
+            pickup_city=name,
+            pickup_state=state,
+            pickup_latitude=tool_lat,
+            pickup_longitude=tool_lng,
+            latitude=tool_lat,
+            longitude=tool_lng,
+            delivery_available=delivery,
+            delivery_radius=rng.choice([5, 10, 15, 25]) if delivery else 0,
+            delivery_fee=rng.choice([5, 10, 15, 20]) if delivery else 0,
+        ))
+    return {Tool: tools}
+
+
+def _rental_start(rng):
+    """Start date skewed towards summer and towards Friday/Saturday pickups"""
+    first = _plan['today'] - timedelta(days=_plan['history_days'])
+    span = _plan['history_days'] + _plan['future_days']
+    while True:
+        day = first + timedelta(days=rng.randrange(span))
+        season = 0.65 + 0.35 * math.cos((day.timetuple().tm_yday - 196) / 365 * 2 * math.pi)
+        weekday = 1.0 if day.weekday() in (4, 5) else 0.6
+        if rng.random() < season * weekday:
+            return day
+
+
+def _rental_rows(rng, start, stop):
+    today = _plan['today']
+    tool_count = len(_plan['tool_owner'])
+    rentals, deposits, transactions, feedback = [], [], [], []
+    for index in range(start, stop):
+        # A minority of tools gets most of the bookings
+        tool_index = int(tool_count * rng.random() ** 1.6)
+        owner_index = _plan['tool_owner'][tool_index]
+        neighbours = _plan['users_by_city'][_plan['user_city'][owner_index]]
+        borrower_index = neighbours[rng.randrange(len(neighbours))] if rng.random() < 0.9 else rng.randrange(len(_plan['user_city']))
+        if borrower_index == owner_index:
+            borrower_index = (owner_index + 1) % len(_plan['user_city'])
+
+        if PRICING_TYPES[_plan['tool_kind'][tool_index]] == 'weekly':
+            days = 7 * rng.randint(1, 3)
+        else:
+            days = min(30, 1 + int(rng.expovariate(1 / 2.5)))
+        start_date = _rental_start(rng)
+        end_date = start_date + timedelta(days=days - 1)
+
+        if start_date > today:
+            status = 'pending'
+        elif end_date >= today:
+            status = 'active'
+        else:
+            roll = rng.random()
+            status = 'completed' if roll < 0.9 else 'cancelled' if roll < 0.97 else 'forfeited'
+        payment_status = {'pending': 'pending', 'cancelled': 'refunded'}.get(status, 'paid')
+
+        rental_id = _plan['rental_base'] + index
+        owner_id = _plan['user_base'] + owner_index
+        borrower_id = _plan['user_base'] + borrower_index
+        rentals.append(RentalTransaction(
+            id=rental_id,
+            tool_id=_plan['tool_base'] + tool_index,
+            owner_id=owner_id,
+            borrower_id=borrower_id,
+            start_date=start_date,
+            end_date=end_date,
+            total_price=_plan['tool_price'][tool_index] * days,
+            payment_status=payment_status,
+            payment_reference=f'PAY-{rental_id}' if payment_status != 'pending' else '',
+            status=status,
+        ))
+
+        deposit_id = _plan['deposit_base'] + index
+        deposit_status = {'pending': 'pending', 'active': 'paid', 'forfeited': 'forfeited'}.get(status, 'refunded')
+        deposits.append(Deposit(id=deposit_id, rental_transaction_id=rental_id, status=deposit_status))
+        # Two id slots per rental: the payment and its refund or forfeit
+        transaction_id = _plan['transaction_base'] + 2 * index
+        if status != 'pending':
+            transactions.append(DepositTransaction(
+                id=transaction_id, deposit_id=deposit_id, transaction_type='payment',
+                amount=Decimal('50.00'), reference=f'DEP-{deposit_id}'
+            ))
+        if deposit_status in ('refunded', 'forfeited'):
+            transactions.append(DepositTransaction(
+                id=transaction_id + 1, deposit_id=deposit_id,
+                transaction_type='forfeit' if deposit_status == 'forfeited' else 'refund',
+                amount=Decimal('50.00'), reference=f'DEP-{deposit_id}-{deposit_status}'
+            ))
+
+        if status == 'completed' and rng.random() < 0.6:
+            feedback.append(Feedback(
+                id=_plan['feedback_base'] + index,
+                rental_transaction_id=rental_id,
+                reviewer_id=borrower_id,
+                reviewed_user_id=owner_id,
+                rating=rng.choices([1, 2, 3, 4, 5], weights=[2, 3, 10, 30, 55])[0],
+                comment=rng.choice(['', 'Worked great.', 'Easy pickup.', 'Exactly as described.', 'A bit worn but fine.']),
+            ))
+    return {RentalTransaction: rentals, Deposit: deposits, DepositTransaction: transactions, Feedback: feedback}
+
+
+def _hourly_rows(rng, start, stop):
+    slots = []
+    slots_per_tool = _plan['hourly_days'] * len(SLOT_HOURS)
+    for position in range(start, stop):
+        tool_index = _plan['hourly_tools'][position]
+        slot_id = _plan['hourly_base'] + position * slots_per_tool
+        for day_offset in range(_plan['hourly_days']):
+            day = _plan['today'] + timedelta(days=day_offset)
+            for hour in SLOT_HOURS:
+                booked = rng.random() < 0.15
+                slots.append(HourlyAvailability(
+                    id=slot_id,
+                    tool_id=_plan['tool_base'] + tool_index,
+                    date=day,
+                    hour=hour,
+                    is_booked=booked,
+                    is_available=booked or rng.random() < 0.9,
+                ))
+                slot_id += 1
+    return {HourlyAvailability: slots}
+
+
+GENERATORS = {
+    'users': _user_rows,
+    'tools': _tool_rows,
+    'rentals': _rental_rows,
+    'hourly': _hourly_rows,
+}
+
+
+def _run_chunk(table, chunk, start, stop):
+    """Generate and insert one chunk; returns {model name: rows inserted}"""
+    rows = GENERATORS[table](_rng(table, chunk), start, stop)
+    with transaction.atomic():
+        for model, objects in rows.items():
+            model.objects.bulk_create(objects, batch_size=_plan['batch_size'])
+    return {model.__name__: len(objects) for model, objects in rows.items()}
+
+
+class Command(BaseCommand):
+    help = 'Bulk-generate a large, reproducible synthetic dataset (users, tools, rentals, deposits, reviews, hourly slots)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Number of users to create')
+        parser.add_argument('--tools', type=int, default=5000, help='Number of tools to create')
+        parser.add_argument('--rentals', type=int, default=20000, help='Number of rentals (each with a deposit)')
+        parser.add_argument('--owner-ratio', type=float, default=0.3, help='Share of users who list tools')
+        parser.add_argument('--hourly-days', type=int, default=7, help='Days of hourly slots to create for hourly tools')
+        parser.add_argument('--history-days', type=int, default=730, help='How far back rental start dates go')
+        parser.add_argument('--today', type=date.fromisoformat, default=date.today(),
+                            help='Reference date (YYYY-MM-DD) that rental statuses are computed against')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed; the same seed yields the same rows')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per chunk and per INSERT')
+        parser.add_argument('--workers', type=int, default=1, help='Processes inserting chunks in parallel (ignored on SQLite)')
+        parser.add_argument('--skip-derived', action='store_true',
+                            help='Do not rebuild the search index and rental rollups afterwards')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['tools'] < 1:
+            self.stdout.write(self.style.ERROR('Need at least 2 users and 1 tool'))
+            return
+
+        workers = options['workers']
+        if workers > 1 and connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING('SQLite allows a single writer; using 1 worker'))
+            workers = 1
+
+        started = time.perf_counter()
+        plan = self.build_plan(options)
+        self.stdout.write(
+            f'Generating {options["users"]} users, {options["tools"]} tools, {options["rentals"]} rentals '
+            f'({len(plan["hourly_tools"])} hourly tools) with seed {options["seed"]} on {workers} worker(s)'
+        )
+
+        totals = {}
+        if workers > 1:
+            # Forked workers must not share the parent's database connection
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(plan,)) as pool:
+                for table, size in self.phases(options, plan):
+                    self.run_phase(plan, table, size, totals, pool)
+        else:
+            _init_worker(plan)
+            for table, size in self.phases(options, plan):
+                self.run_phase(plan, table, size, totals)
+
+        self.reset_sequences()
+
+        if not options['skip_derived']:
+            if search.is_supported():
+                self.stdout.write('Rebuilding search index...')
+                search.rebuild_index()
+            self.stdout.write('Rebuilding rental rollups...')
+            rollups.rebuild(batch_size=options['batch_size'])
+
+        self.stdout.write('\n' + '='*50)
+        self.stdout.write('DATASET SUMMARY')
+        self.stdout.write('='*50)
+        for name, count in totals.items():
+            self.stdout.write(f'{name:<20} {count:>12,}')
+        self.stdout.write(self.style.SUCCESS(f'Done in {time.perf_counter() - started:.1f}s'))
+
+    def build_plan(self, options):
+        """Cross-table choices (cities, owners, prices) shared by every chunk"""
+        rng = random.Random(f'{options["seed"]}:plan')
+        user_count, tool_count = options['users'], options['tools']
+
+        user_city = array('B', rng.choices(range(len(CITIES)), weights=[city[4] for city in CITIES], k=user_count))
+        users_by_city = [array('i') for _ in CITIES]
+        for index, city in enumerate(user_city):
+            users_by_city[city].append(index)
+        users_by_city = [members or array('i', [0]) for members in users_by_city]
+
+        owners = sorted(rng.sample(range(user_count), max(1, int(user_count * options['owner_ratio']))))
+        is_owner = bytearray(user_count)
+        for index in owners:
+            is_owner[index] = 1
+        # Squaring the uniform draw gives a few power owners with many listings
+        tool_owner = array('i', (owners[int(len(owners) * rng.random() ** 2)] for _ in range(tool_count)))
+        tool_kind = bytearray(rng.choices(range(len(PRICING_TYPES)), weights=[75, 15, 10], k=tool_count))
+        tool_price = array('H', (min(250, max(5, int(rng.lognormvariate(3.2, 0.6)))) for _ in range(tool_count)))
+        hourly_tools = array('i', (index for index, kind in enumerate(tool_kind) if PRICING_TYPES[kind] == 'hourly'))
+
+        def next_id(model):
+            return (model.objects.aggregate(top=Max('id'))['top'] or 0) + 1
+
+        return {
+            'seed': options['seed'],
+            'today': options['today'],
+            'history_days': options['history_days'],
+            'future_days': 60,
+            'hourly_days': options['hourly_days'],
+            'batch_size': options['batch_size'],
+            # One shared hash keeps user creation cheap; every generated user's password is "password"
+            'password': make_password('password'),
+            'user_base': next_id(UserProfile),
+            'tool_base': next_id(Tool),
+            'rental_base': next_id(RentalTransaction),
+            'deposit_base': next_id(Deposit),
+            'transaction_base': next_id(DepositTransaction),
+            'feedback_base': next_id(Feedback),
+            'hourly_base': next_id(HourlyAvailability),
+            'user_city': user_city,
+            'users_by_city': users_by_city,
+            'is_owner': is_owner,
+            'tool_owner': tool_owner,
+            'tool_kind': tool_kind,
+            'tool_price': tool_price,
+            'hourly_tools': hourly_tools,
+        }
+
+    def phases(self, options, plan):
+        # Ordered so foreign keys always point at rows from an earlier phase
+        return [
+            ('users', options['users']),
+            ('tools', options['tools']),
+            ('rentals', options['rentals']),
+            ('hourly', len(plan['hourly_tools'])),
+        ]
+
+    def run_phase(self, plan, table, size, totals, pool=None):
+        if not size:
+            return
+        batch_size = plan['batch_size']
+        if table == 'hourly':
+            if not plan['hourly_days']:
+                return
+            # Chunk by tool so each INSERT batch stays near batch_size slots
+            batch_size = max(1, batch_size // (plan['hourly_days'] * len(SLOT_HOURS)))
+        tasks = [(table, chunk, start, min(start + batch_size, size))
+                 for chunk, start in enumerate(range(0, size, batch_size))]
+
+        started = time.perf_counter()
+        if pool is not None:
+            results = [future.result() for future in [pool.submit(_run_chunk, *task) for task in tasks]]
+        else:
+            results = [_run_chunk(*task) for task in tasks]
+        inserted = 0
+        for result in results:
+            for name, count in result.items():
+                totals[name] = totals.get(name, 0) + count
+                inserted += count
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{table:<8} {inserted:>12,} rows in {elapsed:6.1f}s ({inserted / max(elapsed, 1e-9):,.0f} rows/s)')
+
+    def reset_sequences(self):
+        models = [UserProfile, Tool, RentalTransaction, Deposit, DepositTransaction, Feedback, HourlyAvailability]
+        statements = connection.ops.sequence_reset_sql(no_style(), models)
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
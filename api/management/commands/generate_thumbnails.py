@@ -0,0 +1,60 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from django.core.management.base import BaseCommand, CommandError
+from api import thumbnails
+from api.models import Tool, UserProfile
+import multiprocessing
+import os
+
+MODELS = {'tools': Tool, 'profiles': UserProfile}
+
+class Command(BaseCommand):
+    help = 'Generate missing or stale thumbnails for tool images and profile pictures in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--models', default=','.join(MODELS), help='Comma-separated subset of: tools, profiles')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='Worker processes to render with')
+        parser.add_argument('--force', action='store_true', help='Regenerate thumbnails that are already current')
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['models'].split(',') if name.strip()]
+        unknown = [name for name in names if name not in MODELS]
+        if unknown:
+            raise CommandError(f'Unknown models: {", ".join(unknown)}')
+
+        done = failed = 0
+        with ProcessPoolExecutor(options['workers'], mp_context=multiprocessing.get_context('spawn')) as workers:
+            pending = {}
+            for name in names:
+                model = MODELS[name]
+                image_field, variants_field, _ = thumbnails.IMAGE_FIELDS[model]
+                rows = (model.objects.exclude(**{image_field: ''}).exclude(**{f'{image_field}__isnull': True})
+                        .only('pk', image_field, variants_field).order_by('pk'))
+                for instance in rows.iterator():
+                    if thumbnails.is_current(instance) and not options['force']:
+                        continue
+                    # Bound the sources held in memory while the pool works
+                    if len(pending) >= options['workers'] * 4:
+                        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        done, failed = self.tally(finished, pending, done, failed)
+                    try:
+                        pending[thumbnails.submit(instance, workers)] = f'{name} {instance.pk}'
+                    except Exception as e:
+                        failed += 1
+                        self.stdout.write(self.style.WARNING(f'{name} {instance.pk}: {e}'))
+            finished, _ = wait(pending)
+            done, failed = self.tally(finished, pending, done, failed)
+
+        self.stdout.write('=' * 50)
+        self.stdout.write(self.style.SUCCESS(f'Generated thumbnails for {done} images'))
+        if failed:
+            self.stdout.write(self.style.WARNING(f'{failed} images could not be processed'))
+
+    def tally(self, finished, pending, done, failed):
+        for future in finished:
+            label = pending.pop(future)
+            if future.exception() is None:
+                done += 1
+            else:
+                failed += 1
+                self.stdout.write(self.style.WARNING(f'{label}: {future.exception()}'))
+        return done, failed
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api import outbox
+import time
+
+class Command(BaseCommand):
+    help = 'Deliver queued outbox events to their consumers (notifications, ...), once or continuously'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumers', default='', help='Comma-separated consumers to run (default: all registered)')
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE, help='Events per consumer per batch')
+        parser.add_argument('--loop', action='store_true', help='Keep polling instead of exiting once caught up')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep between polls when idle (with --loop)')
+        parser.add_argument('--status', action='store_true', help='Print the backlog of each consumer and exit')
+        parser.add_argument('--purge', action='store_true', help='Also delete processed events older than OUTBOX_RETENTION_DAYS')
+
+    def handle(self, *args, **options):
+        if options['status']:
+            for name, waiting in outbox.backlog().items():
+                self.stdout.write(f'{name}: {waiting} events waiting')
+            return
+
+        names = [name.strip() for name in options['consumers'].split(',') if name.strip()] or list(outbox.CONSUMERS)
+        unknown = [name for name in names if name not in outbox.CONSUMERS]
+        if unknown:
+            raise CommandError(f'Unknown consumers: {", ".join(unknown)}')
+
+        total = 0
+        try:
+            while True:
+                delivered = 0
+                for name in names:
+                    # Drain each consumer until it is caught up; run one process per consumer to isolate slow ones
+                    while True:
+                        done = outbox.drain(name, options['batch_size'])
+                        delivered += done
+                        if done < options['batch_size']:
+                            break
+                total += delivered
+                if delivered:
+                    self.stdout.write(f'Processed {delivered} events')
+                if options['purge']:
+                    purged = outbox.purge(settings.OUTBOX_RETENTION_DAYS)
+                    if purged:
+                        self.stdout.write(f'Purged {purged} old events')
+                if not options['loop']:
+                    break
+                if not delivered:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {total} outbox events'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from api import rollups
+
+class Command(BaseCommand):
+    help = 'Recompute the tool daily and owner monthly rental rollups from the rental and deposit tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows fetched and inserted per batch (default: 5000)',
+        )
+
+    def handle(self, *args, **options):
+        daily, monthly = rollups.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {daily} tool daily rollups and {monthly} owner monthly rollups'))
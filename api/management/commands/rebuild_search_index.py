@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from api import search
+
+class Command(BaseCommand):
+    help = 'Create the full-text search index for tools and repopulate it from api_tool'
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            self.stdout.write(self.style.ERROR(f'Full-text search is not supported on {connection.vendor}'))
+            return
+
+        indexed = search.rebuild_index()
+        if connection.vendor == 'sqlite':
+            self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} tools in {search.FTS_TABLE}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'FULLTEXT index {search.FULLTEXT_INDEX} is in place'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from api import messaging
+from api.models import UnreadMessageCounter
+
+class Command(BaseCommand):
+    help = 'Fill in missing message recipients and recompute every user\'s unread message counter'
+
+    def handle(self, *args, **options):
+        messaging.rebuild_unread_counts()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt unread counters for {UnreadMessageCounter.objects.count()} users'))
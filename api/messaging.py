@@ -0,0 +1,107 @@
+"""
+Rental chat threads and unread counters.
+
+Every message has a recipient: the rental's borrower when the owner wrote
+it, otherwise the owner. UnreadMessageCounter keeps each recipient's
+unread total, adjusted with F() updates as messages are created, deleted,
+or change read state (signals), and by ``mark_read``, which flips a whole
+thread with a single UPDATE and subtracts the row count. The inbox badge is
+then a primary-key read. QuerySet.update/bulk_create elsewhere bypass the
+signals; ``rebuild_unread_counts`` recomputes the counters after those.
+
+Threads are paged newest first with an opaque keyset cursor over
+(created_at, id) (see api.pagination), so each page is an index range scan
+on idx_message_thread no matter how deep the client scrolls.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+
+from .models import Message, RentalTransaction, UnreadMessageCounter
+from .pagination import DEFAULT_PAGE_SIZE, keyset_page
+
+
+def recipient_for(rental, sender_id):
+    """The participant on the other side of ``sender_id`` in a rental"""
+    return rental.borrower_id if sender_id is not None and sender_id == rental.owner_id else rental.owner_id
+
+
+def _add(user_id, delta):
+    if user_id is None or not delta:
+        return
+    if UnreadMessageCounter.objects.filter(user_id=user_id).update(unread=F('unread') + delta):
+        return
+    if delta < 0:
+        # No counter yet (or it went with the user): nothing to subtract from
+        return
+    try:
+        with transaction.atomic():
+            UnreadMessageCounter.objects.create(user_id=user_id, unread=delta)
+    except IntegrityError:
+        UnreadMessageCounter.objects.filter(user_id=user_id).update(unread=F('unread') + delta)
+
+
+def unread_state(recipient_id, is_read):
+    """What a message contributes to its recipient's counter: (recipient_id, 0 or 1)"""
+    return recipient_id, 0 if is_read else 1
+
+
+def message_changed(old_state, new_state):
+    """Move a message's unread contribution from its previous state to its current one"""
+    if old_state == new_state:
+        return
+    if old_state:
+        _add(old_state[0], -old_state[1])
+    if new_state:
+        _add(new_state[0], new_state[1])
+
+
+def stored_state(message_id):
+    row = Message.objects.filter(pk=message_id).values_list('recipient_id', 'is_read').first()
+    return unread_state(*row) if row else None
+
+
+def unread_count(user_id):
+    counter = UnreadMessageCounter.objects.filter(user_id=user_id).values_list('unread', flat=True).first()
+    return max(counter or 0, 0)
+
+
+def mark_read(rental_id, user_id, up_to_id=None):
+    """Mark the user's unread messages in a thread (optionally only up to a message id) as read"""
+    with transaction.atomic():
+        unread = Message.objects.filter(rental_transaction_id=rental_id, recipient_id=user_id, is_read=False)
+        if up_to_id is not None:
+            unread = unread.filter(id__lte=up_to_id)
+        marked = unread.update(is_read=True)
+        _add(user_id, -marked)
+    return marked
+
+
+def thread_page(rental_id, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    One page of a rental's messages, newest first.
+
+    Returns ``(messages, next_cursor)``; pass ``next_cursor`` back to get the
+    older page, and it is None once the start of the thread is reached.
+    """
+    messages = Message.objects.filter(rental_transaction_id=rental_id).select_related('sender')
+    return keyset_page(messages, cursor, limit)
+
+
+def backfill_recipients(message_model, rental_model):
+    """Fill in missing recipients with two UPDATEs; takes the models so migrations can pass historical ones"""
+    rental = rental_model.objects.filter(pk=OuterRef('rental_transaction_id'))
+    message_model.objects.filter(recipient__isnull=True).update(recipient_id=Subquery(rental.values('owner_id')[:1]))
+    # Messages the owner wrote go to the borrower instead
+    message_model.objects.filter(sender_id=F('recipient_id')).update(recipient_id=Subquery(rental.values('borrower_id')[:1]))
+
+
+def rebuild_unread_counts():
+    """Backfill missing recipients and recompute every counter from the messages table"""
+    with transaction.atomic():
+        backfill_recipients(Message, RentalTransaction)
+        totals = Message.objects.filter(is_read=False, recipient__isnull=False).values('recipient_id').annotate(n=Count('id'))
+        UnreadMessageCounter.objects.all().delete()
+        UnreadMessageCounter.objects.bulk_create(
+            [UnreadMessageCounter(user_id=row['recipient_id'], unread=row['n']) for row in totals],
+            batch_size=1000,
+        )
@@ -0,0 +1,253 @@
+"""
+Per-request latency and SQL instrumentation, exposed in Prometheus text format.
+
+MetricsMiddleware times every request and wraps each database connection
+with ``execute_wrapper`` to count queries and their time. Samples are keyed
+by HTTP method and the matched URL pattern (not the concrete path), so the
+number of series stays bounded. Queries slower than SLOW_QUERY_MS are logged
+with their SQL on the ``api.slow_sql`` logger.
+
+Counters live in process memory: with several workers each one reports its
+own totals and Prometheus sums them per instance. Recording a request costs
+a couple of dict lookups and one short lock hold.
+
+The endpoint exposes routes, latencies and pool internals, so it only
+answers staff users and scrapers sending ``Authorization: Bearer
+<METRICS_TOKEN>``.
+"""
+import hmac
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import structured_logging
+
+logger = logging.getLogger('api.slow_sql')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+UNMATCHED_ROUTE = 'unmatched'
+MAX_LOGGED_SQL = 2000
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self.requests = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.sql_seconds = {}
+        self.slow_queries = {}
+
+    def record(self, method, route, status, seconds, sql):
+        with self.lock:
+            key = (method, route, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.observe((method, route), seconds)
+            self.queries.observe((method, route), sql.count)
+            self.sql_seconds[(method, route)] = self.sql_seconds.get((method, route), 0.0) + sql.seconds
+            if sql.slow:
+                self.slow_queries[(method, route)] = self.slow_queries.get((method, route), 0) + sql.slow
+
+    def reset(self):
+        with self.lock:
+            self._clear()
+
+
+registry = Registry()
+
+
+class QueryTimer:
+    """execute_wrapper that counts and times the queries of one request"""
+
+    def __init__(self, slow_seconds):
+        self.slow_seconds = slow_seconds
+        self.count = 0
+        self.seconds = 0.0
+        self.slow = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            if elapsed >= self.slow_seconds:
+                self.slow += 1
+                logger.warning(
+                    'Slow query (%.1f ms) on %s: %s',
+                    elapsed * 1000, context['connection'].alias, sql[:MAX_LOGGED_SQL],
+                )
+
+
+def _route(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.route if match is not None and match.route else UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'METRICS_ENABLED', True)
+        self.slow_seconds = getattr(settings, 'SLOW_QUERY_MS', 200) / 1000
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        timer = QueryTimer(self.slow_seconds)
+        started = time.perf_counter()
+        status = 500
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(timer))
+                response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            registry.record(request.method, _route(request), status, time.perf_counter() - started, timer)
+
+
+def is_authorized(request):
+    """Staff users, or a scraper presenting METRICS_TOKEN as a bearer token"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated and user.is_staff:
+        return True
+    token = settings.METRICS_TOKEN
+    scheme, _, presented = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return bool(token) and scheme.lower() == 'bearer' and hmac.compare_digest(presented.strip().encode(), token.encode())
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _quote(value):
+    return '"%s"' % _escape(value)
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}={_quote(value)}' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}'
+
+
+def _histogram_lines(name, histogram, label_names):
+    lines = []
+    for labels, series in sorted(histogram.series.items()):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, series):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(label_names, labels, "le=%s" % _quote(bound))} {cumulative}')
+        cumulative += series[len(histogram.buckets)]
+        lines.append(f'{name}_bucket{_labels(label_names, labels, "le=%s" % _quote("+Inf"))} {cumulative}')
+        lines.append(f'{name}_sum{_labels(label_names, labels)} {series[-1]}')
+        lines.append(f'{name}_count{_labels(label_names, labels)} {cumulative}')
+    return lines
+
+
+# (pool_stats() key, metric name, type, help)
+POOL_METRICS = [
+    ('size', 'toolshare_db_pool_size', 'gauge', 'Open connections in the pool, including ones being opened.'),
+    ('in_use', 'toolshare_db_pool_in_use', 'gauge', 'Connections currently borrowed.'),
+    ('idle', 'toolshare_db_pool_idle', 'gauge', 'Connections waiting in the pool.'),
+    ('waiters', 'toolshare_db_pool_waiters', 'gauge', 'Threads waiting for a connection.'),
+    ('checkouts', 'toolshare_db_pool_checkouts_total', 'counter', 'Connections handed out.'),
+    ('created', 'toolshare_db_pool_created_total', 'counter', 'Physical connections opened.'),
+    ('discarded', 'toolshare_db_pool_discarded_total', 'counter', 'Connections closed for age, idleness or failed checks.'),
+    ('timeouts', 'toolshare_db_pool_timeouts_total', 'counter', 'Checkouts that gave up waiting.'),
+    ('wait_seconds', 'toolshare_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a connection.'),
+]
+
+
+def _pool_lines():
+    """Pool metrics for database backends that expose pool_stats() (the pooled MySQL backend)"""
+    pools = {}
+    for alias in connections:
+        pool_stats = getattr(connections[alias], 'pool_stats', None)
+        stats = pool_stats() if pool_stats is not None else None
+        if stats is not None:
+            pools[alias] = stats
+    lines = []
+    if not pools:
+        return lines
+    for key, name, kind, description in POOL_METRICS:
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+        for alias, stats in sorted(pools.items()):
+            lines.append(f'{name}{_labels(("alias",), (alias,))} {stats[key]}')
+    return lines
+
+
+def render():
+    """Current metrics in the Prometheus text exposition format (version 0.0.4)"""
+    route_labels = ('method', 'route')
+    with registry.lock:
+        lines = [
+            '# HELP toolshare_http_requests_total HTTP requests by method, route and status code.',
+            '# TYPE toolshare_http_requests_total counter',
+        ]
+        for labels, count in sorted(registry.requests.items()):
+            lines.append(f'toolshare_http_requests_total{_labels(("method", "route", "status"), labels)} {count}')
+
+        lines += [
+            '# HELP toolshare_http_request_duration_seconds Time spent handling a request.',
+            '# TYPE toolshare_http_request_duration_seconds histogram',
+        ]
+        lines += _histogram_lines('toolshare_http_request_duration_seconds', registry.latency, route_labels)
+
+        lines += [
+            '# HELP toolshare_db_queries_per_request SQL queries issued while handling a request.',
+            '# TYPE toolshare_db_queries_per_request histogram',
+        ]
+        lines += _histogram_lines('toolshare_db_queries_per_request', registry.queries, route_labels)
+
+        lines += [
+            '# HELP toolshare_db_query_seconds_total Time spent executing SQL.',
+            '# TYPE toolshare_db_query_seconds_total counter',
+        ]
+        for labels, seconds in sorted(registry.sql_seconds.items()):
+            lines.append(f'toolshare_db_query_seconds_total{_labels(route_labels, labels)} {seconds}')
+
+        lines += [
+            '# HELP toolshare_db_slow_queries_total SQL queries slower than SLOW_QUERY_MS.',
+            '# TYPE toolshare_db_slow_queries_total counter',
+        ]
+        for labels, count in sorted(registry.slow_queries.items()):
+            lines.append(f'toolshare_db_slow_queries_total{_labels(route_labels, labels)} {count}')
+
+        lines += [
+            '# HELP toolshare_log_records_dropped_total Log records dropped because the log queue was full.',
+            '# TYPE toolshare_log_records_dropped_total counter',
+            f'toolshare_log_records_dropped_total {structured_logging.dropped_records()}',
+        ]
+
+        lines += _pool_lines()
+
+    return '\n'.join(lines) + '\n'
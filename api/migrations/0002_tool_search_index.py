@@ -0,0 +1,37 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS api_tool_fts "
+                "USING fts5(name, description, tokenize='porter unicode61')"
+            )
+            cursor.execute(
+                "INSERT INTO api_tool_fts(rowid, name, description) "
+                "SELECT id, name, description FROM api_tool"
+            )
+        elif connection.vendor == 'mysql':
+            cursor.execute("ALTER TABLE api_tool ADD FULLTEXT INDEX idx_tool_fulltext (name, description)")
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute("DROP TABLE IF EXISTS api_tool_fts")
+        elif connection.vendor == 'mysql':
+            cursor.execute("ALTER TABLE api_tool DROP INDEX idx_tool_fulltext")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
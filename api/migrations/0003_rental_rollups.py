@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0002_tool_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OwnerMonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('rental_count', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0.0, max_digits=12)),
+                ('booked_days', models.IntegerField(default=0)),
+                ('deposits_forfeited', models.DecimalField(decimal_places=2, default=0.0, max_digits=12)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('owner', 'month')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ToolDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('rental_count', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0.0, max_digits=12)),
+                ('booked_days', models.IntegerField(default=0)),
+                ('deposits_forfeited', models.DecimalField(decimal_places=2, default=0.0, max_digits=12)),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tool_daily_rollups', to=settings.AUTH_USER_MODEL)),
+                ('tool', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='api.tool')),
+            ],
+            options={
+                'unique_together': {('tool', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,109 @@
+from django.db import migrations, models
+
+# Indexes previously created by hand from database_optimizations*.sql. Databases
+# that ran those scripts already have them under these names, which would make
+# AddIndex fail (or leave duplicates), so they are dropped first if present.
+LEGACY_INDEXES = {
+    'api_rentaltransaction': [
+        'idx_rental_transactions_dates',
+        'idx_rental_transactions_status_dates',
+        'idx_rental_transactions_tool_dates',
+        'idx_availability_check',
+        'idx_active_rentals',
+    ],
+    'api_tool': ['idx_tools_location', 'idx_tools_location_available'],
+    'api_user': ['idx_users_location'],
+}
+
+
+def drop_legacy_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        tables = set(connection.introspection.table_names(cursor))
+        for table, names in LEGACY_INDEXES.items():
+            if table not in tables:
+                continue
+            existing = connection.introspection.get_constraints(cursor, table)
+            for name in names:
+                if existing.get(name, {}).get('index') and not existing[name].get('primary_key'):
+                    schema_editor.execute(schema_editor.sql_delete_index % {
+                        'table': schema_editor.quote_name(table),
+                        'name': schema_editor.quote_name(name),
+                    })
+
+
+def _user_table(apps, schema_editor):
+    # UserProfile lives in api_user (Meta.db_table), which the migration state predates
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if 'api_user' in connection.introspection.table_names(cursor):
+            return 'api_user'
+    return apps.get_model('api', 'UserProfile')._meta.db_table
+
+
+def add_user_location_index(apps, schema_editor):
+    quote = schema_editor.quote_name
+    schema_editor.execute(
+        f"CREATE INDEX {quote('idx_users_location')} ON {quote(_user_table(apps, schema_editor))} "
+        f"({quote('latitude')}, {quote('longitude')})"
+    )
+
+
+def drop_user_location_index(apps, schema_editor):
+    schema_editor.execute(schema_editor.sql_delete_index % {
+        'table': schema_editor.quote_name(_user_table(apps, schema_editor)),
+        'name': schema_editor.quote_name('idx_users_location'),
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_rental_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_legacy_indexes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='tool',
+            index=models.Index(fields=['latitude', 'longitude', 'available'], name='idx_tools_location_available'),
+        ),
+        # Recreates the dropped legacy user location index on the table the model actually uses
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(add_user_location_index, drop_user_location_index)],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='userprofile',
+                    index=models.Index(fields=['latitude', 'longitude'], name='idx_users_location'),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='rentaltransaction',
+            index=models.Index(fields=['tool', 'status', 'start_date', 'end_date'], name='idx_availability_check'),
+        ),
+        migrations.AddIndex(
+            model_name='rentaltransaction',
+            index=models.Index(fields=['tool', 'start_date', 'end_date'], name='idx_rental_tool_dates'),
+        ),
+        migrations.AddIndex(
+            model_name='rentaltransaction',
+            index=models.Index(fields=['status', 'start_date', 'end_date'], name='idx_rental_status_dates'),
+        ),
+        migrations.AddIndex(
+            model_name='rentaltransaction',
+            index=models.Index(fields=['start_date', 'end_date'], name='idx_rental_transactions_dates'),
+        ),
+        migrations.AddIndex(
+            model_name='feedback',
+            index=models.Index(fields=['rental_transaction', 'rating'], name='idx_feedback_rental_rating'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowrequest',
+            index=models.Index(fields=['owner', 'status', 'expires_at'], name='idx_borrow_owner_status_exp'),
+        ),
+        migrations.AddIndex(
+            model_name='hourlyavailability',
+            index=models.Index(fields=['tool', 'date', 'is_booked', 'is_available'], name='idx_hourly_tool_date_state'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+import django.db.models.deletion
+
+
+def backfill_recipients_and_counters(apps, schema_editor):
+    Message = apps.get_model('api', 'Message')
+    RentalTransaction = apps.get_model('api', 'RentalTransaction')
+    UnreadMessageCounter = apps.get_model('api', 'UnreadMessageCounter')
+    db_alias = schema_editor.connection.alias
+
+    rental = RentalTransaction.objects.using(db_alias).filter(pk=OuterRef('rental_transaction_id'))
+    messages = Message.objects.using(db_alias)
+    messages.filter(recipient__isnull=True).update(recipient_id=Subquery(rental.values('owner_id')[:1]))
+    messages.filter(sender_id=F('recipient_id')).update(recipient_id=Subquery(rental.values('borrower_id')[:1]))
+
+    totals = messages.filter(is_read=False, recipient__isnull=False).values('recipient_id').annotate(n=Count('id'))
+    UnreadMessageCounter.objects.using(db_alias).bulk_create(
+        [UnreadMessageCounter(user_id=row['recipient_id'], unread=row['n']) for row in totals],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0004_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='recipient',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages_received', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['rental_transaction', 'created_at', 'id'], name='idx_message_thread'),
+        ),
+        migrations.CreateModel(
+            name='UnreadMessageCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='unread_message_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('unread', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_recipients_and_counters, migrations.RunPython.noop),
+    ]
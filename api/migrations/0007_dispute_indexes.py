@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_outbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dispute',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='idx_dispute_status_created'),
+        ),
+        migrations.AddIndex(
+            model_name='dispute',
+            index=models.Index(fields=['created_at', 'id'], name='idx_dispute_created'),
+        ),
+        migrations.AddIndex(
+            model_name='disputemessage',
+            index=models.Index(fields=['dispute', 'created_at', 'id'], name='idx_dispute_msg_thread'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_chunked_uploads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tool',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='profile_picture_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
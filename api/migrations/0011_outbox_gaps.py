@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_media_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxcursor',
+            name='gaps',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
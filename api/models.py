@@ -4,6 +4,7 @@ from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
 from datetime import datetime, timedelta
 import math
+import uuid
 
 class UserProfile(AbstractUser):
     phone_number = models.CharField(max_length=15, blank=True)
@@ -15,6 +16,7 @@ class UserProfile(AbstractUser):
     is_owner = models.BooleanField(default=False)
     is_borrower = models.BooleanField(default=True)
     profile_picture = models.ImageField(upload_to='profile_pics/', null=True, blank=True)
+    profile_picture_variants = models.JSONField(default=dict, blank=True)  # Thumbnails, see api.thumbnails
     bio = models.TextField(blank=True)
     rating = models.DecimalField(max_digits=3, decimal_places=2, default=0.00)
     total_rentals = models.IntegerField(default=0)  # Match the database column name
@@ -28,6 +30,9 @@ class UserProfile(AbstractUser):
 
     class Meta:
         db_table = 'api_user'  # Specify the correct table name
+        indexes = [
+            models.Index(fields=['latitude', 'longitude'], name='idx_users_location'),
+        ]
 
     def __str__(self):
         return self.username
@@ -119,6 +124,13 @@ class Dispute(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            # Moderation queue: disputes in a status, newest first (keyset on created_at, id)
+            models.Index(fields=['status', 'created_at', 'id'], name='idx_dispute_status_created'),
+            models.Index(fields=['created_at', 'id'], name='idx_dispute_created'),
+        ]
+    
     def __str__(self):
         return f"Dispute #{self.id} - {self.title} ({self.status})"
 
@@ -129,6 +141,12 @@ class DisputeMessage(models.Model):
     attachments = models.JSONField(default=list, blank=True)  # List of file URLs
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            # Dispute threads paged newest first
+            models.Index(fields=['dispute', 'created_at', 'id'], name='idx_dispute_msg_thread'),
+        ]
+    
     def __str__(self):
         return f"Message from {self.sender.username} in Dispute #{self.dispute.id}"
 
@@ -143,6 +161,7 @@ class Tool(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField()
     image = models.ImageField(upload_to='tool_images/', null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True)  # Thumbnails, see api.thumbnails
     pricing_type = models.CharField(max_length=20, choices=PRICING_TYPE_CHOICES, default='daily')
     price_per_hour = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
     price_per_day = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
@@ -169,23 +188,25 @@ class Tool(models.Model):
     longitude = models.DecimalField(max_digits=11, decimal_places=8, null=True, blank=True)
     location_updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Bounding-box prefilter for near-location search
+            models.Index(fields=['latitude', 'longitude', 'available'], name='idx_tools_location_available'),
+        ]
+
     def __str__(self):
         return self.name
 
     def get_price_for_duration(self, duration_hours):
         """Calculate price based on duration and pricing type"""
-        if self.pricing_type == 'hourly':
-            return self.price_per_hour * duration_hours
-        elif self.pricing_type == 'daily':
-            days = max(1, duration_hours / 24)
-            return self.price_per_day * days
-        elif self.pricing_type == 'weekly':
-            weeks = max(1, duration_hours / (24 * 7))
-            return self.price_per_week * weeks
-        elif self.pricing_type == 'monthly':
-            months = max(1, duration_hours / (24 * 30))
-            return self.price_per_month * months
-        return 0
+        from .pricing import base_price
+        price = base_price(self.pricing_type, {
+            'price_per_hour': self.price_per_hour,
+            'price_per_day': self.price_per_day,
+            'price_per_week': self.price_per_week,
+            'price_per_month': self.price_per_month,
+        }, duration_hours)
+        return price if price is not None else 0
 
     def calculate_distance_to(self, lat, lng):
         """Calculate distance to another point using Haversine formula"""
@@ -243,6 +264,16 @@ class RentalTransaction(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
     # Remove updated_at as it doesn't exist in the database
+
+    class Meta:
+        indexes = [
+            # Conflict checks: tool + status IN (...) + overlapping date range
+            models.Index(fields=['tool', 'status', 'start_date', 'end_date'], name='idx_availability_check'),
+            # Calendars and rollups: every rental of a tool in a date window
+            models.Index(fields=['tool', 'start_date', 'end_date'], name='idx_rental_tool_dates'),
+            models.Index(fields=['status', 'start_date', 'end_date'], name='idx_rental_status_dates'),
+            models.Index(fields=['start_date', 'end_date'], name='idx_rental_transactions_dates'),
+        ]
     
     def __str__(self):
         return f"Rental {self.id}: {self.tool.name} by {self.borrower.username if self.borrower else 'Unknown'}"
@@ -304,6 +335,12 @@ class Feedback(models.Model):
     is_public = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Reviews per rental; including rating lets tool averages be read from the index
+            models.Index(fields=['rental_transaction', 'rating'], name='idx_feedback_rental_rating'),
+        ]
     
     def __str__(self):
         return f"Feedback from {self.reviewer.username if self.reviewer else 'Unknown'} to {self.reviewed_user.username if self.reviewed_user else 'Unknown'}"
@@ -330,6 +367,12 @@ class BorrowRequest(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     expires_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Owner inbox and expiry sweeps: pending requests for an owner by expiry
+            models.Index(fields=['owner', 'status', 'expires_at'], name='idx_borrow_owner_status_exp'),
+        ]
     
     def __str__(self):
         return f"Borrow Request {self.id}: {self.tool.name} by {self.borrower.username if self.borrower else 'Unknown'}"
@@ -344,8 +387,10 @@ class BorrowRequest(models.Model):
         self.save()
         
         # Calculate total price
-        days = (self.end_date - self.start_date).days + 1
-        total_price = self.tool.get_price_for_duration(days * 24)
+        from .pricing import duration_hours, DEFAULT_DEPOSIT
+        total_price = self.tool.get_price_for_duration(
+            duration_hours(self.start_date, self.end_date, self.start_time, self.end_time)
+        )
         
         # Create rental transaction
         rental = RentalTransaction.objects.create(
@@ -363,7 +408,7 @@ class BorrowRequest(models.Model):
         # Create deposit
         Deposit.objects.create(
             rental_transaction=rental,
-            amount=50.00,
+            amount=DEFAULT_DEPOSIT,
             status='paid'
         )
         
@@ -437,6 +482,11 @@ class HourlyAvailability(models.Model):
     
     class Meta:
         unique_together = ['tool', 'date', 'hour']
+        indexes = [
+            # Slot lookups by tool and date filter on the flags; the unique key alone
+            # already serves plain (tool, date) lookups
+            models.Index(fields=['tool', 'date', 'is_booked', 'is_available'], name='idx_hourly_tool_date_state'),
+        ]
     
     def __str__(self):
         return f"Hourly Availability for {self.tool.name} on {self.date} at {self.hour}:00"
@@ -444,9 +494,17 @@ class HourlyAvailability(models.Model):
 class Message(models.Model):
     rental_transaction = models.ForeignKey(RentalTransaction, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(UserProfile, on_delete=models.CASCADE, null=True, blank=True)
+    # The other party of the rental; filled in from the rental on save (see api.messaging)
+    recipient = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='messages_received', null=True, blank=True)
     message = models.TextField()
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a rental's thread, newest first
+            models.Index(fields=['rental_transaction', 'created_at', 'id'], name='idx_message_thread'),
+        ]
     
     def __str__(self):
         return f"Message from {self.sender.username if self.sender else 'Unknown'} in Rental {self.rental_transaction.id}"
@@ -489,3 +547,110 @@ class ApplicationReview(models.Model):
     
     def __str__(self):
         return f"Application Review for {self.user.username} by {self.reviewer.username if self.reviewer else 'System'}"
+
+
+class ToolDailyRollup(models.Model):
+    """Per tool, per day rental totals maintained incrementally by api.rollups"""
+    tool = models.ForeignKey(Tool, on_delete=models.CASCADE, related_name='daily_rollups')
+    owner = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='tool_daily_rollups', null=True, blank=True)
+    day = models.DateField()
+    rental_count = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    booked_days = models.IntegerField(default=0)
+    deposits_forfeited = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    
+    class Meta:
+        unique_together = ['tool', 'day']
+    
+    def __str__(self):
+        return f"Rollup for {self.tool_id} on {self.day}"
+
+class OwnerMonthlyRollup(models.Model):
+    """Per owner, per month rental totals maintained incrementally by api.rollups"""
+    owner = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='monthly_rollups')
+    month = models.DateField()  # First day of the month
+    rental_count = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    booked_days = models.IntegerField(default=0)
+    deposits_forfeited = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    
+    class Meta:
+        unique_together = ['owner', 'month']
+    
+    def __str__(self):
+        return f"Rollup for owner {self.owner_id} in {self.month:%Y-%m}"
+
+class UnreadMessageCounter(models.Model):
+    """Unread messages per recipient, maintained incrementally by api.messaging"""
+    user = models.OneToOneField(UserProfile, on_delete=models.CASCADE, primary_key=True, related_name='unread_message_counter')
+    unread = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.unread} unread for user {self.user_id}"
+
+class OutboxEvent(models.Model):
+    """A domain event written in the same transaction as the change it describes; delivered by api.outbox"""
+    topic = models.CharField(max_length=100)
+    aggregate_type = models.CharField(max_length=50)
+    aggregate_id = models.BigIntegerField()
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Outbox event {self.id}: {self.topic} for {self.aggregate_type} {self.aggregate_id}"
+
+class OutboxCursor(models.Model):
+    """The last outbox event one consumer has processed"""
+    consumer = models.CharField(max_length=50, primary_key=True)
+    last_event_id = models.BigIntegerField(default=0)
+    attempts = models.IntegerField(default=0)  # Failed tries at the event after last_event_id
+    last_error = models.TextField(blank=True, default='')
+    gaps = models.JSONField(default=dict, blank=True)  # {skipped event id: unix time to stop waiting for it}
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Outbox cursor {self.consumer} at {self.last_event_id}"
+
+class ChunkedUpload(models.Model):
+    """A file sent in chunks through api.uploads, attached to a verification or dispute once complete"""
+    STATUS_CHOICES = [
+        ('uploading', 'Uploading'),
+        ('complete', 'Complete'),
+        ('attached', 'Attached'),
+    ]
+    
+    PURPOSE_CHOICES = [
+        ('verification_document', 'Verification Document'),
+        ('dispute_evidence', 'Dispute Evidence'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='chunked_uploads', null=True, blank=True)
+    purpose = models.CharField(max_length=30, choices=PURPOSE_CHOICES)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64)
+    offset = models.BigIntegerField(default=0)  # Bytes received so far
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    file = models.FileField(upload_to='uploads/%Y/%m/', blank=True)  # Set once the checksum matches
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Sweeps for abandoned uploads
+            models.Index(fields=['status', 'updated_at'], name='idx_upload_status_updated'),
+        ]
+
+    def __str__(self):
+        return f"Upload {self.id}: {self.filename} ({self.offset}/{self.size}, {self.status})"
+
+class MediaBlob(models.Model):
+    """A content-addressed media file and the number of saves referencing it, maintained by api.storage"""
+    name = models.CharField(max_length=100, primary_key=True)
+    size = models.BigIntegerField()
+    refcount = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} references)"
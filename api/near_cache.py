@@ -0,0 +1,163 @@
+"""
+Cached candidate lists for "tools near me" searches.
+
+Searches from the same neighbourhood share one cached candidate list. The
+caller's point is snapped to a CELL_DEGREES grid cell, and the radius is
+rounded up to one of RADIUS_BUCKETS. The list holds every available tool
+(id, lat, lng) within that radius of anywhere in the cell: the bucket
+radius plus the distance from the cell centre to a corner. Each caller
+then gets exact distances for their own point from the cached coordinates,
+filtered to the radius they asked for, without a query.
+
+Invalidation works on a coarser grid of TILE_DEGREES tiles. Every tile has
+a version number in the cache, and an entry's key includes the versions of
+all tiles its search box overlaps. A tool that is created, moved, toggled
+available or deleted bumps the version of its old and new tiles once the
+write commits. Every entry that could contain the tool is thereby
+replaced. Versions start from the clock in nanoseconds (``cache.add``, so
+concurrent seeds do not overwrite each other) and only ever ``incr``: a
+version key that is evicted comes back larger than before, never as a
+value some old entry was keyed on. NEAR_ME_CACHE_TTL keeps entries short-lived for writes that skip
+signals (QuerySet.update) and processes that do not share a cache.
+Radii beyond the largest bucket are not cached.
+"""
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Tool
+from . import db_router, search
+
+CELL_DEGREES = 0.01  # About 0.7 miles of latitude
+TILE_DEGREES = 1.0
+RADIUS_BUCKETS = [1, 2, 5, 10, 25, 50, 100]
+EARTH_RADIUS_MILES = 3959  # Same as Tool.calculate_distance_to
+# Tool fields that decide whether and where a tool shows up in a near-me search
+SNAPSHOT_FIELDS = ['latitude', 'longitude', 'pickup_latitude', 'pickup_longitude', 'available', 'pricing_type']
+
+
+def distance_miles(lat1, lng1, lat2, lng2):
+    """Haversine distance in miles, as Tool.calculate_distance_to computes it"""
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    a = (math.sin(math.radians(lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(math.radians(lng2 - lng1) / 2) ** 2)
+    return EARTH_RADIUS_MILES * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def _tile(lat, lng):
+    return math.floor(lat / TILE_DEGREES), math.floor(lng / TILE_DEGREES)
+
+
+def _version_key(tile):
+    return f'near-me-version:{tile[0]}:{tile[1]}'
+
+
+def _tiles_around(lat, lng, radius):
+    """Every tile the bounding box of a ``radius``-mile circle overlaps"""
+    lat_delta = radius / search.MILES_PER_DEGREE_LAT
+    lng_delta = radius / (search.MILES_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+    south, west = _tile(lat - lat_delta, lng - lng_delta)
+    north, east = _tile(lat + lat_delta, lng + lng_delta)
+    return [(row, column) for row in range(south, north + 1) for column in range(west, east + 1)]
+
+
+def bump_location(lat, lng):
+    """Invalidate every cached search that could include a tool at (lat, lng)"""
+    if lat is None or lng is None:
+        return
+    key = _version_key(_tile(float(lat), float(lng)))
+    cache.add(key, time.time_ns(), None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted since the add: a new seed is still above every earlier version
+        cache.add(key, time.time_ns(), None)
+
+
+def _versions(keys):
+    """Current version of each tile key, seeding the ones the cache does not have"""
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if not missing:
+        return [versions[key] for key in keys]
+    seed = time.time_ns()
+    for key in missing:
+        cache.add(key, seed, None)
+    versions.update(cache.get_many(missing))
+    # Still missing (evicted again): the fresh seed only misses, it cannot match an old entry
+    return [versions.get(key, seed) for key in keys]
+
+
+def tool_snapshot(tool):
+    return tuple(getattr(tool, field) for field in SNAPSHOT_FIELDS)
+
+
+def stored_snapshot(tool_id):
+    """Snapshot of a tool as currently stored, for instances loaded with deferred fields"""
+    row = Tool.objects.filter(pk=tool_id).values_list(*SNAPSHOT_FIELDS).first()
+    return tuple(row) if row else None
+
+
+def tool_changed(old_snapshot, new_snapshot):
+    """Bump the tiles a tool left and entered; the old snapshot of a new tool and the new one of a deleted tool are None"""
+    if old_snapshot == new_snapshot:
+        return
+    for snapshot in {old_snapshot, new_snapshot} - {None}:
+        bump_location(snapshot[0], snapshot[1])
+
+
+def _load(lat, lng, radius, pricing_type):
+    """[(tool id, lat, lng)] of available tools within ``radius`` miles of (lat, lng)"""
+    tools = Tool.objects.filter(available=True, pickup_latitude__isnull=False, pickup_longitude__isnull=False)
+    if pricing_type:
+        tools = tools.filter(pricing_type=pricing_type)
+    rows = search.apply_bounding_box(tools, lat, lng, radius).values_list(
+        'id', 'latitude', 'longitude', 'pickup_latitude', 'pickup_longitude'
+    )
+    candidates = []
+    for tool_id, tool_lat, tool_lng, pickup_lat, pickup_lng in rows:
+        # Distance is measured from latitude/longitude but only tools with a pickup point are listed
+        if not (tool_lat and tool_lng and pickup_lat and pickup_lng):
+            continue
+        tool_lat, tool_lng = float(tool_lat), float(tool_lng)
+        if distance_miles(tool_lat, tool_lng, lat, lng) <= radius:
+            candidates.append((tool_id, tool_lat, tool_lng))
+    return candidates
+
+
+def candidates(lat, lng, radius, pricing_type=None):
+    """[(tool id, lat, lng)] covering every tool within ``radius`` miles of (lat, lng), usually from cache"""
+    bucket = next((size for size in RADIUS_BUCKETS if size >= radius), None)
+    if bucket is None:
+        return _load(lat, lng, radius, pricing_type)
+
+    row, column = math.floor(lat / CELL_DEGREES), math.floor(lng / CELL_DEGREES)
+    center_lat, center_lng = (row + 0.5) * CELL_DEGREES, (column + 0.5) * CELL_DEGREES
+    # The corner nearer the equator is the farthest from the centre
+    corner_lat = row * CELL_DEGREES if center_lat >= 0 else (row + 1) * CELL_DEGREES
+    reach = bucket + distance_miles(center_lat, center_lng, corner_lat, column * CELL_DEGREES)
+
+    version_keys = [_version_key(tile) for tile in _tiles_around(center_lat, center_lng, reach)]
+    digest = hashlib.sha1(','.join(str(version) for version in _versions(version_keys)).encode()).hexdigest()[:16]
+    key = f'near-me:{row}:{column}:{bucket}:{pricing_type or ""}:{digest}'
+    cached = None if db_router.fresh_reads() else cache.get(key)
+    if cached is None:
+        cached = _load(center_lat, center_lng, reach, pricing_type)
+        cache.set(key, cached, getattr(settings, 'NEAR_ME_CACHE_TTL', 60))
+    return cached
+
+
+def nearby(lat, lng, radius, pricing_type=None):
+    """{tool id: exact distance in miles} for tools within ``radius`` of the caller's own point"""
+    lat, lng, radius = float(lat), float(lng), float(radius)
+    pricing_type = (pricing_type or '').strip().lower()
+    distances = {}
+    for tool_id, tool_lat, tool_lng in candidates(lat, lng, radius, pricing_type):
+        distance = distance_miles(tool_lat, tool_lng, lat, lng)
+        if distance <= radius:
+            distances[tool_id] = distance
+    return distances
@@ -0,0 +1,62 @@
+"""
+Email notifications, sent by the outbox ``notifications`` consumer.
+
+Each outbox topic maps to the user ids in the event payload that should
+hear about it and a subject/body template filled in from the payload. Users
+without an email address are skipped. With at-least-once delivery, a
+retried batch can send an email twice. For notices like these that is
+acceptable, and it is better than losing the email.
+"""
+from django.conf import settings
+from django.core.mail import send_mail
+
+from . import outbox
+from .models import UserProfile
+
+# topic -> (payload keys holding recipient user ids, subject, body)
+TEMPLATES = {
+    'borrow_request.created': (
+        ['owner_id'],
+        'New borrow request for {tool_name}',
+        '{borrower_name} would like to borrow {tool_name} from {start_date} to {end_date}.',
+    ),
+    'borrow_request.approved': (
+        ['borrower_id'],
+        'Your request for {tool_name} was approved',
+        'Your rental of {tool_name} from {start_date} to {end_date} is confirmed.',
+    ),
+    'deposit.paid': (
+        ['borrower_id', 'owner_id'],
+        'Deposit received for {tool_name}',
+        'A deposit of ${amount} was paid for rental #{rental_id} (reference {reference}).',
+    ),
+    'deposit.returned': (
+        ['borrower_id'],
+        'Deposit returned for {tool_name}',
+        'Your deposit of ${amount} for rental #{rental_id} has been returned (reference {reference}).',
+    ),
+    'deposit.forfeited': (
+        ['borrower_id', 'owner_id'],
+        'Deposit forfeited for {tool_name}',
+        '${amount} of the deposit for rental #{rental_id} was forfeited: {reason}',
+    ),
+    'dispute.resolved': (
+        ['initiator_id', 'borrower_id', 'owner_id'],
+        'Dispute #{dispute_id} {status}',
+        'The dispute "{title}" on rental #{rental_id} was marked {status}.\n\n{resolution}',
+    ),
+}
+
+
+@outbox.consumer('notifications', topics=TEMPLATES)
+def send_notification(event):
+    recipient_keys, subject, body = TEMPLATES[event.topic]
+    user_ids = {event.payload.get(key) for key in recipient_keys} - {None}
+    emails = UserProfile.objects.filter(id__in=user_ids).exclude(email='').values_list('email', flat=True)
+    for email in emails:
+        send_mail(
+            subject.format(**event.payload),
+            body.format(**event.payload),
+            settings.DEFAULT_FROM_EMAIL,
+            [email],
+        )
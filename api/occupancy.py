@@ -0,0 +1,112 @@
+"""
+Owner-level tools x days occupancy heatmap.
+
+Sources for all of an owner's tools come from availability_calendar's
+one-query-per-table loader and are painted into a NumPy int8 matrix with
+slice operations, so the work per tool is proportional to its number of
+bookings rather than the window length. Rows are painted from the same
+``day_spans`` mapping and status codes as the single-tool calendar and are
+returned either run-length encoded or as base64 bitmaps of occupied
+(partial or booked) days.
+"""
+import base64
+
+import numpy as np
+
+from .availability_calendar import AVAILABLE, BOOKED, CLOSED, PARTIAL, STATUS_NAMES, DAY, load_sources, day_spans
+from .models import Tool
+
+RLE = 'rle'
+BITMAP = 'bitmap'
+
+
+def _span(start_date, days, range_start, range_end):
+    first = max((range_start - start_date).days, 0)
+    last = min((range_end - start_date).days + 1, days)
+    return first, last
+
+
+def _raise(row, first, last, code):
+    """Raise row[first:last] to ``code`` where it has lower precedence"""
+    if first < last:
+        np.maximum(row[first:last], code, out=row[first:last])
+
+
+def build_matrix(tool_ids, start_date, end_date):
+    """Return an int8 matrix of day status codes, one row per tool id"""
+    days = (end_date - start_date).days + 1
+    matrix = np.full((len(tool_ids), days), AVAILABLE, dtype=np.int8)
+    if not tool_ids:
+        return matrix
+
+    sources = load_sources(tool_ids, start_date, end_date, DAY)
+    ordinals = np.arange(start_date.toordinal(), start_date.toordinal() + days)
+    weekdays = (np.arange(days) + start_date.weekday()) % 7
+
+    for row_index, tool_id in enumerate(tool_ids):
+        tool_sources = sources[tool_id]
+        row = matrix[row_index]
+
+        if tool_sources['recurring']:
+            open_days = np.zeros(days, dtype=bool)
+            for pattern_type, pattern_start, pattern_end, days_of_week, _, _ in tool_sources['recurring']:
+                matches = ordinals >= pattern_start.toordinal()
+                if pattern_end is not None:
+                    matches &= ordinals <= pattern_end.toordinal()
+                if pattern_type != 'daily':
+                    matches &= np.isin(weekdays, days_of_week or [])
+                open_days |= matches
+            for open_start, open_end in tool_sources['open']:
+                first, last = _span(start_date, days, open_start, open_end)
+                open_days[first:last] = True
+            row[~open_days] = CLOSED
+
+        for range_start, range_end, code in day_spans(tool_sources):
+            _raise(row, *_span(start_date, days, range_start, range_end), code)
+
+    return matrix
+
+
+def encode_runs(row):
+    """Run-length encode one matrix row as [[status name, count], ...]"""
+    if not len(row):
+        return []
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(row)) + 1))
+    lengths = np.diff(np.append(starts, len(row)))
+    return [[STATUS_NAMES[row[start]], int(length)] for start, length in zip(starts, lengths)]
+
+
+def occupied(matrix):
+    """Partial or booked days; owner-blocked days are not occupancy"""
+    return (matrix == PARTIAL) | (matrix == BOOKED)
+
+
+def encode_bitmap(row):
+    """Base64 of the packed bits (MSB first) marking occupied days"""
+    return base64.b64encode(np.packbits(occupied(row)).tobytes()).decode('ascii')
+
+
+def owner_heatmap(owner_id, start_date, end_date, encoding=RLE):
+    """Occupancy of every tool an owner lists over the window"""
+    if encoding not in (RLE, BITMAP):
+        raise ValueError('encoding must be "rle" or "bitmap"')
+    tools = list(Tool.objects.filter(owner_id=owner_id).order_by('id').values_list('id', 'name'))
+    tool_ids = [tool_id for tool_id, _ in tools]
+    matrix = build_matrix(tool_ids, start_date, end_date)
+    occupied_days = occupied(matrix)
+
+    rows = []
+    for row_index, (tool_id, name) in enumerate(tools):
+        row = matrix[row_index]
+        rows.append({
+            'tool_id': tool_id,
+            'tool_name': name,
+            'occupancy_rate': round(float(occupied_days[row_index].mean()), 4) if len(row) else 0.0,
+            encoding: encode_runs(row) if encoding == RLE else encode_bitmap(row),
+        })
+
+    return {
+        'days': matrix.shape[1],
+        'occupied_tools_per_day': occupied_days.sum(axis=0).astype(int).tolist(),
+        'tools': rows,
+    }
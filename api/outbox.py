@@ -0,0 +1,183 @@
+"""
+Transactional outbox for side effects of borrow-request, deposit and
+dispute changes.
+
+Views call ``emit`` inside the same ``transaction.atomic()`` block as the
+state change, so an OutboxEvent row exists exactly when the change
+committed. Consumers registered with ``@consumer`` (notifications, ...)
+are run later by ``manage.py process_outbox``. They never run inside the
+request, so a slow or failing consumer does not hold up the API.
+
+Every consumer has an OutboxCursor holding the last event id it processed.
+``drain`` locks the cursor row, hands the consumer the next batch in id
+order and moves the cursor forward in the same transaction. Delivery is
+at least once: if the worker dies before that commit, the batch is
+delivered again, so handlers must be idempotent. A failing event stops the
+consumer's batch and is retried on the next run; after OUTBOX_MAX_ATTEMPTS
+failures it is skipped and logged. The error is kept on the cursor.
+
+Ids are assigned at insert, but transactions commit in any order. Events
+are therefore only read once they are OUTBOX_SETTLE_SECONDS old, which
+covers most transactions that are still open. For slower ones, every id
+the cursor moves past without seeing is kept on the cursor as a gap and
+looked up again on each drain for OUTBOX_GAP_SECONDS. An event that shows
+up in a gap is delivered ahead of the next batch and logged as late. Most
+gaps are ids of rolled-back inserts and simply expire. An event that
+commits after its gap expired is not delivered.
+"""
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import OutboxEvent, OutboxCursor
+
+logger = logging.getLogger(__name__)
+
+# Gaps tracked per cursor; beyond this the oldest are given up on
+MAX_GAPS = 1000
+
+
+class Consumer:
+    def __init__(self, name, topics, handler):
+        self.name = name
+        self.topics = tuple(topics) if topics else None
+        self.handler = handler
+
+    def wants(self, event):
+        return self.topics is None or event.topic in self.topics
+
+
+CONSUMERS = {}
+
+
+def consumer(name, topics=None):
+    """Register ``handler(event)`` to receive outbox events (optionally only ``topics``)"""
+    def register(handler):
+        CONSUMERS[name] = Consumer(name, topics, handler)
+        return handler
+    return register
+
+
+def emit(topic, instance, **payload):
+    """Record an event about ``instance``; call inside the transaction that changes it"""
+    return OutboxEvent.objects.create(
+        topic=topic,
+        aggregate_type=instance._meta.model_name,
+        aggregate_id=instance.pk,
+        payload=json.loads(json.dumps(payload, cls=DjangoJSONEncoder)),
+    )
+
+
+def _locked_cursor(name):
+    cursor = OutboxCursor.objects.select_for_update().filter(consumer=name).first()
+    if cursor is not None:
+        return cursor
+    # A new consumer starts at the current end of the outbox rather than replaying history
+    latest = OutboxEvent.objects.aggregate(latest=Max('id'))['latest'] or 0
+    try:
+        with transaction.atomic():
+            OutboxCursor.objects.create(consumer=name, last_event_id=latest)
+    except IntegrityError:
+        pass
+    return OutboxCursor.objects.select_for_update().get(consumer=name)
+
+
+def _late_events(cursor, batch_size, now):
+    """Events that committed into the cursor's gaps; expired gaps are dropped"""
+    if not cursor.gaps:
+        return []
+    late = list(OutboxEvent.objects.filter(id__in=[int(event_id) for event_id in cursor.gaps])
+                .order_by('id')[:batch_size])
+    found = {str(event.id) for event in late}
+    cursor.gaps = {event_id: deadline for event_id, deadline in cursor.gaps.items()
+                   if event_id in found or deadline > now}
+    return late
+
+
+def _skip_to(cursor, event_id, now):
+    """Move the cursor to ``event_id``, remembering the ids in between as gaps"""
+    deadline = now + settings.OUTBOX_GAP_SECONDS
+    for missing in range(max(cursor.last_event_id + 1, event_id - MAX_GAPS), event_id):
+        cursor.gaps[str(missing)] = deadline
+    if len(cursor.gaps) > MAX_GAPS:
+        dropped = sorted(cursor.gaps, key=int)[:len(cursor.gaps) - MAX_GAPS]
+        logger.warning('Outbox consumer %s stops waiting for %s skipped event ids', cursor.consumer, len(dropped))
+        for missing in dropped:
+            del cursor.gaps[missing]
+    cursor.last_event_id = event_id
+
+
+def drain(name, batch_size=None):
+    """Deliver one batch of events to consumer ``name``; returns how many the cursor moved past"""
+    registered = CONSUMERS[name]
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    settled_before = timezone.now() - timedelta(seconds=settings.OUTBOX_SETTLE_SECONDS)
+    now = timezone.now().timestamp()
+    with transaction.atomic():
+        cursor = _locked_cursor(name)
+        gaps_before = dict(cursor.gaps)
+        events = _late_events(cursor, batch_size, now)
+        if events:
+            logger.warning('Outbox consumer %s found %s events that committed after OUTBOX_SETTLE_SECONDS: %s',
+                           name, len(events), ', '.join(str(event.id) for event in events))
+        if len(events) < batch_size:
+            # Events of other topics are read too, so the cursor moves past them and purge is not held back
+            events += list(OutboxEvent.objects.filter(id__gt=cursor.last_event_id, created_at__lte=settled_before)
+                           .order_by('id')[:batch_size - len(events)])
+        done = 0
+        for event in events:
+            late = str(event.id) in cursor.gaps
+            if registered.wants(event):
+                try:
+                    # Savepoint per event so a failure keeps the writes of the events before it
+                    with transaction.atomic():
+                        registered.handler(event)
+                    cursor.attempts = 0
+                except Exception as e:
+                    cursor.attempts += 1
+                    cursor.last_error = f'event {event.id} ({event.topic}): {e}'
+                    if cursor.attempts < settings.OUTBOX_MAX_ATTEMPTS:
+                        logger.warning('Outbox consumer %s failed on event %s (attempt %s): %s',
+                                       name, event.id, cursor.attempts, e)
+                        break
+                    logger.error('Outbox consumer %s skipping event %s after %s attempts: %s',
+                                 name, event.id, cursor.attempts, e)
+                    cursor.attempts = 0
+            if late:
+                del cursor.gaps[str(event.id)]
+            else:
+                _skip_to(cursor, event.id, now)
+            done += 1
+        if events or cursor.gaps != gaps_before:
+            cursor.save()
+    return done
+
+
+def backlog():
+    """{consumer name: events waiting} for every registered consumer"""
+    positions = dict(OutboxCursor.objects.filter(consumer__in=CONSUMERS).values_list('consumer', 'last_event_id'))
+    latest = OutboxEvent.objects.aggregate(latest=Max('id'))['latest'] or 0
+    waiting = {}
+    for name, registered in CONSUMERS.items():
+        events = OutboxEvent.objects.filter(id__gt=positions.get(name, latest))
+        if registered.topics:
+            events = events.filter(topic__in=registered.topics)
+        waiting[name] = events.count()
+    return waiting
+
+
+def purge(older_than_days):
+    """Delete events every consumer has processed and that are older than ``older_than_days``"""
+    oldest_needed = (OutboxCursor.objects.filter(consumer__in=CONSUMERS)
+                     .aggregate(position=Min('last_event_id'))['position'])
+    events = OutboxEvent.objects.filter(created_at__lt=timezone.now() - timedelta(days=older_than_days))
+    if oldest_needed is not None:
+        events = events.filter(id__lte=oldest_needed)
+    deleted, _ = events.delete()
+    return deleted
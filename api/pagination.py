@@ -0,0 +1,57 @@
+"""
+Keyset pagination over (created_at, id), newest first.
+
+Cursors are opaque url-safe strings encoding the last row of the previous
+page. The next page is read with ``created_at < c OR (created_at = c AND
+id < i)``, which an index ending in (created_at, id) serves as a range
+scan. Every page costs the same, however deep the client pages, and rows
+inserted meanwhile never shift or repeat rows the way OFFSET paging does.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 30
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(created_at, row_id):
+    raw = f'{created_at.isoformat()}|{row_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+
+def page_size(limit, default=DEFAULT_PAGE_SIZE):
+    """Clamp a client-supplied page size; raises ValueError when it is not a number"""
+    return min(max(1, int(limit if limit not in (None, '') else default)), MAX_PAGE_SIZE)
+
+
+def keyset_page(queryset, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    One page of ``queryset`` newest first, as ``(rows, next_cursor)``.
+
+    Works on model querysets and ``values()`` querysets alike (the rows must
+    expose ``created_at`` and ``id``). ``next_cursor`` is None on the last page.
+    """
+    limit = page_size(limit)
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=row_id))
+    rows = list(queryset.order_by('-created_at', '-id')[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        if isinstance(last, dict):
+            next_cursor = encode_cursor(last['created_at'], last['id'])
+        else:
+            next_cursor = encode_cursor(last.created_at, last.id)
+    return rows[:limit], next_cursor
@@ -0,0 +1,117 @@
+"""
+Exact Decimal price quotes for one or many tools over a rental window.
+
+Prices follow Tool.pricing_type: hourly tools are charged per hour, daily /
+weekly / monthly tools pro rata per day (24h), week (168h) or month (720h)
+with a minimum of one unit. Quotes add the delivery fee when requested and
+the fixed security deposit, and are rounded to cents with ROUND_HALF_UP.
+"""
+import math
+from datetime import date, datetime, time
+from decimal import Decimal, ROUND_HALF_UP
+
+from .models import Tool
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+DEFAULT_DEPOSIT = Decimal('50.00')
+
+# pricing_type -> (price column, hours per billing unit)
+PRICE_COLUMNS = {
+    'hourly': ('price_per_hour', 1),
+    'daily': ('price_per_day', 24),
+    'weekly': ('price_per_week', 24 * 7),
+    'monthly': ('price_per_month', 24 * 30),
+}
+QUOTE_FIELDS = ['id', 'pricing_type', 'price_per_hour', 'price_per_day', 'price_per_week',
+                'price_per_month', 'delivery_available', 'delivery_fee']
+
+
+def _as_date(value):
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _as_time(value):
+    if not value:
+        return None
+    return time.fromisoformat(value) if isinstance(value, str) else value
+
+
+def duration_hours(start_date, end_date, start_time=None, end_time=None):
+    """
+    Billable hours for a rental window.
+
+    Without times the window covers whole days inclusive of both ends (the
+    convention BorrowRequest.approve uses); with times it is the exact span
+    rounded up to the next hour.
+    """
+    start_date = _as_date(start_date)
+    end_date = _as_date(end_date)
+    start_time = _as_time(start_time)
+    end_time = _as_time(end_time)
+    if end_date < start_date:
+        raise ValueError('end_date must not be before start_date')
+
+    if start_time and end_time:
+        span = datetime.combine(end_date, end_time) - datetime.combine(start_date, start_time)
+        if span.total_seconds() <= 0:
+            raise ValueError('Rental window must end after it starts')
+        return max(1, math.ceil(span.total_seconds() / 3600))
+    return ((end_date - start_date).days + 1) * 24
+
+
+def base_price(pricing_type, prices, hours):
+    """
+    Price for ``hours`` given a mapping of price column -> Decimal.
+
+    Returns None when the tool has no price for its pricing type.
+    """
+    column, unit_hours = PRICE_COLUMNS.get(pricing_type, (None, None))
+    if column is None or prices.get(column) is None:
+        return None
+    units = Decimal(hours) / Decimal(unit_hours)
+    if unit_hours > 1:
+        units = max(Decimal(1), units)
+    return (Decimal(prices[column]) * units).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def quote_row(row, hours, include_delivery=False, deposit=DEFAULT_DEPOSIT):
+    """Quote one tool from a dict of its QUOTE_FIELDS"""
+    price = base_price(row['pricing_type'], row, hours)
+    delivery_fee = ZERO
+    if include_delivery and row.get('delivery_available'):
+        delivery_fee = Decimal(row.get('delivery_fee') or ZERO).quantize(CENT, rounding=ROUND_HALF_UP)
+    return {
+        'tool_id': row['id'],
+        'pricing_type': row['pricing_type'],
+        'hours': hours,
+        'base_price': price,
+        'delivery_fee': delivery_fee,
+        'deposit': deposit,
+        'total': price + delivery_fee + deposit if price is not None else None,
+    }
+
+
+def format_quote(quote):
+    """Render a quote for a JSON response, keeping money amounts as exact decimal strings"""
+    if quote is None:
+        return None
+    return {key: str(value) if isinstance(value, Decimal) else value for key, value in quote.items()}
+
+
+def quote_tools(tools, start_date, end_date, start_time=None, end_time=None, include_delivery=False):
+    """
+    Quote already-loaded tools (model instances or QUOTE_FIELDS dicts) without touching the DB.
+    """
+    hours = duration_hours(start_date, end_date, start_time, end_time)
+    quotes = {}
+    for tool in tools:
+        row = tool if isinstance(tool, dict) else {field: getattr(tool, field) for field in QUOTE_FIELDS}
+        quotes[row['id']] = quote_row(row, hours, include_delivery)
+    return quotes
+
+
+def quote_tool_ids(tool_ids, start_date, end_date, start_time=None, end_time=None, include_delivery=False):
+    """Load the price columns for ``tool_ids`` in one query and quote them all"""
+    rows = Tool.objects.filter(id__in=tool_ids).values(*QUOTE_FIELDS)
+    return quote_tools(rows, start_date, end_date, start_time, end_time, include_delivery)
@@ -0,0 +1,148 @@
+"""
+Capture the SQL a code path runs and check its query plans.
+
+``capture_queries()`` records every SELECT (with its parameters and the
+alias it ran on) while a block executes. ``explain()`` runs
+``EXPLAIN QUERY PLAN`` on SQLite or ``EXPLAIN`` on MySQL and normalizes
+each step to ``(table, index, full_scan)``, with subquery aliases (U0, U1,
+...) mapped back to table names. The check_query_plans command uses these
+to fail when a hot path stops using its index or scans a large table.
+"""
+import re
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+# Tables that grow with usage; a full scan of any of them on a hot path is a regression
+LARGE_TABLES = {
+    'api_tool',
+    'api_rentaltransaction',
+    'api_borrowrequest',
+    'api_hourlyavailability',
+    'api_feedback',
+    'api_deposit',
+}
+
+# "api_rentaltransaction" U0 / `api_rentaltransaction` U0
+ALIAS_PATTERN = re.compile(r'[`"](\w+)[`"]\s+(?:AS\s+)?([A-Z]\d+)\b')
+SQLITE_STEP = re.compile(r'^(SCAN|SEARCH) (\S+)(?: AS (\S+))?(.*)$')
+SQLITE_INDEX = re.compile(r'USING (?:COVERING )?INDEX (\w+)')
+MAX_SQL_SHOWN = 500
+
+
+class PlanStep:
+    """One table access in a query plan"""
+
+    def __init__(self, table, index, full_scan, detail):
+        self.table = table
+        self.index = index
+        self.full_scan = full_scan
+        self.detail = detail
+
+    def __repr__(self):
+        return f'PlanStep({self.table!r}, index={self.index!r}, full_scan={self.full_scan})'
+
+
+class CapturedQuery:
+    def __init__(self, alias, sql, params):
+        self.alias = alias
+        self.sql = sql
+        self.params = params
+        self.plan = None
+
+
+@contextmanager
+def capture_queries():
+    """Yield a list that collects every SELECT run on any connection inside the block"""
+    captured = []
+
+    def recorder(alias):
+        def wrapper(execute, sql, params, many, context):
+            if not many and sql.lstrip().upper().startswith('SELECT'):
+                captured.append(CapturedQuery(alias, sql, params))
+            return execute(sql, params, many, context)
+        return wrapper
+
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(recorder(alias)))
+        yield captured
+
+
+def table_aliases(sql):
+    return {alias: table for table, alias in ALIAS_PATTERN.findall(sql)}
+
+
+def explain(query):
+    """The plan of a captured query as a list of PlanSteps"""
+    connection = connections[query.alias]
+    aliases = table_aliases(query.sql)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + query.sql, query.params)
+            steps = _sqlite_steps(cursor.fetchall(), aliases)
+        elif connection.vendor == 'mysql':
+            cursor.execute('EXPLAIN ' + query.sql, query.params)
+            columns = [column[0].lower() for column in cursor.description]
+            steps = _mysql_steps([dict(zip(columns, row)) for row in cursor.fetchall()], aliases)
+        else:
+            raise NotImplementedError(f'Query plans are not supported on {connection.vendor}')
+    query.plan = steps
+    return steps
+
+
+def _sqlite_steps(rows, aliases):
+    steps = []
+    for row in rows:
+        detail = row[-1]
+        match = SQLITE_STEP.match(detail)
+        if not match:
+            continue
+        kind, name, alias, rest = match.groups()
+        table = aliases.get(alias or name, name)
+        index_match = SQLITE_INDEX.search(rest)
+        if index_match:
+            index = index_match.group(1)
+        elif 'PRIMARY KEY' in rest:
+            index = 'PRIMARY'
+        else:
+            index = None
+        # "SCAN t USING INDEX i" walks a whole index, which is still cheaper than the table
+        steps.append(PlanStep(table, index, kind == 'SCAN' and index is None and 'VIRTUAL TABLE' not in rest, detail))
+    return steps
+
+
+def _mysql_steps(rows, aliases):
+    steps = []
+    for row in rows:
+        table = row.get('table')
+        if not table or table.startswith('<'):
+            # Derived tables and unions: their inner steps are listed separately
+            continue
+        table = aliases.get(table, table)
+        detail = ', '.join(f'{key}={value}' for key, value in row.items() if value is not None)
+        steps.append(PlanStep(table, row.get('key'), row.get('type') == 'ALL', detail))
+    return steps
+
+
+def check(queries, expected=(), large_tables=LARGE_TABLES):
+    """
+    Problems found in the plans of ``queries``, as strings (empty when fine).
+
+    ``expected`` lists groups of index names; some plan must use one index
+    from every group. Names match as prefixes, so a foreign-key index can be
+    given as ``<table>_<column>`` without Django's generated hash suffix.
+    """
+    problems = []
+    used = set()
+    for query in queries:
+        steps = query.plan if query.plan is not None else explain(query)
+        for step in steps:
+            if step.index:
+                used.add(step.index)
+            if step.full_scan and step.table in large_tables:
+                problems.append(f'full scan of {step.table}: {step.detail}\n    {query.sql[:MAX_SQL_SHOWN]}')
+    for group in expected:
+        if not any(name.startswith(prefix) for name in used for prefix in group):
+            problems.append(f'none of {", ".join(group)} used (indexes seen: {", ".join(sorted(used)) or "none"})')
+    return problems
@@ -0,0 +1,85 @@
+"""
+orjson-backed drop-ins for DRF's JSONRenderer and JSONParser.
+
+FastJSONRenderer produces the same JSON as the stock renderer for
+everything the API returns. datetimes are ISO 8601 with ``Z`` for UTC,
+dates and times are ISO 8601, and aware times are rejected. Decimals that
+a serializer has not already turned into strings become numbers, and
+UUIDs, lazy strings, querysets and NumPy arrays go through DRF's own
+encoder. The only byte-level difference is the exponent format of very
+large or very small floats (``1e16`` rather than ``1e+16``), which parses
+to the same value. Three cases take the stock code path instead:
+indented output (the browsable API, ``; indent=`` in Accept), integers
+beyond 64 bits, and aware times (so they still raise the same error).
+NaN and infinity render as ``null`` instead of raising.
+
+FastJSONParser parses UTF-8 bodies with orjson. Other charsets and
+malformed bodies go through JSONParser, so clients keep getting the same
+ParseError messages. Integers beyond 64 bits parse as floats, as they
+would in a JavaScript client.
+
+Both fall back to the stock classes when orjson is not installed.
+Select them with REST_FRAMEWORK's DEFAULT_RENDERER_CLASSES and
+DEFAULT_PARSER_CLASSES. ``manage.py benchmark_json`` compares them on
+calendar and search payloads.
+"""
+import codecs
+import io
+
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer that encodes with orjson"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS,
+            )
+        except orjson.JSONEncodeError:
+            # 128-bit integers, aware times: let json produce the result or the error
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same escaping as JSONRenderer: U+2028/2029 break JavaScript string literals
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser that decodes UTF-8 bodies with orjson"""
+
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            utf8 = codecs.lookup((parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)).name == 'utf-8'
+        except LookupError:
+            utf8 = False
+        if not utf8:
+            return super().parse(stream, media_type, parser_context)
+        body = stream.read()
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            pass
+        # Let the stock parser give the exact result or ParseError message
+        return super().parse(io.BytesIO(body), media_type, parser_context)
+
@@ -0,0 +1,207 @@
+"""
+Incrementally maintained rental rollups.
+
+ToolDailyRollup (tool x day) and OwnerMonthlyRollup (owner x month) hold
+rental count, revenue, booked days and forfeited deposits. A rental's count
+and revenue land on its start date and it adds one booked day to every day
+it covers, so booked days summed over any window are exact at its edges; a
+forfeit counts on the day its DepositTransaction was recorded. Signals apply the difference between a rental's previous and new
+contribution with F() updates, so dashboards read a handful of pre-summed
+rows instead of aggregating api_rentaltransaction. Bulk writes that skip
+signals (QuerySet.update, bulk_create) are not seen; ``rebuild_rollups``
+recomputes everything from scratch after those.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import RentalTransaction, DepositTransaction, ToolDailyRollup, OwnerMonthlyRollup
+
+# Rentals in these states never happened as far as earnings are concerned
+EXCLUDED_STATUSES = ('cancelled',)
+
+TOTAL_FIELDS = ['rental_count', 'revenue', 'booked_days', 'deposits_forfeited']
+SNAPSHOT_FIELDS = ['tool_id', 'owner_id', 'start_date', 'end_date', 'total_price', 'status']
+
+
+def rental_snapshot(rental):
+    """The fields of a rental that determine its rollup contribution"""
+    return tuple(getattr(rental, field) for field in SNAPSHOT_FIELDS)
+
+
+def stored_snapshot(rental_id):
+    """Snapshot of a rental as currently stored, for instances loaded with deferred fields"""
+    row = RentalTransaction.objects.filter(pk=rental_id).values_list(*SNAPSHOT_FIELDS).first()
+    return tuple(row) if row else None
+
+
+def booked_days(start_date, end_date):
+    """Every day a rental covers, both ends included; a rental without an end date covers its start"""
+    return [start_date + timedelta(days=offset) for offset in range(((end_date or start_date) - start_date).days + 1)]
+
+
+def _contribution(snapshot):
+    """{(tool_id, owner_id, day): deltas} a rental adds to the daily rows"""
+    tool_id, owner_id, start_date, end_date, total_price, status = snapshot
+    if tool_id is None or start_date is None or status in EXCLUDED_STATUSES:
+        return {}
+    contribution = {(tool_id, owner_id, day): {'booked_days': 1} for day in booked_days(start_date, end_date)}
+    contribution.setdefault((tool_id, owner_id, start_date), {}).update(rental_count=1, revenue=Decimal(total_price or 0))
+    return contribution
+
+
+def _upsert(model, key, deltas, defaults=None):
+    """Add ``deltas`` to the row identified by ``key``, creating it on first use"""
+    updates = {field: F(field) + value for field, value in deltas.items()}
+    if model.objects.filter(**key).update(**updates):
+        return
+    if all(value <= 0 for value in deltas.values()):
+        # Nothing to subtract from: the row went with a cascade delete or a rebuild
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **(defaults or {}), **deltas)
+    except IntegrityError:
+        # Another writer created the row between our UPDATE and INSERT
+        model.objects.filter(**key).update(**updates)
+
+
+def apply_deltas(deltas):
+    """Add {(tool_id, owner_id, day): {field: delta}} to the daily rows and, summed per month, to the monthly rows"""
+    monthly = defaultdict(lambda: defaultdict(int))
+    for (tool_id, owner_id, day), fields in deltas.items():
+        fields = {field: value for field, value in fields.items() if value}
+        if not fields:
+            continue
+        _upsert(ToolDailyRollup, {'tool_id': tool_id, 'day': day}, fields, defaults={'owner_id': owner_id})
+        if owner_id is not None:
+            for field, value in fields.items():
+                monthly[(owner_id, day.replace(day=1))][field] += value
+    for (owner_id, month), fields in monthly.items():
+        fields = {field: value for field, value in fields.items() if value}
+        if fields:
+            _upsert(OwnerMonthlyRollup, {'owner_id': owner_id, 'month': month}, fields)
+
+
+def apply_delta(tool_id, owner_id, day, rental_count=0, revenue=Decimal('0'), booked_days=0, deposits_forfeited=Decimal('0')):
+    apply_deltas({(tool_id, owner_id, day): {
+        'rental_count': rental_count,
+        'revenue': revenue,
+        'booked_days': booked_days,
+        'deposits_forfeited': deposits_forfeited,
+    }})
+
+
+def rental_changed(old_snapshot, new_snapshot):
+    """Move a rental's contribution from its previous state to its current one"""
+    old = _contribution(old_snapshot) if old_snapshot else {}
+    new = _contribution(new_snapshot) if new_snapshot else {}
+    if old == new:
+        return
+    # Only the difference is written, so e.g. a price change touches one day, not the whole rental
+    deltas = defaultdict(lambda: defaultdict(int))
+    for key, fields in old.items():
+        for field, value in fields.items():
+            deltas[key][field] -= value
+    for key, fields in new.items():
+        for field, value in fields.items():
+            deltas[key][field] += value
+    apply_deltas(deltas)
+
+
+def deposit_forfeited(deposit_transaction, sign=1):
+    """Record (or with sign=-1, retract) a forfeit DepositTransaction against its rental's tool and owner"""
+    rental = RentalTransaction.objects.filter(
+        deposits__id=deposit_transaction.deposit_id
+    ).values('tool_id', 'owner_id').first()
+    if rental is None:
+        return
+    apply_delta(
+        rental['tool_id'],
+        rental['owner_id'],
+        deposit_transaction.created_at.date(),
+        deposits_forfeited=sign * Decimal(deposit_transaction.amount or 0),
+    )
+
+
+def rebuild(batch_size=5000):
+    """Recompute every rollup row from the source tables; returns (daily rows, monthly rows)"""
+    daily = defaultdict(lambda: {'owner_id': None, 'rental_count': 0, 'revenue': Decimal('0'),
+                                 'booked_days': 0, 'deposits_forfeited': Decimal('0')})
+
+    rentals = RentalTransaction.objects.exclude(status__in=EXCLUDED_STATUSES).values_list(
+        'tool_id', 'owner_id', 'start_date', 'end_date', 'total_price'
+    )
+    for tool_id, owner_id, start_date, end_date, total_price in rentals.iterator(chunk_size=batch_size):
+        row = daily[(tool_id, start_date)]
+        row['owner_id'] = row['owner_id'] or owner_id
+        row['rental_count'] += 1
+        row['revenue'] += Decimal(total_price or 0)
+        for day in booked_days(start_date, end_date):
+            row = daily[(tool_id, day)]
+            row['owner_id'] = row['owner_id'] or owner_id
+            row['booked_days'] += 1
+
+    forfeits = DepositTransaction.objects.filter(transaction_type='forfeit').values_list(
+        'deposit__rental_transaction__tool_id', 'deposit__rental_transaction__owner_id', 'created_at', 'amount'
+    )
+    for tool_id, owner_id, created_at, amount in forfeits.iterator(chunk_size=batch_size):
+        row = daily[(tool_id, created_at.date())]
+        row['owner_id'] = row['owner_id'] or owner_id
+        row['deposits_forfeited'] += Decimal(amount or 0)
+
+    monthly = defaultdict(lambda: dict.fromkeys(TOTAL_FIELDS, 0))
+    for (tool_id, day), row in daily.items():
+        if row['owner_id'] is None:
+            continue
+        totals = monthly[(row['owner_id'], day.replace(day=1))]
+        for field in TOTAL_FIELDS:
+            totals[field] += row[field]
+
+    with transaction.atomic():
+        ToolDailyRollup.objects.all().delete()
+        OwnerMonthlyRollup.objects.all().delete()
+        ToolDailyRollup.objects.bulk_create(
+            [ToolDailyRollup(tool_id=tool_id, day=day, **row) for (tool_id, day), row in daily.items()],
+            batch_size=batch_size,
+        )
+        OwnerMonthlyRollup.objects.bulk_create(
+            [OwnerMonthlyRollup(owner_id=owner_id, month=month, **totals) for (owner_id, month), totals in monthly.items()],
+            batch_size=batch_size,
+        )
+    return len(daily), len(monthly)
+
+
+def _totals(rows):
+    totals = {'rental_count': 0, 'revenue': Decimal('0.00'), 'booked_days': 0, 'deposits_forfeited': Decimal('0.00')}
+    for row in rows:
+        for field in TOTAL_FIELDS:
+            totals[field] += row[field]
+    return totals
+
+
+def format_row(row):
+    """Render a rollup row for a JSON response, keeping money amounts as exact decimal strings"""
+    return {key: str(value) if isinstance(value, Decimal) else value for key, value in row.items()}
+
+
+def owner_summary(owner_id, start_month=None, end_month=None):
+    """Monthly rows and grand totals for an owner's dashboard"""
+    months = OwnerMonthlyRollup.objects.filter(owner_id=owner_id)
+    if start_month:
+        months = months.filter(month__gte=start_month)
+    if end_month:
+        months = months.filter(month__lte=end_month)
+    rows = list(months.order_by('month').values('month', *TOTAL_FIELDS))
+    return [format_row(row) for row in rows], format_row(_totals(rows))
+
+
+def tool_utilization(tool_id, start_date, end_date):
+    """Daily rows and totals for one tool over a window"""
+    days = ToolDailyRollup.objects.filter(tool_id=tool_id, day__range=[start_date, end_date])
+    rows = list(days.order_by('day').values('day', *TOTAL_FIELDS))
+    totals = dict(_totals(rows), active_days=len(rows))
+    return [format_row(row) for row in rows], format_row(totals)
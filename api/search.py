@@ -0,0 +1,233 @@
+"""
+Full-text search over tool names and descriptions.
+
+SQLite keeps a copy of each tool's text in the FTS5 table ``api_tool_fts``
+(rowid = tool id) and ranks matches with bm25(). MySQL uses the FULLTEXT
+index ``idx_tool_fulltext`` on ``api_tool(name, description)`` and ranks with
+MATCH ... AGAINST relevance. The text match, location and date filters are
+all applied in a single SQL statement so the database plans them together.
+"""
+import math
+import re
+
+from django.db import connection
+from django.db.models import Avg, Count, Exists, FloatField, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Tool, RentalTransaction, Feedback
+
+FTS_TABLE = 'api_tool_fts'
+FULLTEXT_INDEX = 'idx_tool_fulltext'
+
+MILES_PER_DEGREE_LAT = 69.0
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def is_supported():
+    """Return True if the current database backend has a full-text index"""
+    return connection.vendor in ('sqlite', 'mysql')
+
+
+def tokenize(text):
+    """Lowercase word tokens of a search string"""
+    return _TOKEN_RE.findall((text or '').lower())
+
+
+def _match_expression(tokens):
+    if connection.vendor == 'sqlite':
+        # Quote every token so FTS5 operators in user input are treated as text
+        return ' '.join('"%s"' % token for token in tokens)
+    return ' '.join(tokens)
+
+
+def create_index():
+    """Create the backend's full-text structure if it does not exist yet"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                f"USING fts5(name, description, tokenize='porter unicode61')"
+            )
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.statistics "
+                "WHERE table_schema = DATABASE() AND table_name = 'api_tool' AND index_name = %s",
+                [FULLTEXT_INDEX]
+            )
+            if not cursor.fetchone()[0]:
+                cursor.execute(f"ALTER TABLE api_tool ADD FULLTEXT INDEX {FULLTEXT_INDEX} (name, description)")
+
+
+def rebuild_index():
+    """Repopulate the SQLite FTS table from api_tool (MySQL maintains its own index)"""
+    create_index()
+    if connection.vendor != 'sqlite':
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, name, description) "
+            f"SELECT id, name, description FROM api_tool"
+        )
+        cursor.execute(f"SELECT COUNT(*) FROM {FTS_TABLE}")
+        return cursor.fetchone()[0]
+
+
+def index_tool(tool):
+    """Insert or refresh a single tool in the SQLite FTS table"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [tool.id])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (%s, %s, %s)",
+            [tool.id, tool.name or '', tool.description or '']
+        )
+
+
+def remove_tool(tool_id):
+    """Drop a deleted tool from the SQLite FTS table"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [tool_id])
+
+
+def apply_text_match(queryset, tokens):
+    """Restrict a Tool queryset to full-text matches and annotate ``search_rank`` (higher is better)"""
+    expression = _match_expression(tokens)
+    if connection.vendor == 'sqlite':
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = api_tool.id', f'{FTS_TABLE} MATCH %s'],
+            params=[expression],
+            select={'search_rank': f'-bm25({FTS_TABLE})'},
+        )
+    match = 'MATCH(api_tool.name, api_tool.description) AGAINST (%s IN NATURAL LANGUAGE MODE)'
+    return queryset.extra(
+        where=[match],
+        params=[expression],
+        select={'search_rank': match},
+        select_params=[expression],
+    )
+
+
+def apply_bounding_box(queryset, lat, lng, radius):
+    """Restrict a Tool queryset to the lat/lng box around a ``radius``-mile circle (served by idx_tools_location_available)"""
+    lat = float(lat)
+    lng = float(lng)
+    radius = float(radius)
+    miles_per_degree_lng = MILES_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01)
+    lat_delta = radius / MILES_PER_DEGREE_LAT
+    lng_delta = radius / miles_per_degree_lng
+    return queryset.filter(
+        latitude__range=(lat - lat_delta, lat + lat_delta),
+        longitude__range=(lng - lng_delta, lng + lng_delta),
+    )
+
+
+def apply_location_filter(queryset, lat, lng, radius):
+    """
+    Restrict a Tool queryset to tools within ``radius`` miles of (lat, lng).
+
+    The bounding box lets the database use idx_tools_location_available; the
+    equirectangular distance check trims the corners with plain arithmetic
+    so it runs on every backend without trigonometric SQL functions.
+    """
+    lat = float(lat)
+    lng = float(lng)
+    radius = float(radius)
+    miles_per_degree_lng = MILES_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01)
+    return apply_bounding_box(queryset, lat, lng, radius).extra(
+        where=[
+            '((api_tool.latitude - %s) * %s) * ((api_tool.latitude - %s) * %s) + '
+            '((api_tool.longitude - %s) * %s) * ((api_tool.longitude - %s) * %s) <= %s'
+        ],
+        params=[
+            lat, MILES_PER_DEGREE_LAT, lat, MILES_PER_DEGREE_LAT,
+            lng, miles_per_degree_lng, lng, miles_per_degree_lng,
+            radius * radius,
+        ],
+    )
+
+
+def apply_date_filter(queryset, start_date, end_date):
+    """Exclude tools with an active rental overlapping [start_date, end_date)"""
+    conflicting = RentalTransaction.objects.filter(
+        tool=OuterRef('pk'),
+        status='active',
+        start_date__lt=end_date,
+        end_date__gt=start_date,
+    )
+    return queryset.filter(~Exists(conflicting))
+
+
+def apply_rating_filter(queryset, min_rating):
+    """Keep tools whose average review rating is at least ``min_rating`` (unrated tools count as 0)"""
+    average = Feedback.objects.filter(
+        rental_transaction__tool=OuterRef('pk')
+    ).values('rental_transaction__tool').annotate(avg=Avg('rating')).values('avg')
+    return queryset.annotate(
+        average_rating=Coalesce(Subquery(average, output_field=FloatField()), 0.0)
+    ).filter(average_rating__gte=min_rating)
+
+
+def annotate_review_stats(queryset):
+    """Annotate ``average_rating`` (0 when unrated) and ``review_count`` on a Tool queryset"""
+    reviews = Feedback.objects.filter(rental_transaction__tool=OuterRef('pk')).values('rental_transaction__tool')
+    return queryset.annotate(
+        average_rating=Coalesce(Subquery(reviews.annotate(avg=Avg('rating')).values('avg'), output_field=FloatField()), 0.0),
+        review_count=Coalesce(Subquery(reviews.annotate(n=Count('id')).values('n'), output_field=IntegerField()), 0),
+    )
+
+
+def filter_tools(queryset, lat=None, lng=None, radius=10, start_date=None, end_date=None,
+                 pricing_type=None, max_price=None, min_rating=None):
+    """Apply the shared search filters to a Tool queryset"""
+    if pricing_type:
+        queryset = queryset.filter(pricing_type=pricing_type)
+    if max_price is not None:
+        queryset = queryset.filter(price_per_day__lte=max_price)
+    if lat is not None and lng is not None:
+        queryset = apply_location_filter(queryset, lat, lng, radius)
+    if start_date and end_date:
+        queryset = apply_date_filter(queryset, start_date, end_date)
+    if min_rating:
+        queryset = apply_rating_filter(queryset, min_rating)
+    return queryset
+
+
+def search_tools(query, lat=None, lng=None, radius=10, start_date=None, end_date=None,
+                 pricing_type=None, page=1, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Rank available tools against ``query`` and return one page of results.
+
+    Returns ``(tools, total)``; each tool carries ``search_rank`` and, when a
+    location was given, ``distance`` in miles.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return [], 0
+
+    page = max(1, int(page))
+    page_size = min(max(1, int(page_size)), MAX_PAGE_SIZE)
+
+    tools = filter_tools(
+        Tool.objects.filter(available=True).select_related('owner'),
+        lat=lat, lng=lng, radius=radius,
+        start_date=start_date, end_date=end_date,
+        pricing_type=pricing_type,
+    )
+    has_location = lat is not None and lng is not None
+    tools = apply_text_match(tools, tokens).order_by('-search_rank', 'id')
+
+    total = tools.count()
+    offset = (page - 1) * page_size
+    results = list(tools[offset:offset + page_size])
+    for tool in results:
+        tool.distance = tool.calculate_distance_to(lat, lng) if has_location else None
+    return results, total
@@ -1,17 +1,48 @@
+import logging
 from rest_framework import serializers
+from . import thumbnails
 from .models import UserProfile, Tool, Feedback, BorrowRequest, RentalTransaction, Availability, Message, UserReview, ApplicationReview, Deposit, DepositTransaction, FlexibleAvailability, RecurringAvailability, HourlyAvailability, UserVerification, Dispute, DisputeMessage
 
+logger = logging.getLogger(__name__)
+
+class ThumbnailField(serializers.Field):
+    """URLs of one derivative size of an image ({'webp': ..., 'jpeg': ...}), or None until it is generated"""
+    
+    def __init__(self, size, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+        self.size = size
+    
+    def to_representation(self, instance):
+        return thumbnails.urls(instance, self.size, self.context.get('request'))
+
 class UserSerializer(serializers.ModelSerializer):
+    profile_picture_avatar = ThumbnailField('avatar')
+    
     class Meta:
         model = UserProfile
-        fields = '__all__'
+        exclude = ['profile_picture_variants']
+
+class ToolCardField(serializers.Field):
+    """A tool's cached card (see api.tool_cards), looked up in the ``tool_cards`` dict the view puts in the context"""
+    
+    def __init__(self, **kwargs):
+        kwargs['source'] = 'tool_id'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+    
+    def to_representation(self, tool_id):
+        return self.context['tool_cards'].get(tool_id)
 
 class ToolSerializer(serializers.ModelSerializer):
     owner = UserSerializer(read_only=True)
+    # Lists show 300x200 cards; the full image stays available as `image`
+    image_card = ThumbnailField('card')
     
     class Meta:
         model = Tool
-        fields = '__all__'
+        exclude = ['image_variants']
     
     def create(self, validated_data):
         # Get the owner ID from the context or request
@@ -48,6 +79,10 @@ class BorrowRequestSerializer(serializers.ModelSerializer):
         
         return super().create(validated_data)
 
+class BorrowRequestListSerializer(BorrowRequestSerializer):
+    """Borrow requests for lists, with the compact tool card instead of the full tool"""
+    tool = ToolCardField()
+
 class RentalTransactionSerializer(serializers.ModelSerializer):
     tool = serializers.PrimaryKeyRelatedField(queryset=Tool.objects.all())
     borrower = serializers.PrimaryKeyRelatedField(queryset=UserProfile.objects.all())
@@ -58,7 +93,7 @@ class RentalTransactionSerializer(serializers.ModelSerializer):
         fields = '__all__'
     
     def create(self, validated_data):
-        print(f"DEBUG: validated_data = {validated_data}")
+        logger.debug('Creating rental transaction', extra={'fields': sorted(validated_data)})
         
         # Create the rental transaction
         rental = RentalTransaction.objects.create(**validated_data)
@@ -85,6 +120,15 @@ class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
         fields = '__all__'
+        read_only_fields = ['recipient']
+
+class ThreadMessageSerializer(serializers.ModelSerializer):
+    """Compact message for rental chat threads"""
+    sender_username = serializers.CharField(source='sender.username', read_only=True, default=None)
+    
+    class Meta:
+        model = Message
+        fields = ['id', 'sender', 'sender_username', 'recipient', 'message', 'is_read', 'created_at']
 
 class UserReviewSerializer(serializers.ModelSerializer):
     reviewer = UserSerializer(read_only=True)
@@ -166,12 +210,13 @@ class DisputeSerializer(serializers.ModelSerializer):
 # Enhanced serializers with additional context
 class ToolWithReviewsSerializer(serializers.ModelSerializer):
     owner = UserSerializer(read_only=True)
+    image_detail = ThumbnailField('detail')
     average_rating = serializers.SerializerMethodField()
     total_reviews = serializers.SerializerMethodField()
     
     class Meta:
         model = Tool
-        fields = '__all__'
+        exclude = ['image_variants']
     
     def get_average_rating(self, obj):
         from django.db.models import Avg
@@ -193,10 +238,11 @@ class UserWithRatingSerializer(serializers.ModelSerializer):
     average_rating = serializers.SerializerMethodField()
     total_reviews = serializers.SerializerMethodField()
     verification_status = serializers.SerializerMethodField()
+    profile_picture_profile = ThumbnailField('profile')
     
     class Meta:
         model = UserProfile
-        fields = '__all__'
+        exclude = ['profile_picture_variants']
     
     def get_average_rating(self, obj):
         reviews = UserReview.objects.filter(reviewed_user=obj, is_public=True)
@@ -0,0 +1,186 @@
+from django.db import transaction
+from django.db.models.signals import post_init, pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .models import Tool, RentalTransaction, Availability, FlexibleAvailability, RecurringAvailability, HourlyAvailability, DepositTransaction, Message, BorrowRequest, UserProfile, Feedback
+from . import search, autocomplete, availability_calendar, rollups, messaging, live_updates, thumbnails, tool_cards, near_cache
+
+CALENDAR_SOURCES = [RentalTransaction, Availability, FlexibleAvailability, RecurringAvailability, HourlyAvailability]
+
+
+@receiver(post_save, sender=Tool)
+def index_tool_for_search(sender, instance, **kwargs):
+    """Keep the full-text index in sync with tool name/description edits"""
+    search.index_tool(instance)
+    autocomplete.tool_saved(instance)
+
+
+@receiver(post_delete, sender=Tool)
+def remove_tool_from_search(sender, instance, **kwargs):
+    search.remove_tool(instance.id)
+    autocomplete.tool_deleted(instance.id)
+
+
+@receiver(post_save, sender=Tool)
+@receiver(post_delete, sender=Tool)
+def invalidate_tool_card(sender, instance, using=None, **kwargs):
+    # After commit, so a list request cannot re-cache the old row in between
+    tool_id = instance.pk
+    transaction.on_commit(lambda: tool_cards.invalidate([tool_id]), using=using)
+
+
+@receiver(post_init, sender=Tool)
+def remember_tool_location(sender, instance, **kwargs):
+    # Same approach as the rental rollup snapshot: never touch deferred fields here
+    if instance.pk is None:
+        instance._near_snapshot = None
+    elif not instance.get_deferred_fields().intersection(near_cache.SNAPSHOT_FIELDS):
+        instance._near_snapshot = near_cache.tool_snapshot(instance)
+
+
+@receiver(pre_save, sender=Tool)
+@receiver(pre_delete, sender=Tool)
+def load_tool_location(sender, instance, **kwargs):
+    if not hasattr(instance, '_near_snapshot'):
+        instance._near_snapshot = near_cache.stored_snapshot(instance.pk)
+
+
+@receiver(post_save, sender=Tool)
+def invalidate_near_me_searches(sender, instance, using=None, **kwargs):
+    """Drop cached near-me candidates around a tool's old and new position once the save commits"""
+    old, new = instance._near_snapshot, near_cache.tool_snapshot(instance)
+    instance._near_snapshot = new
+    transaction.on_commit(lambda: near_cache.tool_changed(old, new), using=using)
+
+
+@receiver(post_delete, sender=Tool)
+def remove_tool_from_near_me(sender, instance, using=None, **kwargs):
+    snapshot = instance._near_snapshot
+    transaction.on_commit(lambda: near_cache.tool_changed(snapshot, None), using=using)
+
+
+@receiver(post_save, sender=UserProfile)
+def invalidate_owner_tool_cards(sender, instance, created, update_fields=None, using=None, **kwargs):
+    if created or (update_fields is not None and not tool_cards.OWNER_FIELDS.intersection(update_fields)):
+        return
+    owner_id = instance.pk
+    transaction.on_commit(lambda: tool_cards.invalidate_owner(owner_id), using=using)
+
+
+@receiver(post_save, sender=Feedback)
+@receiver(post_delete, sender=Feedback)
+def invalidate_reviewed_tool_card(sender, instance, using=None, **kwargs):
+    """A review changes the rating on its tool's card"""
+    if instance.rental_transaction_id is None:
+        return
+    # Looked up now: when the rental itself is being deleted it is gone by commit time
+    tool_id = RentalTransaction.objects.filter(pk=instance.rental_transaction_id).values_list('tool_id', flat=True).first()
+    if tool_id is not None:
+        transaction.on_commit(lambda: tool_cards.invalidate([tool_id]), using=using)
+
+
+@receiver(post_save, sender=RentalTransaction)
+def count_rental_for_autocomplete(sender, instance, created, **kwargs):
+    if created:
+        autocomplete.rental_created(instance.tool_id)
+
+
+def invalidate_tool_calendar(sender, instance, using=None, **kwargs):
+    """Drop cached calendars when any of their source rows change"""
+    # After commit, so a calendar read in between cannot cache the old rows under the new version
+    tool_id = instance.tool_id
+    transaction.on_commit(lambda: availability_calendar.bump_version(tool_id), using=using)
+
+
+for model in CALENDAR_SOURCES:
+    post_save.connect(invalidate_tool_calendar, sender=model, dispatch_uid=f'calendar-save-{model.__name__}')
+    post_delete.connect(invalidate_tool_calendar, sender=model, dispatch_uid=f'calendar-delete-{model.__name__}')
+
+
+def publish_availability_change(sender, instance, signal, created=False, using=None, **kwargs):
+    """Push an availability delta to SSE subscribers once the write commits"""
+    action = 'deleted' if signal is post_delete else 'created' if created else 'updated'
+    delta = live_updates.build_delta(instance, action)
+    if delta is not None:
+        transaction.on_commit(lambda: live_updates.publish(delta), using=using)
+
+
+# Borrow requests do not change the calendar itself, but approvals and cancellations are worth pushing
+for model in CALENDAR_SOURCES + [BorrowRequest]:
+    post_save.connect(publish_availability_change, sender=model, dispatch_uid=f'live-save-{model.__name__}')
+    post_delete.connect(publish_availability_change, sender=model, dispatch_uid=f'live-delete-{model.__name__}')
+
+
+@receiver(post_init, sender=RentalTransaction)
+def remember_rental_for_rollups(sender, instance, **kwargs):
+    # Snapshot what the row looked like when loaded so saves can apply a delta.
+    # Touching a deferred field here would query (and recurse), so leave those to pre_save.
+    if instance.pk is None:
+        instance._rollup_snapshot = None
+    elif not instance.get_deferred_fields().intersection(rollups.SNAPSHOT_FIELDS):
+        instance._rollup_snapshot = rollups.rental_snapshot(instance)
+
+
+@receiver(pre_save, sender=RentalTransaction)
+@receiver(pre_delete, sender=RentalTransaction)
+def load_rental_for_rollups(sender, instance, **kwargs):
+    if not hasattr(instance, '_rollup_snapshot'):
+        instance._rollup_snapshot = rollups.stored_snapshot(instance.pk)
+
+
+@receiver(post_save, sender=RentalTransaction)
+def update_rollups_for_rental(sender, instance, **kwargs):
+    snapshot = rollups.rental_snapshot(instance)
+    rollups.rental_changed(getattr(instance, '_rollup_snapshot', None), snapshot)
+    instance._rollup_snapshot = snapshot
+
+
+@receiver(post_delete, sender=RentalTransaction)
+def remove_rental_from_rollups(sender, instance, **kwargs):
+    rollups.rental_changed(instance._rollup_snapshot, None)
+
+
+@receiver(post_save, sender=DepositTransaction)
+def update_rollups_for_forfeit(sender, instance, created, **kwargs):
+    if created and instance.transaction_type == 'forfeit':
+        rollups.deposit_forfeited(instance)
+
+
+@receiver(post_delete, sender=DepositTransaction)
+def retract_rollups_for_forfeit(sender, instance, **kwargs):
+    if instance.transaction_type == 'forfeit':
+        rollups.deposit_forfeited(instance, sign=-1)
+
+
+@receiver(pre_save, sender=Message)
+def prepare_message_for_counters(sender, instance, **kwargs):
+    if instance.recipient_id is None:
+        instance.recipient_id = messaging.recipient_for(instance.rental_transaction, instance.sender_id)
+    instance._unread_state = None if instance._state.adding else messaging.stored_state(instance.pk)
+
+
+@receiver(post_save, sender=Message)
+def update_unread_counter(sender, instance, **kwargs):
+    state = messaging.unread_state(instance.recipient_id, instance.is_read)
+    messaging.message_changed(getattr(instance, '_unread_state', None), state)
+    instance._unread_state = state
+
+
+@receiver(post_delete, sender=Message)
+def remove_message_from_counter(sender, instance, **kwargs):
+    messaging.message_changed(messaging.unread_state(instance.recipient_id, instance.is_read), None)
+
+
+def render_thumbnails(sender, instance, update_fields=None, **kwargs):
+    """Queue derivative images when a tool image or profile picture is set or replaced"""
+    image_field, variants_field, _ = thumbnails.IMAGE_FIELDS[sender]
+    if update_fields is not None and image_field not in update_fields:
+        return
+    if image_field in instance.get_deferred_fields() or variants_field in instance.get_deferred_fields():
+        # Loaded without the image (e.g. .only()), so this save cannot have changed it
+        return
+    thumbnails.schedule(instance)
+
+
+for model in thumbnails.IMAGE_FIELDS:
+    post_save.connect(render_thumbnails, sender=model, dispatch_uid=f'thumbnails-{model.__name__}')
@@ -0,0 +1,120 @@
+"""
+Content-addressed media storage.
+
+ContentAddressedStorage is a FileSystemStorage that names every saved file
+after the SHA-256 of its bytes: ``blobs/ab/cd/<sha256><ext>``. The
+``upload_to`` prefix a field asks for is ignored. The same photo uploaded
+for five listings is written to disk once, and later uploads of it only
+hash the bytes.
+
+MediaBlob counts the saves and deletes of each blob. ``save`` takes a
+reference and ``delete`` drops one, under a lock on the blob's row. When
+the last reference goes, the file and row are removed, but only after the
+deleting transaction commits. A rollback therefore cannot leave a model
+pointing at a missing file. Some writes never call ``delete``:
+QuerySet.update, rows deleted without their files, and saves rolled back
+after the file was written. The ``gc_media`` command recounts references
+from the database, corrects the counts and removes blobs that nothing
+refers to.
+
+Names saved before this backend was enabled (``tool_images/...``) keep
+working as plain files and are deleted the old way.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+BLOB_DIR = 'blobs'
+
+
+def blob_name(digest, extension):
+    return f'{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def is_blob(name):
+    return name.replace('\\', '/').startswith(f'{BLOB_DIR}/')
+
+
+def _extension(name):
+    extension = os.path.splitext(name)[1].lower()
+    return extension if 1 < len(extension) <= 10 and extension[1:].isalnum() else ''
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that deduplicates files by content hash and reference-counts them"""
+
+    def get_available_name(self, name, max_length=None):
+        # The final name comes from the content in _save; never add a random suffix
+        return name
+
+    def _save(self, name, content):
+        from .models import MediaBlob
+
+        temp_dir = self.path(f'{BLOB_DIR}/tmp')
+        os.makedirs(temp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        # Hash while spooling to a temp file on the same filesystem, so the final move is a rename
+        with tempfile.NamedTemporaryFile(dir=temp_dir, delete=False) as spooled:
+            if hasattr(content, 'seek') and getattr(content, 'seekable', lambda: True)():
+                content.seek(0)
+            for chunk in content.chunks():
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                digest.update(chunk)
+                spooled.write(chunk)
+                size += len(chunk)
+        stored = blob_name(digest.hexdigest(), _extension(name))
+        path = self.path(stored)
+        try:
+            with transaction.atomic():
+                blob = MediaBlob.objects.select_for_update().filter(name=stored).first()
+                if blob is None or not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(spooled.name, path)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(path, self.file_permissions_mode)
+                created = False
+                if blob is None:
+                    try:
+                        # Savepoint, so losing the race leaves the outer transaction usable
+                        with transaction.atomic():
+                            MediaBlob.objects.create(name=stored, size=size, refcount=1)
+                        created = True
+                    except IntegrityError:
+                        # A concurrent first save of the same content created the row first; the file is identical
+                        pass
+                if not created:
+                    MediaBlob.objects.filter(name=stored).update(refcount=F('refcount') + 1)
+        finally:
+            if os.path.exists(spooled.name):
+                os.unlink(spooled.name)
+        return stored
+
+    def delete(self, name):
+        if not name or not is_blob(name):
+            return super().delete(name)
+        from .models import MediaBlob
+
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is not None:
+                MediaBlob.objects.filter(name=name).update(refcount=F('refcount') - 1)
+            if blob is None or blob.refcount <= 1:
+                transaction.on_commit(lambda: self._remove_if_unreferenced(name))
+
+    def _remove_if_unreferenced(self, name):
+        from .models import MediaBlob
+
+        # The row stays until here so that a concurrent save of the same content
+        # waits on its lock, and then either re-references the file or rewrites it
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is None or blob.refcount <= 0:
+                super().delete(name)
+                if blob is not None:
+                    blob.delete()
@@ -0,0 +1,169 @@
+"""
+Structured, sampled logging that never blocks request threads.
+
+Request threads only stamp the record (request id, sampling decision) and
+``put_nowait`` it on a bounded in-process queue; a QueueListener thread does
+the JSON formatting and the actual write. When the queue is full the record
+is dropped and counted rather than making the caller wait; the total is
+exported as ``toolshare_log_records_dropped_total`` on /api/metrics/.
+
+Wired up from settings.LOGGING:
+
+    'filters': {'request_id': {'()': 'api.structured_logging.RequestIdFilter'},
+                'sampling': {'()': 'api.structured_logging.SamplingFilter', 'rates': {...}}},
+    'handlers': {'queue': {'()': 'api.structured_logging.queue_handler',
+                           'filters': ['request_id', 'sampling']}},
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import queue
+import random
+import re
+import sys
+import threading
+import uuid
+import weakref
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# Every NonBlockingQueueHandler configured in this process, for dropped_records()
+_handlers = weakref.WeakSet()
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'request_id'}
+
+
+class RequestIdFilter(logging.Filter):
+    """Attach the current request id (if any) to every record"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of records below WARNING for the configured loggers.
+
+    ``rates`` maps logger name prefixes to a keep probability; the longest
+    matching prefix wins and unlisted loggers are not sampled.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = dict(rates or {})
+        self._resolved = {}
+
+    def rate_for(self, name):
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate = 1.0
+            best = -1
+            for prefix, prefix_rate in self.rates.items():
+                if (name == prefix or name.startswith(prefix + '.')) and len(prefix) > best:
+                    rate, best = prefix_rate, len(prefix)
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the standard fields plus any ``extra`` keys"""
+
+    def format(self, record):
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RESERVED_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload['exc'] = record.exc_text
+        return json.dumps(payload, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops (and counts) records instead of waiting on a full queue"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        _handlers.add(self)
+
+    def prepare(self, record):
+        # Freeze the message now, since args may be mutated after the call
+        # returns; formatting and traceback rendering happen on the listener thread.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+
+def dropped_records():
+    """Records dropped on a full queue since start-up, across this process's handlers"""
+    return sum(handler.dropped for handler in list(_handlers))
+
+
+def queue_handler(stream='ext://sys.stdout', maxsize=10000):
+    """
+    dictConfig factory: a NonBlockingQueueHandler whose listener writes JSON to ``stream``.
+
+    The listener thread is started here and stopped (flushing the queue) at exit.
+    """
+    if isinstance(stream, str):
+        stream = sys.stderr if stream == 'ext://sys.stderr' else sys.stdout
+    target = logging.StreamHandler(stream)
+    target.setFormatter(JsonFormatter())
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=maxsize))
+    listener = QueueListener(handler.queue, target, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    handler.listener = listener
+    return handler
+
+
+class RequestIdMiddleware:
+    """Give each request an id (the incoming X-Request-ID if sane) for log correlation"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        incoming = request.headers.get(REQUEST_ID_HEADER, '')
+        request_id = incoming if VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        request.request_id = request_id
+        token = request_id_var.set(request_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        response[REQUEST_ID_HEADER] = request_id
+        return response
@@ -1,3 +1,1806 @@
-from django.test import TestCase
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from concurrent.futures import Future
+from unittest import mock
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import queue
+import shutil
+import sqlite3
+import sys
+import tempfile
+import uuid
 
-# Create your tests here.
+import numpy as np
+from PIL import Image
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.db.migrations.executor import MigrationExecutor
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from toolshare_backend.db_backends.pool import ConnectionPool
+
+from . import autocomplete, availability_calendar, db_router, facets, imaging, live_updates, metrics, near_cache, occupancy, outbox, pagination, pricing, renderers, rollups, search, storage, structured_logging, thumbnails, tool_cards, uploads
+from .management.commands import check_query_plans
+from .models import Availability, BorrowRequest, ChunkedUpload, Feedback, FlexibleAvailability, HourlyAvailability, MediaBlob, OutboxCursor, OutboxEvent, OwnerMonthlyRollup, RecurringAvailability, RentalTransaction, Tool, ToolDailyRollup, UserProfile
+
+
+class ApiTestCase(TestCase):
+    """TestCase whose database also has the full-text table the Tool signals write to"""
+
+    @classmethod
+    def setUpClass(cls):
+        # Before super() so setUpTestData can already create tools
+        search.create_index()
+        super().setUpClass()
+
+
+class SearchTests(ApiTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = UserProfile.objects.create_user(username='owner', password='x')
+        cls.borrower = UserProfile.objects.create_user(username='borrower', password='x')
+        cls.drill = cls.tool('Cordless Drill', 'Drill with two batteries and a drill bit set', '15.00', 40.70, -74.00)
+        cls.press = cls.tool('Drill Press', 'Bench press for workshop use, takes large bits', '30.00', 40.75, -74.00,
+                             pricing_type='weekly')
+        cls.saw = cls.tool('Circular Saw', 'Cuts plywood; not a drill', '20.00', 40.70, -74.05)
+        cls.far = cls.tool('Hammer Drill', 'Masonry drill', '25.00', 41.50, -74.00)
+        cls.hidden = cls.tool('Old Drill', 'Drill drill drill', '5.00', 40.70, -74.00, available=False)
+
+    @classmethod
+    def tool(cls, name, description, price, lat, lng, **fields):
+        return Tool.objects.create(
+            name=name, description=description, owner=cls.owner, price_per_day=Decimal(price),
+            latitude=Decimal(str(lat)), longitude=Decimal(str(lng)), **fields
+        )
+
+    def ids(self, tools):
+        return [tool.id for tool in tools]
+
+    def test_ranks_available_matches(self):
+        results, total = search.search_tools('drill')
+        self.assertEqual(total, 4)
+        self.assertEqual(set(self.ids(results)), {self.drill.id, self.press.id, self.saw.id, self.far.id})
+        ranks = [tool.search_rank for tool in results]
+        self.assertEqual(ranks, sorted(ranks, reverse=True))
+
+        mention = self.tool('Detail Kit', 'Works like a small sander, with attachments for crafts and hobby projects', '9.00', 40.7, -74.0)
+        sander = self.tool('Orbital Sander', 'Random orbit sander with dust bag', '12.00', 40.7, -74.0)
+        # Name and repeated description matches outrank a passing mention in a longer text
+        self.assertEqual(self.ids(search.search_tools('sander')[0]), [sander.id, mention.id])
+
+    def test_every_token_must_match_and_operators_are_text(self):
+        self.assertEqual(self.ids(search.search_tools('drill press')[0]), [self.press.id])
+        self.assertEqual(search.search_tools('drill OR saw')[1], 0)
+        self.assertEqual(self.ids(search.search_tools('"not" drill*')[0]), [self.saw.id])
+        self.assertEqual(search.search_tools('  ?! ')[0], [])
+
+    def test_pages_and_totals(self):
+        first, total = search.search_tools('drill', page_size=3)
+        second, second_total = search.search_tools('drill', page=2, page_size=3)
+        self.assertEqual((total, second_total), (4, 4))
+        self.assertEqual(len(first), 3)
+        self.assertEqual(self.ids(first + second), self.ids(search.search_tools('drill')[0]))
+        self.assertEqual(search.search_tools('drill', page=3, page_size=3), ([], 4))
+        self.assertEqual(len(search.search_tools('drill', page_size=0)[0]), 1)
+
+    def test_location_filter_keeps_the_circle(self):
+        results, total = search.search_tools('drill', lat=40.70, lng=-74.00, radius=5)
+        self.assertEqual(set(self.ids(results)), {self.drill.id, self.press.id, self.saw.id})
+        self.assertEqual(total, 3)
+        distances = {tool.id: tool.distance for tool in results}
+        self.assertEqual(distances[self.drill.id], 0)
+        self.assertAlmostEqual(distances[self.press.id], 3.45, places=1)
+        self.assertIsNone(search.search_tools('drill')[0][0].distance)
+
+        # (40.74, -73.947) is inside the 3-mile bounding box but about 3.8 miles away
+        corner = self.tool('Corner Drill', 'drill', '10.00', 40.74, -73.947)
+        box = search.apply_bounding_box(Tool.objects.all(), 40.70, -74.00, 3)
+        circle = search.apply_location_filter(Tool.objects.all(), 40.70, -74.00, 3)
+        self.assertIn(corner, box)
+        self.assertNotIn(corner, circle)
+        self.assertNotIn(self.far, box)
+
+    def test_date_filter_excludes_overlapping_active_rentals(self):
+        start = date(2030, 1, 10)
+        for tool, status, first, last in (
+            (self.drill, 'active', date(2030, 1, 8), date(2030, 1, 11)),
+            (self.press, 'completed', date(2030, 1, 10), date(2030, 1, 12)),
+            (self.saw, 'active', date(2030, 1, 5), date(2030, 1, 10)),  # Returned the morning it starts
+        ):
+            RentalTransaction.objects.create(tool=tool, owner=self.owner, borrower=self.borrower,
+                                             start_date=first, end_date=last, status=status)
+        results, total = search.search_tools('drill', start_date=start, end_date=start + timedelta(days=2))
+        self.assertEqual(set(self.ids(results)), {self.press.id, self.saw.id, self.far.id})
+        self.assertEqual(total, 3)
+
+    def test_pricing_price_and_rating_filters(self):
+        tools = Tool.objects.filter(available=True)
+        self.assertEqual(set(search.filter_tools(tools, pricing_type='weekly')), {self.press})
+        self.assertEqual(set(search.filter_tools(tools, max_price=Decimal('20.00'))), {self.drill, self.saw})
+
+        rental = RentalTransaction.objects.create(tool=self.saw, owner=self.owner, borrower=self.borrower,
+                                                  start_date=date(2030, 1, 1), end_date=date(2030, 1, 2))
+        for rating in (4, 5):
+            Feedback.objects.create(rental_transaction=rental, reviewer=self.borrower, rating=rating)
+        self.assertEqual(list(search.filter_tools(tools, min_rating=4.5)), [self.saw])
+        self.assertEqual(list(search.filter_tools(tools, min_rating=4.6)), [])
+        stats = search.annotate_review_stats(tools).get(pk=self.saw.pk)
+        self.assertEqual((stats.average_rating, stats.review_count), (4.5, 2))
+
+    def test_index_follows_saves_and_deletes(self):
+        self.saw.name = 'Jigsaw'
+        self.saw.description = 'Curved cuts'
+        self.saw.save()
+        self.assertEqual(self.ids(search.search_tools('jigsaw')[0]), [self.saw.id])
+        self.assertNotIn(self.saw.id, self.ids(search.search_tools('drill')[0]))
+
+        self.drill.delete()
+        self.assertEqual(search.search_tools('batteries'), ([], 0))
+        self.assertEqual(search.search_tools('drill')[1], 2)
+
+    def test_rebuild_index_matches_the_tools(self):
+        self.assertEqual(search.rebuild_index(), Tool.objects.count())
+        self.assertEqual(search.search_tools('drill')[1], 4)
+
+
+class FacetTests(ApiTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = UserProfile.objects.create_user(username='owner', password='x')
+        for name, price, pricing_type, city, delivery in (
+            ('Drill', '0.00', 'daily', 'Austin', True),
+            ('Saw', '12.00', 'daily', 'Austin', False),
+            ('Ladder', '30.00', 'weekly', 'Dallas', False),
+            ('Mower', '150.00', 'daily', '', True),
+            ('Sander', None, 'hourly', 'Dallas', False),
+        ):
+            Tool.objects.create(name=name, description=f'{name} for rent', owner=owner, pricing_type=pricing_type,
+                                price_per_day=Decimal(price) if price else None, pickup_city=city, delivery_available=delivery)
+        Tool.objects.create(name='Hidden', owner=owner, price_per_day=Decimal('1.00'), available=False)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_normalize_filters(self):
+        self.assertEqual(
+            facets.normalize_filters({'q': '  Cordless   DRILL! ', 'lat': '40.7', 'radius': 5, 'pricing_type': ' Daily ',
+                                      'start_date': '2030-01-02', 'max_price': '', 'unknown': 'x', 'min_rating': None}),
+            {'q': 'cordless drill', 'lat': '40.70000', 'radius': '5.00000', 'pricing_type': 'daily', 'start_date': '2030-01-02'},
+        )
+        self.assertEqual(facets.normalize_filters({'q': '?!'}), {})
+        for filters in ({'start_date': '2030-13-01'}, {'end_date': 'tomorrow'}, {'lat': 'north'}):
+            with self.subTest(filters=filters), self.assertRaises(ValueError):
+                facets.normalize_filters(filters)
+
+    def test_equivalent_requests_share_a_cache_key(self):
+        key = facets.cache_key(facets.normalize_filters({'q': 'drill', 'radius': '10', 'max_price': '25'}))
+        self.assertEqual(key, facets.cache_key(facets.normalize_filters({'max_price': 25.0, 'q': 'DRILL ', 'radius': '10.000', 'lat': ''})))
+        self.assertNotEqual(key, facets.cache_key(facets.normalize_filters({'q': 'drill', 'radius': '10'})))
+
+    def test_counts_come_from_one_grouped_query(self):
+        with self.assertNumQueries(1):
+            result = facets.get_facets({})
+        self.assertEqual(result, {'total': 5, 'facets': {
+            'pricing_type': {'daily': 3, 'weekly': 1, 'hourly': 1},
+            'price_bucket': {'0-10': 1, '10-25': 1, '25-50': 1, '50-100': 0, '100+': 1, 'unpriced': 1},
+            'pickup_city': {'Austin': 2, 'Dallas': 2, '': 1},
+            'delivery_available': {'true': 2, 'false': 3},
+        }})
+
+    def test_filters_narrow_the_counts(self):
+        self.assertEqual(facets.get_facets({'pricing_type': 'daily', 'max_price': '20'})['total'], 2)
+        self.assertEqual(facets.get_facets({'q': 'ladder'})['facets']['pickup_city'], {'Dallas': 1})
+        # Zero is a price limit, not a missing filter
+        self.assertEqual(facets.get_facets({'max_price': '0'})['total'], 1)
+
+    def test_results_are_cached_unless_reads_must_be_fresh(self):
+        facets.get_facets({'pricing_type': 'daily'})
+        Tool.objects.filter(name='Saw').update(pricing_type='weekly')
+        with self.assertNumQueries(0):
+            self.assertEqual(facets.get_facets({'pricing_type': 'daily'})['total'], 3)
+        with mock.patch.object(db_router, 'fresh_reads', return_value=True), self.assertNumQueries(1):
+            self.assertEqual(facets.get_facets({'pricing_type': 'daily'})['total'], 2)
+        # The fresh result replaced the cached one
+        with self.assertNumQueries(0):
+            self.assertEqual(facets.get_facets({'pricing_type': 'daily'})['total'], 2)
+
+
+class PricingTests(SimpleTestCase):
+    def test_whole_days_are_inclusive(self):
+        self.assertEqual(pricing.duration_hours('2030-01-01', '2030-01-03'), 72)
+
+    def test_times_round_up_to_the_hour(self):
+        self.assertEqual(pricing.duration_hours(date(2030, 1, 1), date(2030, 1, 1), time(9, 0), time(10, 1)), 2)
+
+    def test_backwards_window_is_rejected(self):
+        with self.assertRaises(ValueError):
+            pricing.duration_hours('2030-01-03', '2030-01-01')
+        with self.assertRaises(ValueError):
+            pricing.duration_hours('2030-01-01', '2030-01-01', '10:00', '09:00')
+
+    def test_base_price_is_pro_rata_with_a_minimum_unit(self):
+        prices = {'price_per_week': Decimal('70.00'), 'price_per_hour': Decimal('2.50')}
+        self.assertEqual(pricing.base_price('weekly', prices, 24), Decimal('70.00'))
+        self.assertEqual(pricing.base_price('weekly', prices, 24 * 10), Decimal('100.00'))
+        self.assertEqual(pricing.base_price('hourly', prices, 3), Decimal('7.50'))
+        self.assertIsNone(pricing.base_price('daily', prices, 24))
+
+    def test_quote_adds_delivery_only_when_offered_and_requested(self):
+        row = {'id': 1, 'pricing_type': 'daily', 'price_per_day': Decimal('9.99'),
+               'delivery_available': True, 'delivery_fee': Decimal('5.00')}
+        self.assertEqual(pricing.quote_row(row, 48)['total'], Decimal('69.98'))
+        self.assertEqual(pricing.quote_row(row, 48, include_delivery=True)['total'], Decimal('74.98'))
+        self.assertEqual(pricing.quote_row(dict(row, delivery_available=False), 48, include_delivery=True)['delivery_fee'], Decimal('0.00'))
+
+    def test_format_quote_keeps_exact_decimal_strings(self):
+        quote = pricing.format_quote({'tool_id': 1, 'total': Decimal('10.10'), 'base_price': None})
+        self.assertEqual(quote, {'tool_id': 1, 'total': '10.10', 'base_price': None})
+
+
+class QuoteToolsViewTests(ApiTestCase):
+    def setUp(self):
+        owner = UserProfile.objects.create_user(username='owner', password='x')
+        self.tool = Tool.objects.create(
+            name='Drill', owner=owner, pricing_type='daily', price_per_day=Decimal('10.00'),
+            delivery_available=True, delivery_fee=Decimal('5.00')
+        )
+
+    def quote(self, include_delivery):
+        return self.client.post('/api/tools/quotes/', {
+            'tool_ids': [self.tool.id], 'start_date': '2030-01-01', 'end_date': '2030-01-01',
+            'include_delivery': include_delivery,
+        }, content_type='application/json')
+
+    def test_include_delivery_strings_are_parsed_as_booleans(self):
+        for value, fee in (('false', '0.00'), ('0', '0.00'), (False, '0.00'), ('true', '5.00'), (True, '5.00')):
+            response = self.quote(value)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['quotes'][0]['delivery_fee'], fee, value)
+
+    def test_invalid_include_delivery_is_a_bad_request(self):
+        self.assertEqual(self.quote('maybe').status_code, 400)
+
+
+class RollupTests(ApiTestCase):
+    def setUp(self):
+        self.owner = UserProfile.objects.create_user(username='owner', password='x')
+        self.tool = Tool.objects.create(name='Drill', owner=self.owner, price_per_day=Decimal('10.00'))
+
+    def rent(self, start, end, total='30.00', **fields):
+        return RentalTransaction.objects.create(
+            tool=self.tool, owner=self.owner, start_date=start, end_date=end,
+            total_price=Decimal(total), status='active', **fields
+        )
+
+    def rows(self):
+        return sorted(ToolDailyRollup.objects.values_list('day', 'rental_count', 'revenue', 'booked_days'))
+
+    def test_booked_days_are_spread_over_the_rental(self):
+        self.rent(date(2030, 1, 30), date(2030, 2, 1))
+        self.assertEqual(self.rows(), [
+            (date(2030, 1, 30), 1, Decimal('30.00'), 1),
+            (date(2030, 1, 31), 0, Decimal('0.00'), 1),
+            (date(2030, 2, 1), 0, Decimal('0.00'), 1),
+        ])
+        months = dict(OwnerMonthlyRollup.objects.values_list('month', 'booked_days'))
+        self.assertEqual(months, {date(2030, 1, 1): 2, date(2030, 2, 1): 1})
+
+    def test_utilization_window_counts_only_days_inside_it(self):
+        self.rent(date(2030, 1, 1), date(2030, 1, 10))
+        _, totals = rollups.tool_utilization(self.tool.id, date(2030, 1, 8), date(2030, 1, 20))
+        self.assertEqual(totals['booked_days'], 3)
+        self.assertEqual(totals['rental_count'], 0)
+
+    def test_incremental_rows_match_a_rebuild(self):
+        rental = self.rent(date(2030, 1, 1), date(2030, 1, 5))
+        self.rent(date(2030, 1, 4), date(2030, 1, 6), total='12.50')
+        rental.end_date = date(2030, 1, 2)
+        rental.total_price = Decimal('20.00')
+        rental.save()
+        self.rent(date(2030, 1, 3), date(2030, 1, 3)).delete()
+        incremental = self.rows()
+        rollups.rebuild()
+        self.assertEqual(self.rows(), [row for row in incremental if any(row[1:])])
+
+    def test_deleting_the_tool_does_not_recreate_its_rows(self):
+        self.rent(date(2030, 1, 1), date(2030, 1, 3))
+        self.tool.delete()
+        self.assertFalse(ToolDailyRollup.objects.exists())
+
+
+class CalendarMergeTests(SimpleTestCase):
+    # Monday 7 to Sunday 13 January 2030
+    start, end = date(2030, 1, 7), date(2030, 1, 13)
+    weekdays = ('weekly', date(2030, 1, 1), None, [0, 1, 2, 3, 4], time(9), time(17, 30))
+
+    def names(self, runs):
+        return [name for name, length in runs for _ in range(length)]
+
+    def test_days_follow_precedence(self):
+        sources = {
+            'recurring': [self.weekdays],
+            'open': [(date(2030, 1, 12), date(2030, 1, 12))],
+            'hourly_days': [(date(2030, 1, 8), 3, 0)],
+            'blocked': [(date(2030, 1, 9), date(2030, 1, 10))],
+            'rentals': [(date(2030, 1, 10), date(2030, 1, 11), None, None)],
+        }
+        codes = availability_calendar.merge_days(sources, self.start, self.end)
+        self.assertEqual(
+            availability_calendar.run_length_encode(codes),
+            [['available', 1], ['partial', 1], ['blocked', 1], ['booked', 2], ['available', 1], ['closed', 1]],
+        )
+
+    def test_days_without_recurring_are_open_and_spans_are_clipped(self):
+        sources = {
+            'booked': [(date(2029, 12, 30), date(2030, 1, 7))],
+            'hourly_days': [(date(2030, 1, 9), 24, 0), (date(2030, 1, 10), 0, 24), (date(2030, 1, 11), 0, 5)],
+            'rentals': [(date(2030, 1, 13), date(2030, 1, 20), None, None)],
+        }
+        codes = availability_calendar.merge_days(sources, self.start, self.end)
+        self.assertEqual(
+            [availability_calendar.STATUS_NAMES[code] for code in codes],
+            ['booked', 'available', 'booked', 'blocked', 'available', 'available', 'booked'],
+        )
+
+    def test_hours(self):
+        sources = {
+            'recurring': [self.weekdays],
+            'hourly': [(self.start, 10, True), (self.start, 12, False)],
+            'rentals': [(self.start, self.start, time(14), time(15, 30))],
+        }
+        codes = availability_calendar.merge_hours(sources, self.start, self.start)
+        self.assertEqual(len(codes), 24)
+        self.assertEqual(availability_calendar.run_length_encode(codes), [
+            ['closed', 9], ['available', 1], ['booked', 1], ['available', 1], ['blocked', 1],
+            ['available', 1], ['booked', 2], ['available', 2], ['closed', 6],
+        ])
+
+    def test_hours_and_days_agree_on_whole_day_sources(self):
+        sources = {
+            'blocked': [(date(2030, 1, 8), date(2030, 1, 8))],
+            'booked': [(date(2030, 1, 10), date(2030, 1, 11))],
+        }
+        days = self.names(availability_calendar.run_length_encode(availability_calendar.merge_days(sources, self.start, self.end)))
+        hours = self.names(availability_calendar.run_length_encode(availability_calendar.merge_hours(sources, self.start, self.end)))
+        self.assertEqual(hours, [name for name in days for _ in range(24)])
+
+    def test_run_length_encode(self):
+        self.assertEqual(availability_calendar.run_length_encode([]), [])
+        self.assertEqual(
+            availability_calendar.run_length_encode([0, 0, 4, 4, 4, 0, 1]),
+            [['available', 2], ['booked', 3], ['available', 1], ['closed', 1]],
+        )
+
+    def test_window_is_validated(self):
+        for start, end, resolution in (
+            ('2030-01-02', '2030-01-01', 'day'),
+            ('2030-01-01', '2031-01-02', 'day'),
+            ('2030-01-01', '2030-02-01', 'hour'),
+            ('2030-01-01', '2030-01-01', 'week'),
+            ('yesterday', '2030-01-01', 'day'),
+        ):
+            with self.subTest(start=start, end=end, resolution=resolution), self.assertRaises(ValueError):
+                availability_calendar.parse_window(start, end, resolution)
+
+
+class CalendarCacheTests(ApiTestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = UserProfile.objects.create_user(username='owner', password='x')
+        self.borrower = UserProfile.objects.create_user(username='borrower', password='x')
+        self.tool = Tool.objects.create(name='Drill', owner=self.owner, price_per_day=Decimal('10.00'))
+        self.day = date(2030, 1, 7)
+
+    def calendar(self):
+        return availability_calendar.get_status_calendar(self.tool.id, self.day, self.day + timedelta(days=2))
+
+    def test_calendar_is_cached(self):
+        self.assertEqual(self.calendar(), [['available', 3]])
+        with self.assertNumQueries(0):
+            self.calendar()
+
+    def test_source_writes_replace_the_cached_calendar_after_commit(self):
+        self.calendar()
+        version = cache.get(availability_calendar._version_key(self.tool.id), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            rental = RentalTransaction.objects.create(
+                tool=self.tool, owner=self.owner, borrower=self.borrower,
+                start_date=self.day, end_date=self.day, status='active',
+            )
+            # Not before the commit, or a concurrent read could cache the old rows under the new version
+            self.assertEqual(cache.get(availability_calendar._version_key(self.tool.id), 0), version)
+        self.assertEqual(self.calendar(), [['booked', 1], ['available', 2]])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            FlexibleAvailability.objects.create(tool=self.tool, start_date=self.day + timedelta(days=2),
+                                                end_date=self.day + timedelta(days=2), is_available=False)
+        self.assertEqual(self.calendar(), [['booked', 1], ['available', 1], ['blocked', 1]])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            rental.delete()
+        self.assertEqual(self.calendar(), [['available', 2], ['blocked', 1]])
+
+    def test_writes_that_skip_signals_need_a_bump(self):
+        self.calendar()
+        HourlyAvailability.objects.bulk_create([
+            HourlyAvailability(tool=self.tool, date=self.day, hour=hour, is_booked=True) for hour in range(24)
+        ])
+        self.assertEqual(self.calendar(), [['available', 3]])
+        availability_calendar.bump_version(self.tool.id)
+        self.assertEqual(self.calendar(), [['booked', 1], ['available', 2]])
+
+
+class OccupancyTests(ApiTestCase):
+    # Monday 7 to Sunday 13 January 2030
+    start, end = date(2030, 1, 7), date(2030, 1, 13)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = UserProfile.objects.create_user(username='owner', password='x')
+        borrower = UserProfile.objects.create_user(username='borrower', password='x')
+        cls.rented, cls.scheduled, cls.idle = (
+            Tool.objects.create(name=name, owner=cls.owner, price_per_day=Decimal('10.00'))
+            for name in ('Rented', 'Scheduled', 'Idle')
+        )
+        Tool.objects.create(name='Not theirs', owner=borrower, price_per_day=Decimal('10.00'))
+        for status, first, last in (('active', 8, 9), ('cancelled', 12, 12)):
+            RentalTransaction.objects.create(tool=cls.rented, owner=cls.owner, borrower=borrower, status=status,
+                                             start_date=date(2030, 1, first), end_date=date(2030, 1, last))
+        for hour in (9, 10, 11):
+            HourlyAvailability.objects.create(tool=cls.rented, date=date(2030, 1, 11), hour=hour, is_booked=True)
+        RecurringAvailability.objects.create(tool=cls.scheduled, pattern_type='weekly', start_date=date(2030, 1, 1),
+                                             days_of_week=[0, 1, 2, 3, 4], start_time=time(9), end_time=time(17))
+        FlexibleAvailability.objects.create(tool=cls.scheduled, start_date=date(2030, 1, 10), end_date=date(2030, 1, 10),
+                                            is_available=False)
+        Availability.objects.create(tool=cls.scheduled, start_date=date(2030, 1, 13), end_date=date(2030, 1, 20), is_booked=True)
+
+    expected = {
+        'Rented': ['available', 'booked', 'booked', 'available', 'partial', 'available', 'available'],
+        'Scheduled': ['available', 'available', 'available', 'blocked', 'available', 'closed', 'booked'],
+        'Idle': ['available'] * 7,
+    }
+
+    def test_matrix_matches_the_calendar_merge(self):
+        tool_ids = [self.rented.id, self.scheduled.id, self.idle.id]
+        matrix = occupancy.build_matrix(tool_ids, self.start, self.end)
+        self.assertEqual(matrix.shape, (3, 7))
+        sources = availability_calendar.load_sources(tool_ids, self.start, self.end)
+        for row, tool_id in zip(matrix, tool_ids):
+            self.assertEqual(row.tolist(), availability_calendar.merge_days(sources[tool_id], self.start, self.end))
+        self.assertEqual(occupancy.build_matrix([], self.start, self.end).shape, (0, 7))
+
+    def test_run_length_encoded_heatmap(self):
+        heatmap = occupancy.owner_heatmap(self.owner.id, self.start, self.end)
+        self.assertEqual(heatmap['days'], 7)
+        self.assertEqual([row['tool_name'] for row in heatmap['tools']], ['Rented', 'Scheduled', 'Idle'])
+        for row in heatmap['tools']:
+            with self.subTest(row['tool_name']):
+                self.assertEqual([name for name, length in row['rle'] for _ in range(length)], self.expected[row['tool_name']])
+        self.assertEqual([row['occupancy_rate'] for row in heatmap['tools']], [round(3 / 7, 4), round(1 / 7, 4), 0.0])
+        # The blocked Thursday is not occupancy
+        self.assertEqual(heatmap['occupied_tools_per_day'], [0, 1, 1, 0, 1, 0, 1])
+
+    def test_bitmap_heatmap(self):
+        heatmap = occupancy.owner_heatmap(self.owner.id, self.start, self.end, occupancy.BITMAP)
+        for row in heatmap['tools']:
+            with self.subTest(row['tool_name']):
+                bits = np.unpackbits(np.frombuffer(base64.b64decode(row['bitmap']), dtype=np.uint8))[:7]
+                occupied = [name in ('partial', 'booked') for name in self.expected[row['tool_name']]]
+                self.assertEqual(bits.astype(bool).tolist(), occupied)
+        with self.assertRaises(ValueError):
+            occupancy.owner_heatmap(self.owner.id, self.start, self.end, 'csv')
+
+
+class PrefixIndexTests(SimpleTestCase):
+    def texts(self, index, prefix, limit=autocomplete.DEFAULT_LIMIT):
+        return [suggestion['text'] for suggestion in index.lookup(prefix, limit)]
+
+    def test_matches_word_starts_ranked_by_popularity(self):
+        index = autocomplete.PrefixIndex()
+        index.load([
+            (autocomplete.TOOL, 'Cordless Drill', 5), (autocomplete.TOOL, 'Drill Press', 2),
+            (autocomplete.TOOL, 'Hammer Drill', 9), (autocomplete.TOOL, 'Sander', 20),
+            (autocomplete.CITY, 'Drillton', 1), (autocomplete.TOOL, 'Deleted', 0),
+        ])
+        self.assertEqual(self.texts(index, 'dri'), ['Hammer Drill', 'Cordless Drill', 'Drill Press', 'Drillton'])
+        self.assertEqual(self.texts(index, 'DRILL P'), ['Drill Press'])
+        self.assertEqual(self.texts(index, 'dri', limit=2), ['Hammer Drill', 'Cordless Drill'])
+        self.assertEqual(self.texts(index, 'ill'), [])
+        self.assertEqual(self.texts(index, '  '), [])
+        self.assertEqual(index.lookup('sand'), [{'text': 'Sander', 'type': 'tool', 'popularity': 20}])
+
+    def test_accents_and_spacing_are_normalized(self):
+        index = autocomplete.PrefixIndex()
+        index.add(autocomplete.CITY, ' São  Paulo ')
+        self.assertEqual(self.texts(index, 'sao p'), ['São  Paulo'])
+        self.assertEqual(self.texts(index, 'paulo'), ['São  Paulo'])
+
+    def test_updates_keep_cached_prefixes_exact(self):
+        index = autocomplete.PrefixIndex()
+        names = [f'Saw {number}' for number in range(40)]
+        weights = {}
+        for step in range(400):
+            name = names[(step * 7) % len(names)]
+            if step % 3 == 2 and weights.get(name):
+                index.remove(autocomplete.TOOL, name)
+                weights[name] -= 1
+            else:
+                index.add(autocomplete.TOOL, name)
+                weights[name] = weights.get(name, 0) + 1
+            if step % 20 == 0:
+                expected = sorted((name for name, weight in weights.items() if weight > 0),
+                                  key=lambda name: (-weights[name], len(name), name.lower()))
+                for prefix in ('s', 'sa', 'saw'):
+                    self.assertEqual(self.texts(index, prefix, autocomplete.MAX_LIMIT), expected[:autocomplete.MAX_LIMIT])
+
+    def test_max_terms_caps_new_terms(self):
+        index = autocomplete.PrefixIndex(max_terms=2)
+        for name in ('Drill', 'Saw', 'Sander'):
+            index.add(autocomplete.TOOL, name)
+        index.add(autocomplete.TOOL, 'Saw')
+        self.assertEqual(len(index), 2)
+        self.assertEqual(self.texts(index, 's'), ['Saw'])
+
+
+class AutocompleteTests(ApiTestCase):
+    def setUp(self):
+        for name in ('_index', '_pending', '_refresher'):
+            patcher = mock.patch.object(autocomplete, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.owner = UserProfile.objects.create_user(username='owner', password='x')
+        self.borrower = UserProfile.objects.create_user(username='borrower', password='x')
+        self.drill = self.tool('Cordless Drill', 'Austin')
+        self.press = self.tool('Drill Press', 'Dallas')
+
+    def tool(self, name, city):
+        return Tool.objects.create(name=name, owner=self.owner, price_per_day=Decimal('10.00'), pickup_city=city)
+
+    def rent(self, tool):
+        today = date.today()
+        return RentalTransaction.objects.create(tool=tool, owner=self.owner, borrower=self.borrower,
+                                                start_date=today, end_date=today, status='active')
+
+    def texts(self, prefix):
+        return [suggestion['text'] for suggestion in autocomplete.suggest(prefix)]
+
+    def test_requests_never_build_the_index(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(autocomplete.suggest('dri'), [])
+        self.assertIsNone(autocomplete._refresher)
+
+    def test_build_ranks_by_rentals_and_signals_keep_it_current(self):
+        self.rent(self.press)
+        autocomplete.build_index()
+        self.assertEqual(self.texts('dri'), ['Drill Press', 'Cordless Drill'])
+
+        self.rent(self.drill)
+        self.rent(self.drill)
+        self.assertEqual(self.texts('dri'), ['Cordless Drill', 'Drill Press'])
+        self.drill.name = 'Impact Driver'
+        self.drill.save()
+        self.assertEqual(self.texts('dri'), ['Impact Driver', 'Drill Press'])
+        self.assertEqual(self.texts('cordless'), [])
+        self.press.delete()
+        self.assertEqual(self.texts('dri'), ['Impact Driver'])
+        self.assertEqual(self.texts('a'), ['Austin'])
+
+    def test_updates_during_a_rebuild_are_replayed(self):
+        autocomplete.build_index()
+        load = autocomplete.PrefixIndex.load
+
+        def load_with_concurrent_writes(index, entries):
+            # Writes that land after the rebuild's snapshot query
+            self.press.delete()
+            self.tool('Drill Bit Set', 'Austin')
+            return load(index, entries)
+
+        with mock.patch.object(autocomplete.PrefixIndex, 'load', load_with_concurrent_writes):
+            autocomplete.build_index()
+        self.assertIsNone(autocomplete._pending)
+        self.assertEqual(self.texts('dri'), ['Drill Bit Set', 'Cordless Drill'])
+
+    def test_endpoint(self):
+        autocomplete.build_index()
+        response = self.client.get('/api/tools/autocomplete/', {'q': 'dri', 'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'query': 'dri', 'suggestions': [{'text': 'Drill Press', 'type': 'tool', 'popularity': 1}]})
+        self.assertEqual(self.client.get('/api/tools/autocomplete/', {'q': 'dri', 'limit': 'x'}).status_code, 400)
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        clock = mock.patch('toolshare_backend.db_backends.pool.time.monotonic', lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.opened = []
+
+    def connect(self):
+        conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self.opened.append(conn)
+        return conn
+
+    def pool(self, **options):
+        options.setdefault('ping', lambda conn: conn.execute('SELECT 1'))
+        options.setdefault('reset', lambda conn: conn.rollback())
+        return ConnectionPool(self.connect, error_class=TimeoutError, **options)
+
+    def test_checkin_makes_the_connection_reusable(self):
+        pool = self.pool()
+        conn = pool.checkout()
+        pool.checkin(conn)
+        self.assertIs(pool.checkout(), conn)
+        self.assertEqual(pool.stats()['created'], 1)
+        self.assertEqual(pool.stats()['in_use'], 1)
+
+    def test_checkout_fails_after_the_timeout_when_full(self):
+        pool = self.pool(max_size=2, timeout=0)
+        first, second = pool.checkout(), pool.checkout()
+        with self.assertRaises(TimeoutError):
+            pool.checkout()
+        self.assertEqual(pool.stats()['timeouts'], 1)
+        pool.checkin(first)
+        self.assertIs(pool.checkout(), first)
+        self.assertEqual(len(self.opened), 2)
+
+    def test_connection_failing_its_ping_is_replaced(self):
+        pool = self.pool(health_check_after=5)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        conn.close()
+        self.now += 10
+        replacement = pool.checkout()
+        self.assertIsNot(replacement, conn)
+        replacement.execute('SELECT 1')
+        self.assertEqual(pool.stats()['discarded'], 1)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_connection_failing_its_reset_is_not_returned(self):
+        pool = self.pool(reset=mock.Mock(side_effect=sqlite3.OperationalError))
+        conn = pool.checkout()
+        pool.checkin(conn)
+        self.assertEqual(pool.stats()['idle'], 0)
+        self.assertIsNot(pool.checkout(), conn)
+
+    def test_discarded_connection_frees_its_slot(self):
+        pool = self.pool(max_size=1, timeout=0)
+        pool.discard(pool.checkout())
+        pool.checkout()
+        self.assertEqual(pool.stats()['discarded'], 1)
+
+    def test_connections_past_max_lifetime_are_recycled(self):
+        pool = self.pool(max_lifetime=60, idle_timeout=3600)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        self.now += 30
+        self.assertIs(pool.checkout(), conn)
+        self.now += 31
+        pool.checkin(conn)  # Too old to go back to the idle list
+        self.assertEqual(pool.stats()['idle'], 0)
+        self.assertIsNot(pool.checkout(), conn)
+
+    def test_idle_connections_past_idle_timeout_are_recycled(self):
+        pool = self.pool(idle_timeout=300)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        self.now += 301
+        self.assertIsNot(pool.checkout(), conn)
+        self.assertEqual(pool.stats()['discarded'], 1)
+
+
+class MetricsTests(ApiTestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+
+    def lines(self):
+        return metrics.render().splitlines()
+
+    def test_histogram_buckets_are_upper_inclusive(self):
+        histogram = metrics.Histogram((1, 5))
+        for value in (0.5, 1, 3, 5, 7):
+            histogram.observe(('GET',), value)
+        self.assertEqual(histogram.series[('GET',)], [2, 2, 1, 16.5])
+
+    def test_query_timer_counts_and_logs_slow_queries(self):
+        timer = metrics.QueryTimer(slow_seconds=0)
+        context = {'connection': connections['default']}
+        with self.assertLogs('api.slow_sql', 'WARNING') as logs:
+            self.assertEqual(timer(lambda *args: 'rows', 'SELECT 1', None, False, context), 'rows')
+        self.assertIn('SELECT 1', logs.output[0])
+        with self.assertRaises(RuntimeError), self.assertLogs('api.slow_sql', 'WARNING'):
+            timer(mock.Mock(side_effect=RuntimeError), 'SELECT 2', None, False, context)
+        self.assertEqual((timer.count, timer.slow), (2, 2))
+        self.assertFalse(metrics.QueryTimer(slow_seconds=60).slow)
+
+    def test_render_prometheus_text(self):
+        sql = metrics.QueryTimer(slow_seconds=1)
+        sql.count, sql.seconds, sql.slow = 3, 0.25, 1
+        metrics.registry.record('GET', 'api/tools/<int:pk>/', 200, 0.02, sql)
+        metrics.registry.record('GET', 'api/tools/<int:pk>/', 404, 0.3, sql)
+        metrics.registry.record('POST', 'say "hi"\n', 500, 20, sql)
+        lines = self.lines()
+        route = 'method="GET",route="api/tools/<int:pk>/"'
+        self.assertIn(f'toolshare_http_requests_total{{{route},status="200"}} 1', lines)
+        self.assertIn(f'toolshare_http_request_duration_seconds_bucket{{{route},le="0.01"}} 0', lines)
+        self.assertIn(f'toolshare_http_request_duration_seconds_bucket{{{route},le="0.025"}} 1', lines)
+        self.assertIn(f'toolshare_http_request_duration_seconds_bucket{{{route},le="+Inf"}} 2', lines)
+        self.assertIn(f'toolshare_http_request_duration_seconds_count{{{route}}} 2', lines)
+        self.assertIn(f'toolshare_db_queries_per_request_bucket{{{route},le="5"}} 2', lines)
+        self.assertIn(f'toolshare_db_query_seconds_total{{{route}}} 0.5', lines)
+        self.assertIn(f'toolshare_db_slow_queries_total{{{route}}} 2', lines)
+        self.assertIn('toolshare_http_requests_total{method="POST",route="say \\"hi\\"\\n",status="500"} 1', lines)
+        self.assertIn('# TYPE toolshare_http_request_duration_seconds histogram', lines)
+
+    def test_middleware_records_the_route_pattern(self):
+        owner = UserProfile.objects.create_user(username='owner', password='x')
+        tool = Tool.objects.create(name='Drill', owner=owner, price_per_day=Decimal('10.00'))
+        self.client.get(f'/api/tools/{tool.id}/reviews/')
+        self.client.get('/no/such/page/')
+        routes = {labels[1] for labels in metrics.registry.requests}
+        self.assertEqual(routes, {'api/tools/<int:tool_id>/reviews/', metrics.UNMATCHED_ROUTE})
+        series = metrics.registry.queries.series[('GET', 'api/tools/<int:tool_id>/reviews/')]
+        self.assertGreater(series[-1], 0)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_endpoint_needs_staff_or_the_token(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        self.assertEqual(self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn(b'toolshare_http_requests_total', response.content)
+
+        self.client.force_login(UserProfile.objects.create_user(username='user', password='x'))
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        self.client.force_login(UserProfile.objects.create_user(username='staff', password='x', is_staff=True))
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 200)
+
+    def test_no_token_configured_means_staff_only(self):
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+
+class StructuredLoggingTests(SimpleTestCase):
+    def record(self, name='api.views', level=logging.INFO, msg='hello %s', args=('world',), **extra):
+        record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_json_formatter_includes_extra_fields_and_traceback(self):
+        formatter = structured_logging.JsonFormatter()
+        payload = json.loads(formatter.format(self.record(request_id='abc', tool_id=7, when=date(2025, 1, 2))))
+        self.assertEqual(payload['message'], 'hello world')
+        self.assertEqual((payload['level'], payload['logger'], payload['request_id']), ('INFO', 'api.views', 'abc'))
+        self.assertEqual((payload['tool_id'], payload['when']), (7, '2025-01-02'))
+        self.assertTrue(payload['ts'].endswith('+00:00'))
+        self.assertNotIn('args', payload)
+
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            record = self.record(exc_info=sys.exc_info())
+        self.assertIn('ValueError: boom', json.loads(formatter.format(record))['exc'])
+
+    def test_sampling_filter_uses_the_longest_prefix_and_keeps_warnings(self):
+        sampler = structured_logging.SamplingFilter({'api': 0.5, 'api.views': 0.0})
+        self.assertEqual(sampler.rate_for('api.views.tools'), 0.0)
+        self.assertEqual(sampler.rate_for('api.search'), 0.5)
+        self.assertEqual(sampler.rate_for('api_other'), 1.0)
+        self.assertEqual(sampler.rate_for('django.request'), 1.0)
+
+        self.assertFalse(sampler.filter(self.record('api.views')))
+        self.assertTrue(sampler.filter(self.record('api.views', logging.WARNING)))
+        with mock.patch.object(structured_logging.random, 'random', return_value=0.4):
+            self.assertTrue(sampler.filter(self.record('api.search')))
+        with mock.patch.object(structured_logging.random, 'random', return_value=0.6):
+            self.assertFalse(sampler.filter(self.record('api.search')))
+
+    def test_full_queue_drops_records_and_reports_them(self):
+        before = structured_logging.dropped_records()
+        handler = structured_logging.NonBlockingQueueHandler(queue.Queue(maxsize=1))
+        handler.handle(self.record())
+        handler.handle(self.record())
+        handler.handle(self.record())
+        self.assertEqual(handler.queue.qsize(), 1)
+        self.assertEqual(handler.dropped, 2)
+        self.assertEqual(structured_logging.dropped_records(), before + 2)
+        self.assertIn(f'toolshare_log_records_dropped_total {before + 2}', metrics.render().splitlines())
+
+    def test_queued_record_is_frozen(self):
+        handler = structured_logging.NonBlockingQueueHandler(queue.Queue())
+        args = ['before']
+        handler.handle(self.record(args=(args,)))
+        args[0] = 'after'
+        queued = handler.queue.get_nowait()
+        self.assertEqual((queued.getMessage(), queued.args), ("hello ['before']", None))
+
+    def test_request_id_middleware(self):
+        seen = []
+
+        def view(request):
+            seen.append((request.request_id, structured_logging.request_id_var.get()))
+            return JsonResponse({})
+
+        middleware = structured_logging.RequestIdMiddleware(view)
+        factory = RequestFactory()
+        response = middleware(factory.get('/', HTTP_X_REQUEST_ID='trace-1.a_b'))
+        self.assertEqual(response['X-Request-ID'], 'trace-1.a_b')
+        self.assertEqual(seen[-1], ('trace-1.a_b', 'trace-1.a_b'))
+
+        for incoming in ('', 'bad id', 'x' * 65, 'a\nb'):
+            with self.subTest(incoming=incoming):
+                response = middleware(factory.get('/', HTTP_X_REQUEST_ID=incoming))
+                self.assertNotEqual(response['X-Request-ID'], incoming)
+                self.assertRegex(response['X-Request-ID'], r'^[0-9a-f]{32}$')
+                self.assertEqual(seen[-1][0], response['X-Request-ID'])
+        self.assertIsNone(structured_logging.request_id_var.get())
+
+        record = self.record()
+        with mock.patch.object(structured_logging, 'request_id_var', mock.Mock(get=lambda: 'r1')):
+            structured_logging.RequestIdFilter().filter(record)
+        self.assertEqual(record.request_id, 'r1')
+
+
+@override_settings(LIVE_UPDATES_REDIS_URL='', LIVE_UPDATES_RETRY_MS=3000, LIVE_UPDATES_HEARTBEAT_SECONDS=5)
+class LiveUpdatesTests(ApiTestCase):
+    def setUp(self):
+        self.broker = live_updates.Broker(history_size=3)
+        patcher = mock.patch.object(live_updates, 'broker', self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_async(self, coroutine):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        return loop.run_until_complete(coroutine)
+
+    def test_dispatch_reaches_only_subscribers_of_the_tool(self):
+        async def scenario():
+            first = self.broker.subscribe({1, 2}, maxsize=10)
+            second = self.broker.subscribe({2}, maxsize=10)
+            self.assertEqual(self.broker.subscriber_count(), 2)
+            self.broker.dispatch({'tool_id': 1, 'action': 'created'})
+            self.broker.dispatch({'tool_id': 3, 'action': 'created'})
+            self.broker.dispatch({'tool_id': 2, 'action': 'deleted'})
+            await asyncio.sleep(0)
+            self.assertEqual(await first.get(1), (self.broker.event_id(1), {'tool_id': 1, 'action': 'created'}))
+            self.assertEqual(await first.get(1), (self.broker.event_id(3), {'tool_id': 2, 'action': 'deleted'}))
+            self.assertEqual(await second.get(1), (self.broker.event_id(3), {'tool_id': 2, 'action': 'deleted'}))
+            self.assertTrue(first.queue.empty())
+
+            first.close()
+            self.broker.dispatch({'tool_id': 1, 'action': 'updated'})
+            await asyncio.sleep(0)
+            self.assertTrue(first.queue.empty())
+            self.assertEqual(self.broker.subscriber_count(), 1)
+
+        self.run_async(scenario())
+        self.assertEqual(self.broker.delivered, 3)
+
+    def test_slow_subscriber_is_told_to_resync(self):
+        async def scenario():
+            subscription = self.broker.subscribe({1}, maxsize=2)
+            for _ in range(3):
+                self.broker.dispatch({'tool_id': 1})
+            await asyncio.sleep(0)
+            self.assertIsNone(await subscription.get(1))
+            self.assertFalse(subscription.overflowed)
+            self.broker.dispatch({'tool_id': 1})
+            await asyncio.sleep(0)
+            self.assertEqual((await subscription.get(1))[0], self.broker.event_id(4))
+
+        self.run_async(scenario())
+
+    def test_closed_loop_unsubscribes(self):
+        loop = asyncio.new_event_loop()
+        self.broker.subscribe({1}, loop=loop, maxsize=1)
+        loop.close()
+        self.broker.dispatch({'tool_id': 1})
+        self.assertEqual((self.broker.dropped, self.broker.subscriber_count()), (1, 0))
+
+    def test_replay_after_last_event_id(self):
+        for tool_id in (1, 2, 1, 1):
+            self.broker.dispatch({'tool_id': tool_id})
+        # History holds events 2-4
+        self.assertEqual([event_id for event_id, _ in self.broker.replay(self.broker.event_id(1), {1})],
+                         [self.broker.event_id(3), self.broker.event_id(4)])
+        self.assertEqual(self.broker.replay(self.broker.event_id(3), {1, 2}), [(self.broker.event_id(4), {'tool_id': 1})])
+        self.assertEqual(self.broker.replay(self.broker.event_id(4), {1}), [])
+        for last_event_id in (self.broker.event_id(0), self.broker.event_id(5), 'otherboot-3', self.broker.boot_id + '-x', '', None):
+            with self.subTest(last_event_id=last_event_id):
+                self.assertIsNone(self.broker.replay(last_event_id, {1}))
+
+    def test_stream_replays_then_follows_live_events(self):
+        self.broker.dispatch({'tool_id': 1, 'action': 'created'})
+        self.broker.dispatch({'tool_id': 1, 'action': 'updated'})
+
+        async def scenario():
+            body = live_updates.stream({1}, last_event_id=self.broker.event_id(1))
+            self.assertEqual(await body.__anext__(), 'retry: 3000\n\n')
+            self.assertEqual(await body.__anext__(), live_updates.format_event(self.broker.event_id(2), {'tool_id': 1, 'action': 'updated'}))
+            live_event = asyncio.ensure_future(body.__anext__())
+            await asyncio.sleep(0)
+            self.broker.dispatch({'tool_id': 1, 'action': 'deleted'})
+            self.assertEqual(await live_event, live_updates.format_event(self.broker.event_id(3), {'tool_id': 1, 'action': 'deleted'}))
+            await body.aclose()
+            self.assertEqual(self.broker.subscriber_count(), 0)
+
+            body = live_updates.stream({2, 1}, last_event_id='otherboot-7')
+            await body.__anext__()
+            resync = await body.__anext__()
+            await body.aclose()
+            return resync
+
+        resync = self.run_async(scenario())
+        self.assertEqual(resync, 'id: otherboot-7\nevent: resync\ndata: {"tool_ids": [1, 2]}\n\n')
+
+    def test_committed_writes_are_published(self):
+        owner = UserProfile.objects.create_user(username='owner', password='x')
+        tool = Tool.objects.create(name='Drill', owner=owner, price_per_day=Decimal('10.00'))
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        subscription = self.broker.subscribe({tool.id}, loop=loop, maxsize=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            row = Availability.objects.create(tool=tool, start_date=date(2025, 3, 1), end_date=date(2025, 3, 2), is_booked=True)
+        event_id, delta = loop.run_until_complete(subscription.get(1))
+        self.assertEqual(event_id, self.broker.event_id(1))
+        self.assertEqual(delta, {'tool_id': tool.id, 'source': 'availability', 'action': 'created', 'id': row.id,
+                                 'start_date': '2025-03-01', 'end_date': '2025-03-02', 'is_booked': True})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Availability.objects.get(id=row.id).delete()
+        self.assertEqual(loop.run_until_complete(subscription.get(1))[1]['action'], 'deleted')
+        self.assertIsNone(live_updates.build_delta(Feedback(), 'created'))
+
+    def test_redis_relay(self):
+        redis = mock.Mock()
+        client = redis.Redis.from_url.return_value
+        with mock.patch.dict(sys.modules, {'redis': redis}), \
+                override_settings(LIVE_UPDATES_REDIS_URL='redis://cache:6379/0'), \
+                mock.patch.object(live_updates, '_backend', None):
+            relay = live_updates.backend()
+            self.assertIs(live_updates.backend(), relay)
+            redis.Redis.from_url.assert_called_once_with('redis://cache:6379/0')
+
+            with mock.patch.object(relay, 'ensure_listening'):
+                live_updates.publish({'tool_id': 1})
+                client.publish.assert_called_once_with(settings.LIVE_UPDATES_REDIS_CHANNEL, '{"tool_id": 1}')
+                self.assertEqual(self.broker.delivered + self.broker.dropped, 0)
+
+                # A failed publish still reaches this process's subscribers
+                client.publish.side_effect = ConnectionError
+                with self.assertLogs('api.live_updates', 'WARNING'):
+                    live_updates.publish({'tool_id': 2})
+                self.assertEqual(self.broker.replay(self.broker.event_id(0), {2}), [(self.broker.event_id(1), {'tool_id': 2})])
+
+            client.pubsub.return_value.listen.return_value = [{'data': b'{"tool_id": 3}'}, {'data': b'not json'}]
+            with self.assertLogs('api.live_updates', 'WARNING'):
+                relay._listen()
+            client.pubsub.return_value.subscribe.assert_called_once_with(settings.LIVE_UPDATES_REDIS_CHANNEL)
+            self.assertEqual(self.broker.replay(self.broker.event_id(1), {3}), [(self.broker.event_id(2), {'tool_id': 3})])
+
+
+class FastJSONTests(SimpleTestCase):
+    def render_both(self, data, media_type='application/json'):
+        return renderers.FastJSONRenderer().render(data, media_type), JSONRenderer().render(data, media_type)
+
+    def parse_both(self, body, encoding='utf-8'):
+        results = []
+        for parser in (renderers.FastJSONParser(), JSONParser()):
+            try:
+                results.append(parser.parse(io.BytesIO(body), 'application/json', {'encoding': encoding}))
+            except ParseError as e:
+                results.append(('ParseError', str(e.detail)))
+        return results
+
+    def test_renders_the_same_bytes_as_the_stock_renderer(self):
+        cases = {
+            'decimal': {'price': Decimal('12.50'), 'deposit': Decimal('0.1')},
+            'aware datetime': {'at': datetime(2025, 3, 1, 9, 30, 15, 123456, tzinfo=dt_timezone.utc)},
+            'offset datetime': {'at': datetime(2025, 3, 1, 9, 30, tzinfo=dt_timezone(timedelta(hours=-5)))},
+            'naive datetime, date and time': [datetime(2025, 3, 1, 9, 30), date(2025, 3, 1), time(9, 30, 5)],
+            'line separators': {'notes': 'one\u2028two\u2029three', 'name': 'Bohrmaschine \u00fc \U0001f527'},
+            'uuid and lazy text': [uuid.UUID(int=1), gettext_lazy('Drill')],
+            'numpy': {'occupancy': np.array([1, 0, 2], dtype=np.uint8)},
+            'int keys and big ints': {1: 'a', 'big': 2 ** 70, 'floats': [0.5, -1.25]},
+            'scalars': [None, True, 'x', 3],
+        }
+        for name, data in cases.items():
+            with self.subTest(name):
+                fast, stock = self.render_both(data)
+                self.assertEqual(fast, stock)
+        fast, stock = self.render_both({'notes': '\u2028'})
+        self.assertEqual(fast, b'{"notes":"\\u2028"}')
+        self.assertEqual(self.render_both(None), (b'', b''))
+        self.assertEqual(*self.render_both({'a': [1, 2]}, 'application/json; indent=2'))
+
+    def test_aware_times_raise_like_the_stock_renderer(self):
+        for renderer in (renderers.FastJSONRenderer(), JSONRenderer()):
+            with self.subTest(renderer=type(renderer).__name__), self.assertRaises(ValueError):
+                renderer.render({'at': time(9, 30, tzinfo=dt_timezone.utc)})
+
+    def test_nan_renders_as_null(self):
+        self.assertEqual(renderers.FastJSONRenderer().render({'rate': float('nan')}), b'{"rate":null}')
+
+    def test_parses_like_the_stock_parser(self):
+        bodies = [
+            b'{"price": "12.50", "qty": 3, "ok": true, "none": null}',
+            '{"notes": "one\u2028two", "name": "\u00fc\U0001f527"}'.encode(),
+            b'{"escaped": "\\u2028\\u00fc"}',
+            b'[1.5, -2, 1e3]',
+        ]
+        for body in bodies:
+            with self.subTest(body=body):
+                fast, stock = self.parse_both(body)
+                self.assertEqual(fast, stock)
+                self.assertEqual(type(fast), type(stock))
+
+    def test_malformed_bodies_raise_the_same_parse_error(self):
+        for body in (b'{"a": ', b'', b'{"a": 1,}', b'NaN', b'{"a": Infinity}', b'\xff\xfe{}', b'{"a": "\xe9"}'):
+            with self.subTest(body=body):
+                fast, stock = self.parse_both(body)
+                self.assertEqual(fast[0], 'ParseError')
+                self.assertEqual(fast, stock)
+
+    def test_other_charsets_use_the_stock_parser(self):
+        body = '{"name": "Perceuse \u00e9lectrique"}'.encode('latin-1')
+        self.assertEqual(*self.parse_both(body, encoding='latin-1'))
+        self.assertEqual(self.parse_both(body, encoding='latin-1')[0], {'name': 'Perceuse \u00e9lectrique'})
+        self.assertEqual(*self.parse_both(b'{}', encoding='no-such-charset'))
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    """The test database as primary and a second SQLite file as a replica that has not caught up"""
+
+    # Resolved when the class is set up, after the replica alias has been added
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        replica = dict(connections['default'].settings_dict, NAME=os.path.join(cls.directory, 'replica.sqlite3'))
+        cls.databases_patch = mock.patch.dict(settings.DATABASES, {db_router.REPLICA_ALIAS: replica})
+        cls.databases_patch.start()
+        with connections[db_router.REPLICA_ALIAS].schema_editor() as editor:
+            editor.create_model(UserProfile)
+            editor.create_model(Tool)
+        super().setUpClass()
+        search.create_index()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[db_router.REPLICA_ALIAS].close()
+        del connections[db_router.REPLICA_ALIAS]
+        cls.databases_patch.stop()
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        owner = UserProfile.objects.create_user(username='owner', password='x')
+        self.tool = Tool.objects.create(name='Drill on the primary', owner=owner)
+        self.middleware = db_router.ReplicaMiddleware(self.get_response)
+        self.marked_view = db_router.replica_reads(lambda request: self.view(request))
+        self.read = lambda: list(Tool.objects.values_list('name', flat=True))
+        self.seen = {}
+
+    def get_response(self, request):
+        # What Django's handler does between the middleware's __call__ and the view
+        self.middleware.process_view(request, self.current_view, (), {})
+        return self.current_view(request)
+
+    def view(self, request):
+        if request.method == 'POST' or request.GET.get('write'):
+            Tool.objects.filter(pk=self.tool.pk).update(name='Renamed')
+        self.seen['fresh_reads'] = db_router.fresh_reads()
+        return JsonResponse({'tools': self.read()})
+
+    def request(self, method='get', path='/', cookie=None, marked=True):
+        request = getattr(RequestFactory(), method)(path)
+        if cookie:
+            request.COOKIES[db_router.PIN_COOKIE] = cookie
+        self.current_view = self.marked_view if marked else self.view
+        return self.middleware(request)
+
+    def names(self, response):
+        return json.loads(response.content)['tools']
+
+    def test_marked_get_reads_the_replica(self):
+        response = self.request()
+        self.assertEqual(self.names(response), [])
+        self.assertNotIn(db_router.PIN_COOKIE, response.cookies)
+
+    def test_unmarked_view_reads_the_primary(self):
+        self.assertEqual(self.names(self.request(marked=False)), ['Drill on the primary'])
+
+    def test_write_pins_the_client_to_the_primary(self):
+        response = self.request('post')
+        self.assertEqual(self.names(response), ['Renamed'])
+        cookie = response.cookies[db_router.PIN_COOKIE].value
+        pinned = self.request(cookie=cookie)
+        self.assertEqual(self.names(pinned), ['Renamed'])
+        self.assertTrue(self.seen['fresh_reads'])
+
+    def test_expired_pin_goes_back_to_the_replica(self):
+        self.assertEqual(self.names(self.request(cookie='1')), [])
+        self.assertFalse(self.seen['fresh_reads'])
+
+    def test_write_during_a_replica_request_pins_its_remaining_reads(self):
+        response = self.request(path='/?write=1')
+        self.assertEqual(self.names(response), ['Renamed'])
+        self.assertTrue(self.seen['fresh_reads'])
+        self.assertIn(db_router.PIN_COOKIE, response.cookies)
+
+    def test_pinned_requests_skip_and_refill_caches(self):
+        card = tool_cards.get_cards([self.tool.id])[self.tool.id]
+        cache.set(tool_cards._key(self.tool.id), dict(card, name='Cached from the replica'))
+        self.addCleanup(tool_cards.invalidate, [self.tool.id])
+        self.read = lambda: [card['name'] for card in tool_cards.get_cards([self.tool.id]).values()]
+        self.assertEqual(self.names(self.request(marked=False)), ['Cached from the replica'])
+        pinned = self.request(cookie=str(2 ** 40), marked=False)
+        self.assertEqual(self.names(pinned), ['Drill on the primary'])
+        self.assertEqual(self.names(self.request(marked=False)), ['Drill on the primary'])
+
+
+class QueryPlanTests(ApiTestCase):
+    """The hot paths of check_query_plans keep using their indexes (on a small dataset)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = UserProfile.objects.create_user(username='owner', password='x')
+        borrower = UserProfile.objects.create_user(username='borrower', password='x')
+        today = date.today()
+        tools = [
+            Tool.objects.create(
+                name=f'Tool {index}', owner=owner, price_per_day=Decimal('10.00'),
+                latitude=Decimal('40.7') + Decimal(index) / 100, longitude=Decimal('-74.0') + Decimal(index) / 100,
+                pickup_latitude=Decimal('40.7'), pickup_longitude=Decimal('-74.0'),
+            )
+            for index in range(20)
+        ]
+        for index, tool in enumerate(tools):
+            start = today + timedelta(days=index)
+            RentalTransaction.objects.create(
+                tool=tool, owner=owner, borrower=borrower, start_date=start - timedelta(days=10),
+                end_date=start - timedelta(days=8), status='active'
+            )
+            BorrowRequest.objects.create(
+                tool=tool, owner=owner, borrower=borrower, start_date=start, end_date=start + timedelta(days=2),
+                expires_at=timezone.now() + timedelta(days=1)
+            )
+            HourlyAvailability.objects.create(tool=tool, date=today, hour=index, is_booked=True)
+        cls.subjects = {'tool': tools[0], 'user': owner, 'start': today, 'end': today + timedelta(days=30)}
+
+    def test_hot_paths_use_their_indexes(self):
+        command = check_query_plans.Command()
+        for name in check_query_plans.HOT_PATHS:
+            with self.subTest(name):
+                queries, problems = command.check_path(name, self.subjects)
+                self.assertTrue(queries)
+                self.assertEqual(problems, [])
+
+
+class PaginationTests(TestCase):
+    def test_cursor_round_trip(self):
+        created_at = datetime(2030, 1, 2, 3, 4, 5, 678, tzinfo=dt_timezone.utc)
+        cursor = pagination.encode_cursor(created_at, 42)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(pagination.decode_cursor(cursor), (created_at, 42))
+
+    def test_invalid_cursors_raise_value_error(self):
+        for cursor in ('', 'not a cursor', pagination.encode_cursor(date(2030, 1, 1), 1)[:-3], '\xff'):
+            with self.subTest(cursor=cursor), self.assertRaises(ValueError):
+                pagination.decode_cursor(cursor)
+
+    def test_page_size_is_clamped(self):
+        self.assertEqual(pagination.page_size(None), pagination.DEFAULT_PAGE_SIZE)
+        self.assertEqual(pagination.page_size('0'), 1)
+        self.assertEqual(pagination.page_size('1000'), pagination.MAX_PAGE_SIZE)
+        with self.assertRaises(ValueError):
+            pagination.page_size('ten')
+
+    def test_pages_walk_every_row_once_newest_first(self):
+        shared = datetime(2030, 1, 1, tzinfo=dt_timezone.utc)
+        for index in range(7):
+            event = OutboxEvent.objects.create(topic='test', aggregate_type='tool', aggregate_id=index)
+            # Several rows share a timestamp, so the id tie-break decides their order
+            OutboxEvent.objects.filter(pk=event.pk).update(created_at=shared + timedelta(seconds=index // 3))
+        expected = list(OutboxEvent.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+        seen, cursor = [], None
+        while True:
+            rows, cursor = pagination.keyset_page(OutboxEvent.objects.values('id', 'created_at'), cursor, limit=3)
+            seen.extend(row['id'] for row in rows)
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+
+
+class NearCacheTests(ApiTestCase):
+    """near_cache.nearby gives the same tools and distances as scanning every tool"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = UserProfile.objects.create_user(username='owner', password='x')
+        # A grid across the lat 41 tile edge, every tenth one hourly
+        for row in range(9):
+            for column in range(9):
+                lat, lng = Decimal('40.5') + Decimal(row) / 10, Decimal('-74.4') + Decimal(column) / 10
+                Tool.objects.create(
+                    name=f'Tool {row}-{column}', owner=cls.owner, price_per_day=Decimal('10.00'),
+                    pricing_type='hourly' if (row * 9 + column) % 10 == 0 else 'daily',
+                    latitude=lat, longitude=lng, pickup_latitude=lat, pickup_longitude=lng,
+                )
+        Tool.objects.filter(name='Tool 4-4').update(available=False)
+        Tool.objects.filter(name='Tool 4-5').update(pickup_latitude=None, pickup_longitude=None)
+
+    def setUp(self):
+        cache.clear()
+
+    def brute_force(self, lat, lng, radius, pricing_type=None):
+        tools = Tool.objects.filter(available=True, pickup_latitude__isnull=False, pickup_longitude__isnull=False)
+        if pricing_type:
+            tools = tools.filter(pricing_type=pricing_type)
+        distances = {}
+        for tool in tools:
+            distance = tool.calculate_distance_to(lat, lng)
+            if distance <= radius:
+                distances[tool.id] = distance
+        return distances
+
+    def assertMatches(self, lat, lng, radius, pricing_type=None):
+        expected = self.brute_force(lat, lng, radius, pricing_type)
+        actual = near_cache.nearby(lat, lng, radius, pricing_type)
+        self.assertEqual(set(actual), set(expected))
+        for tool_id, distance in expected.items():
+            self.assertAlmostEqual(actual[tool_id], distance, places=6)
+
+    def move(self, tool_name, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            tool = Tool.objects.get(name=tool_name)
+            for field, value in fields.items():
+                setattr(tool, field, value)
+            tool.save()
+        return tool
+
+    def test_distance_matches_the_model(self):
+        tool = Tool.objects.get(name='Tool 0-0')
+        self.assertAlmostEqual(near_cache.distance_miles(40.5, -74.4, 41.3, -73.6), tool.calculate_distance_to(41.3, -73.6), places=9)
+        self.assertEqual(near_cache.distance_miles(40.5, -74.4, 40.5, -74.4), 0)
+
+    def test_nearby_matches_a_scan(self):
+        # Points in a cell's centre and corners, and radii inside, between and beyond the buckets
+        for lat, lng in ((40.9, -74.0), (40.995, -74.005), (41.0049, -73.9951), (40.5, -74.4)):
+            for radius in (1, 3, 7.5, 30, 150):
+                for pricing_type in (None, 'hourly'):
+                    with self.subTest(lat=lat, lng=lng, radius=radius, pricing_type=pricing_type):
+                        self.assertMatches(lat, lng, radius, pricing_type)
+        # Every point above was served from, or written to, the cache by now
+        with self.assertNumQueries(0):
+            near_cache.nearby(40.9, -74.0, 7.5)
+
+    def test_nearby_is_empty_far_away(self):
+        self.assertEqual(near_cache.nearby(10.0, 10.0, 100), {})
+
+    def test_neighbours_share_a_cached_list(self):
+        near_cache.nearby(40.902, -74.003, 5)
+        # Another point in the same cell and radius bucket
+        with self.assertNumQueries(0):
+            distances = near_cache.nearby(40.908, -74.009, 4)
+        self.assertEqual(distances, self.brute_force(40.908, -74.009, 4))
+
+    def test_writes_replace_cached_lists(self):
+        lat, lng, radius = 40.9, -74.0, 10
+        self.assertMatches(lat, lng, radius)
+        moved = self.move('Tool 0-0', latitude=Decimal('40.91'), longitude=Decimal('-74.01'),
+                          pickup_latitude=Decimal('40.91'), pickup_longitude=Decimal('-74.01'))
+        self.assertIn(moved.id, near_cache.nearby(lat, lng, radius))
+        self.assertMatches(lat, lng, radius)
+
+        hidden = self.move('Tool 4-3', available=False)
+        self.assertNotIn(hidden.id, near_cache.nearby(lat, lng, radius))
+        self.assertMatches(lat, lng, radius)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Tool.objects.get(pk=moved.pk).delete()
+        self.assertNotIn(moved.id, near_cache.nearby(lat, lng, radius))
+
+    def version(self, lat, lng):
+        return cache.get(near_cache._version_key(near_cache._tile(lat, lng)))
+
+    def test_evicted_versions_do_not_revive_old_entries(self):
+        lat, lng, radius = 40.9, -74.0, 10
+        self.assertMatches(lat, lng, radius)
+        # A write that skipped the signals, then the version keys fall out of the cache
+        Tool.objects.filter(name='Tool 4-3').update(available=False)
+        cache.delete_many([near_cache._version_key(tile) for tile in near_cache._tiles_around(lat, lng, 20)])
+        self.assertMatches(lat, lng, radius)
+
+    def test_versions_only_move_forward(self):
+        self.assertIsNone(self.version(40.9, -74.0))
+        near_cache.bump_location(40.9, -74.0)
+        first = self.version(40.9, -74.0)
+        self.assertGreater(first, 1)
+        near_cache.bump_location(40.9, -74.0)
+        self.assertEqual(self.version(40.9, -74.0), first + 1)
+        cache.delete(near_cache._version_key(near_cache._tile(40.9, -74.0)))
+        near_cache.bump_location(40.9, -74.0)
+        self.assertGreater(self.version(40.9, -74.0), first + 1)
+
+    def test_eviction_between_seed_and_incr(self):
+        key = near_cache._version_key(near_cache._tile(40.9, -74.0))
+
+        def evicted(key, delta=1):
+            cache.delete(key)
+            raise ValueError(key)
+
+        with mock.patch.object(cache, 'incr', side_effect=evicted):
+            near_cache.bump_location(40.9, -74.0)
+        self.assertGreater(cache.get(key), 1)
+
+    def test_unrelated_saves_keep_the_cache(self):
+        near_cache.nearby(40.9, -74.0, 10)
+        self.move('Tool 4-3', name='Renamed')
+        with self.assertNumQueries(0):
+            near_cache.nearby(40.9, -74.0, 10)
+
+    def test_bump_only_touches_its_tile(self):
+        near_cache.nearby(40.5, -74.4, 1)
+        near_cache.bump_location(10.0, 10.0)
+        with self.assertNumQueries(0):
+            near_cache.nearby(40.5, -74.4, 1)
+        near_cache.bump_location(40.5, -74.4)
+        with self.assertNumQueries(1):
+            near_cache.nearby(40.5, -74.4, 1)
+
+
+@override_settings(OUTBOX_SETTLE_SECONDS=0, OUTBOX_MAX_ATTEMPTS=2, OUTBOX_BATCH_SIZE=100)
+class OutboxDrainTests(TestCase):
+    def setUp(self):
+        self.delivered = []
+        self.failing = set()
+        outbox.consumer('test', topics=['tool.changed'])(self.handle)
+        self.addCleanup(outbox.CONSUMERS.pop, 'test')
+
+    def handle(self, event):
+        if event.aggregate_id in self.failing:
+            raise RuntimeError('boom')
+        self.delivered.append(event.aggregate_id)
+
+    def emit(self, aggregate_id, topic='tool.changed'):
+        return OutboxEvent.objects.create(topic=topic, aggregate_type='tool', aggregate_id=aggregate_id)
+
+    def start(self):
+        """Create the consumer's cursor at the current end of the outbox"""
+        self.assertEqual(outbox.drain('test'), 0)
+
+    def test_new_consumer_starts_at_the_end(self):
+        self.emit(1)
+        self.start()
+        self.emit(2)
+        self.assertEqual(outbox.drain('test'), 1)
+        self.assertEqual(self.delivered, [2])
+
+    def test_events_are_delivered_in_order_and_other_topics_skipped(self):
+        self.start()
+        self.emit(1)
+        other = self.emit(2, topic='deposit.paid')
+        last = self.emit(3)
+        self.assertEqual(outbox.drain('test'), 3)
+        self.assertEqual(self.delivered, [1, 3])
+        self.assertEqual(OutboxCursor.objects.get(consumer='test').last_event_id, last.id)
+        self.assertGreater(last.id, other.id)
+        self.assertEqual(outbox.drain('test'), 0)
+
+    def test_batch_size_limits_one_drain(self):
+        self.start()
+        for aggregate_id in range(5):
+            self.emit(aggregate_id)
+        self.assertEqual(outbox.drain('test', batch_size=2), 2)
+        self.assertEqual(outbox.drain('test', batch_size=2), 2)
+        self.assertEqual(self.delivered, [0, 1, 2, 3])
+
+    def test_failure_stops_the_batch_and_is_skipped_after_max_attempts(self):
+        self.start()
+        self.emit(1)
+        failed = self.emit(2)
+        self.emit(3)
+        self.failing.add(2)
+        self.assertEqual(outbox.drain('test'), 1)
+        cursor = OutboxCursor.objects.get(consumer='test')
+        self.assertEqual(cursor.attempts, 1)
+        self.assertLess(cursor.last_event_id, failed.id)
+        self.assertIn(f'event {failed.id}', cursor.last_error)
+        # Second failure reaches OUTBOX_MAX_ATTEMPTS: the event is skipped and the rest delivered
+        self.assertEqual(outbox.drain('test'), 2)
+        self.assertEqual(self.delivered, [1, 3])
+        self.assertEqual(OutboxCursor.objects.get(consumer='test').attempts, 0)
+
+    def test_event_committed_after_a_later_one_is_still_delivered(self):
+        self.start()
+        slow = self.emit(1)
+        fast = self.emit(2)
+        # The slow transaction has not committed when the drain runs
+        slow_fields = {'id': slow.id, 'topic': slow.topic, 'aggregate_type': slow.aggregate_type, 'aggregate_id': 1}
+        slow.delete()
+        self.assertEqual(outbox.drain('test'), 1)
+        cursor = OutboxCursor.objects.get(consumer='test')
+        self.assertEqual(cursor.last_event_id, fast.id)
+        self.assertEqual(list(cursor.gaps), [str(slow_fields['id'])])
+
+        OutboxEvent.objects.create(**slow_fields)
+        self.emit(3)
+        with self.assertLogs('api.outbox', 'WARNING') as logs:
+            self.assertEqual(outbox.drain('test'), 2)
+        self.assertIn('committed after OUTBOX_SETTLE_SECONDS', logs.output[0])
+        self.assertEqual(self.delivered, [2, 1, 3])
+        self.assertEqual(OutboxCursor.objects.get(consumer='test').gaps, {})
+
+    def test_gaps_expire(self):
+        self.start()
+        rolled_back = self.emit(1)
+        self.emit(2)
+        rolled_back.delete()
+        with override_settings(OUTBOX_GAP_SECONDS=-1):
+            self.assertEqual(outbox.drain('test'), 1)
+        self.assertEqual(outbox.drain('test'), 0)
+        self.assertEqual(OutboxCursor.objects.get(consumer='test').gaps, {})
+
+    def test_unsettled_events_wait(self):
+        self.start()
+        self.emit(1)
+        with override_settings(OUTBOX_SETTLE_SECONDS=60):
+            self.assertEqual(outbox.drain('test'), 0)
+        self.assertEqual(outbox.drain('test'), 1)
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir, ignore_errors=True)
+        overrides = override_settings(
+            MEDIA_ROOT=os.path.join(temp_dir, 'media'),
+            UPLOAD_TEMP_DIR=os.path.join(temp_dir, 'uploads'),
+            UPLOAD_CHUNK_SIZE=4,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.content = b'0123456789'
+
+    def start(self, content=None, sha256=None):
+        content = self.content if content is None else content
+        sha256 = sha256 or hashlib.sha256(content).hexdigest()
+        return uploads.start('dispute_evidence', 'evidence.txt', len(content), sha256)
+
+    def send(self, upload, offset, data):
+        return uploads.write_chunk(upload.pk, offset, io.BytesIO(data), len(data))
+
+    def test_start_rejects_bad_declarations(self):
+        sha256 = hashlib.sha256(self.content).hexdigest()
+        for purpose, filename, size, digest in (
+            ('profile_picture', 'a.txt', 10, sha256),
+            ('dispute_evidence', 'a.txt', 0, sha256),
+            ('dispute_evidence', 'a.txt', settings.UPLOAD_MAX_SIZE + 1, sha256),
+            ('dispute_evidence', 'a.txt', 10, 'not a digest'),
+            ('dispute_evidence', '', 10, sha256),
+            ('dispute_evidence', '..', 10, sha256),
+        ):
+            with self.subTest(purpose=purpose, filename=filename, size=size, digest=digest), self.assertRaises(ValueError):
+                uploads.start(purpose, filename, size, digest)
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+    def test_chunks_in_order_complete_the_upload(self):
+        upload = self.start()
+        for offset in range(0, len(self.content), 4):
+            upload = self.send(upload, offset, self.content[offset:offset + 4])
+        self.assertEqual(upload.status, 'complete')
+        self.assertEqual(upload.offset, len(self.content))
+        with upload.file.open('rb') as stored:
+            self.assertEqual(stored.read(), self.content)
+        self.assertFalse(os.path.exists(uploads.part_path(upload)))
+
+    def test_wrong_offset_conflicts_with_the_server_offset(self):
+        upload = self.start()
+        self.send(upload, 0, b'0123')
+        for offset in (0, 8):
+            with self.subTest(offset=offset), self.assertRaises(uploads.OffsetConflict) as raised:
+                self.send(upload, offset, b'4567')
+            self.assertEqual(raised.exception.expected, 4)
+        self.assertEqual(ChunkedUpload.objects.get(pk=upload.pk).offset, 4)
+
+    def test_short_chunk_leaves_the_offset(self):
+        upload = self.start()
+        with self.assertRaises(ValueError):
+            uploads.write_chunk(upload.pk, 0, io.BytesIO(b'01'), 4)
+        self.assertEqual(ChunkedUpload.objects.get(pk=upload.pk).offset, 0)
+        # The client resumes from the unchanged offset
+        self.assertEqual(self.send(upload, 0, b'0123').offset, 4)
+
+    def test_chunk_size_and_declared_size_are_enforced(self):
+        upload = self.start()
+        with self.assertRaises(ValueError):
+            self.send(upload, 0, b'01234')
+        self.send(upload, 0, b'0123')
+        self.send(upload, 4, b'4567')
+        with self.assertRaises(ValueError):
+            self.send(upload, 8, b'890')
+        self.assertEqual(ChunkedUpload.objects.get(pk=upload.pk).offset, 8)
+
+    def test_checksum_mismatch_starts_over(self):
+        upload = self.start(sha256=hashlib.sha256(b'something else').hexdigest())
+        self.send(upload, 0, b'0123')
+        self.send(upload, 4, b'4567')
+        with self.assertRaises(uploads.ChecksumMismatch):
+            self.send(upload, 8, b'89')
+        upload.refresh_from_db()
+        self.assertEqual((upload.status, upload.offset), ('uploading', 0))
+        self.assertFalse(upload.file)
+        self.assertFalse(os.path.exists(uploads.part_path(upload)))
+
+    def test_completed_upload_takes_no_more_chunks(self):
+        upload = self.start(b'0123')
+        self.send(upload, 0, b'0123')
+        with self.assertRaises(ValueError):
+            self.send(upload, 4, b'4')
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir, ignore_errors=True)
+        self.storage = storage.ContentAddressedStorage(location=temp_dir)
+
+    def test_identical_content_is_stored_once(self):
+        first = self.storage.save('tool_images/a.JPG', ContentFile(b'photo'))
+        second = self.storage.save('profile_pictures/b.jpg', ContentFile(b'photo'))
+        self.assertEqual(first, second)
+        self.assertTrue(storage.is_blob(first) and first.endswith('.jpg'))
+        self.assertEqual(MediaBlob.objects.get(name=first).refcount, 2)
+
+    def test_losing_the_first_save_race_takes_a_reference(self):
+        name = self.storage.save('a.jpg', ContentFile(b'photo'))
+        # The lock lookup ran before the other save's row existed
+        with mock.patch('django.db.models.query.QuerySet.first', return_value=None):
+            self.assertEqual(self.storage.save('b.jpg', ContentFile(b'photo')), name)
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 2)
+        self.assertTrue(self.storage.exists(name))
+
+
+
+def png(width, height, color=(200, 40, 40), mode='RGB'):
+    buffer = io.BytesIO()
+    Image.new(mode, (width, height), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class SynchronousExecutor:
+    """Runs submitted work in the caller's thread, so the test transaction sees the results"""
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class ImagingTests(SimpleTestCase):
+    def open(self, data):
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        return image
+
+    def test_crop_fills_the_box_and_fit_keeps_the_aspect_ratio(self):
+        rendered = imaging.render(png(1000, 500), {'card': (300, 200, True), 'detail': (800, 600, False), 'huge': (2000, 1500, True)})
+        expected = {'card': (300, 200), 'detail': (800, 400), 'huge': (1000, 500)}  # Never scaled up
+        for name, size in expected.items():
+            self.assertEqual(set(rendered[name]), {'webp', 'jpeg'})
+            for format_name, pil_format in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+                with self.subTest(name=name, format=format_name):
+                    image = self.open(rendered[name][format_name])
+                    self.assertEqual((image.format, image.size), (pil_format, size))
+
+    def test_transparency_is_flattened_onto_white(self):
+        rendered = imaging.render(png(100, 100, (0, 0, 0, 0), mode='RGBA'), {'avatar': (64, 64, True)})
+        image = self.open(rendered['avatar']['jpeg'])
+        self.assertEqual(image.mode, 'RGB')
+        self.assertTrue(all(channel > 245 for channel in image.getpixel((32, 32))))
+
+
+@override_settings(THUMBNAIL_WORKERS=0)
+class ThumbnailTests(ApiTestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        owner = UserProfile.objects.create_user(username='owner', password='x')
+        self.tool = Tool.objects.create(name='Drill', owner=owner, price_per_day=Decimal('10.00'))
+
+    def set_image(self, data, name='drill.png'):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tool.image.save(name, ContentFile(data))
+        self.tool.refresh_from_db()
+
+    def test_saving_an_image_renders_its_variants(self):
+        self.set_image(png(900, 600))
+        variants = self.tool.image_variants
+        self.assertEqual(variants['source'], self.tool.image.name)
+        self.assertEqual(set(variants) - {'source'}, {'card', 'detail'})
+        for name in thumbnails.variant_names(variants):
+            self.assertTrue(default_storage.exists(name), name)
+        self.assertEqual(set(thumbnails.urls(self.tool, 'card')), {'webp', 'jpeg'})
+        with default_storage.open(variants['card']['jpeg']) as f:
+            self.assertEqual(Image.open(f).size, (300, 200))
+
+        # Saving other fields leaves the variants alone
+        with mock.patch.object(thumbnails, 'generate') as generate, self.captureOnCommitCallbacks(execute=True):
+            self.tool.name = 'Cordless drill'
+            self.tool.save()
+        generate.assert_not_called()
+
+    def test_replacing_the_image_removes_the_old_variants(self):
+        self.set_image(png(900, 600))
+        old = thumbnails.variant_names(self.tool.image_variants)
+        self.set_image(png(900, 600, (10, 120, 10)), name='drill2.png')
+        new = thumbnails.variant_names(self.tool.image_variants)
+        self.assertTrue(new and not new & old)
+        self.assertFalse(any(default_storage.exists(name) for name in old))
+
+    def test_render_for_a_replaced_image_is_discarded(self):
+        self.set_image(png(900, 600))
+        current = self.tool.image_variants
+        rendered = imaging.render(png(900, 600, (0, 0, 255)), thumbnails.IMAGE_FIELDS[Tool][2])
+        with self.captureOnCommitCallbacks(execute=True):
+            stale = thumbnails._store(Tool, self.tool.id, 'tool_images/replaced.png', rendered)
+        self.tool.refresh_from_db()
+        self.assertEqual(self.tool.image_variants, current)
+        self.assertFalse(any(default_storage.exists(name) for name in thumbnails.variant_names(stale)))
+        self.assertTrue(all(default_storage.exists(name) for name in thumbnails.variant_names(current)))
+
+    def test_clearing_the_image_drops_its_variants(self):
+        self.set_image(png(900, 600))
+        names = thumbnails.variant_names(self.tool.image_variants)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tool.image = None
+            self.tool.save()
+        self.tool.refresh_from_db()
+        self.assertEqual(self.tool.image_variants, {'source': ''})
+        self.assertIsNone(thumbnails.urls(self.tool, 'card'))
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+
+    def test_submit_stores_the_pool_result(self):
+        self.assertIsNone(thumbnails.submit(self.tool))
+        with mock.patch.object(thumbnails, 'generate'), self.captureOnCommitCallbacks(execute=True):
+            self.tool.image.save('drill.png', ContentFile(png(900, 600)))
+        with self.captureOnCommitCallbacks(execute=True):
+            variants = thumbnails.submit(self.tool, SynchronousExecutor()).result()
+        self.tool.refresh_from_db()
+        self.assertEqual(self.tool.image_variants, variants)
+        self.assertTrue(thumbnails.is_current(self.tool))
+
+    def test_a_broken_image_does_not_fail_the_save(self):
+        with self.assertLogs('api.thumbnails', 'WARNING'):
+            self.set_image(b'not an image', name='broken.png')
+        self.assertEqual(self.tool.image_variants, {})
+        with self.assertLogs('api.thumbnails', 'WARNING'):
+            future = thumbnails.submit(self.tool, SynchronousExecutor())
+        self.assertRaises(Exception, future.result)
+
+
+class ToolCardTests(ApiTestCase):
+    def setUp(self):
+        cache.clear()
+        owner = UserProfile.objects.create_user(username='owner', password='x', first_name='Sam', last_name='Lee')
+        self.tool = Tool.objects.create(
+            name='Drill', owner=owner, price_per_day=Decimal('10.00'),
+            pickup_address='12 Main St', pickup_city='Austin', pickup_state='TX',
+        )
+
+    def card(self):
+        return tool_cards.get_cards([self.tool.id])[self.tool.id]
+
+    def test_card_fields(self):
+        card = self.card()
+        self.assertEqual(card['pickup_location'], '12 Main St, Austin, TX')
+        self.assertEqual(card['price_per_day'], '10.00')
+        self.assertEqual(card['owner']['full_name'], 'Sam Lee')
+        self.assertEqual((card['average_rating'], card['total_reviews']), (0.0, 0))
+
+    def test_saves_replace_the_cached_card(self):
+        self.card()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tool.pickup_address = ''
+            self.tool.save()
+        with self.assertNumQueries(2):
+            self.assertEqual(self.card()['pickup_location'], 'Austin, TX')
+        with self.assertNumQueries(0):
+            self.card()
+
+
+class MigrationTests(TransactionTestCase):
+    """The checked-in migrations apply to an empty database, with their data steps (the suite itself skips them)"""
+
+    alias = 'migrations'
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        database = dict(connections['default'].settings_dict, NAME=os.path.join(cls.directory, 'migrations.sqlite3'))
+        cls.databases_patch = mock.patch.dict(settings.DATABASES, {cls.alias: database})
+        cls.databases_patch.start()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[cls.alias].close()
+        del connections[cls.alias]
+        cls.databases_patch.stop()
+        shutil.rmtree(cls.directory)
+
+    def migrate(self, target=None):
+        """Migrate api to ``target`` (the latest migration by default); returns the models at that state"""
+        with override_settings(MIGRATION_MODULES={}):
+            executor = MigrationExecutor(connections[self.alias])
+            target = target or executor.loader.graph.leaf_nodes('api')[0][1]
+            executor.migrate([('api', target)])
+            return executor.loader.project_state(('api', target)).apps
+
+    def test_migrations_apply_and_backfill(self):
+        apps = self.migrate('0001_initial')
+        User = apps.get_model('api', 'UserProfile')
+        owner = User.objects.using(self.alias).create(username='owner')
+        borrower = User.objects.using(self.alias).create(username='borrower')
+        tool = apps.get_model('api', 'Tool').objects.using(self.alias).create(name='Drill', description='', owner=owner)
+        rental = apps.get_model('api', 'RentalTransaction').objects.using(self.alias).create(
+            tool=tool, owner=owner, borrower=borrower, start_date=date(2030, 1, 1), end_date=date(2030, 1, 2)
+        )
+        Message = apps.get_model('api', 'Message')
+        Message.objects.using(self.alias).create(rental_transaction=rental, sender=borrower, message='Still free?')
+        Message.objects.using(self.alias).create(rental_transaction=rental, sender=owner, message='Yes')
+        Message.objects.using(self.alias).create(rental_transaction=rental, sender=owner, message='Read', is_read=True)
+
+        apps = self.migrate()
+        recipients = dict(apps.get_model('api', 'Message').objects.using(self.alias).values_list('message', 'recipient_id'))
+        self.assertEqual(recipients, {'Still free?': owner.id, 'Yes': borrower.id, 'Read': borrower.id})
+        counters = dict(apps.get_model('api', 'UnreadMessageCounter').objects.using(self.alias).values_list('user_id', 'unread'))
+        self.assertEqual(counters, {owner.id: 1, borrower.id: 1})
+
+        connection = connections[self.alias]
+        with connection.cursor() as cursor:
+            tables = connection.introspection.table_names(cursor)
+            self.assertIn(search.FTS_TABLE, tables)
+            cursor.execute(f"SELECT rowid FROM {search.FTS_TABLE} WHERE {search.FTS_TABLE} MATCH 'drill'")
+            self.assertEqual(cursor.fetchall(), [(tool.id,)])
+            indexes = connection.introspection.get_constraints(cursor, 'api_tool')
+        self.assertIn('idx_tools_location_available', indexes)
+        self.assertIn('api_outboxcursor', tables)
+        self.assertIn('api_mediablob', tables)
+
+        # And back down past the index migrations
+        self.migrate('0003_rental_rollups')
+        with connection.cursor() as cursor:
+            self.assertNotIn('idx_tools_location_available', connection.introspection.get_constraints(cursor, 'api_tool'))
@@ -0,0 +1,183 @@
+"""
+Derivative images (thumbnails) for tool images and profile pictures.
+
+Every image field in IMAGE_FIELDS has a set of sizes. Each size is stored
+as WebP and JPEG next to a ``thumbs/`` copy of the source path. The
+storage names go in a JSON field on the same row (``image_variants``,
+``profile_picture_variants``), together with the source they were made
+from. Serializers can then give each size's URLs without any query or
+storage call, and they ignore variants left over from an earlier image.
+
+When an image changes, a post_save signal calls ``schedule`` once the
+transaction commits. Decoding and resizing run in a process pool of
+THUMBNAIL_WORKERS processes (imaging.render), so big uploads do not hold
+the GIL or the request. With THUMBNAIL_WORKERS=0 they render inline. The
+pool's result callback saves the files and records them with an UPDATE
+guarded on the source name. A render for an image that was replaced in
+the meantime is thrown away. The generate_thumbnails command backfills
+existing rows through the same pool.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+
+from . import imaging
+from .models import Tool, UserProfile
+
+logger = logging.getLogger(__name__)
+
+# Model -> (image field, variants field, {size name: (width, height, crop)})
+IMAGE_FIELDS = {
+    Tool: ('image', 'image_variants', {
+        'card': (300, 200, True),     # List and search cards
+        'detail': (800, 600, False),  # Tool page
+    }),
+    UserProfile: ('profile_picture', 'profile_picture_variants', {
+        'avatar': (64, 64, True),     # Next to names in lists and chat
+        'profile': (256, 256, True),  # Profile page
+    }),
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+    """The shared process pool, or None when THUMBNAIL_WORKERS is 0"""
+    global _pool
+    if not settings.THUMBNAIL_WORKERS:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: forking a threaded web worker can copy held locks into the child
+                _pool = ProcessPoolExecutor(settings.THUMBNAIL_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def derivative_name(source_name, size, format_name):
+    stem = os.path.splitext(source_name)[0]
+    return f'thumbs/{stem}/{size}.{imaging.FORMATS[format_name][2]}'
+
+
+def is_current(instance):
+    """Whether the instance's variants were made from its current image (or there is no image)"""
+    image_field, variants_field, _ = IMAGE_FIELDS[type(instance)]
+    name = getattr(instance, image_field).name
+    return not name or (getattr(instance, variants_field) or {}).get('source') == name
+
+
+def urls(instance, size, request=None):
+    """{format: url} of one derivative size, or None when there is none for the current image"""
+    image_field, variants_field, _ = IMAGE_FIELDS[type(instance)]
+    name = getattr(instance, image_field).name
+    variants = getattr(instance, variants_field) or {}
+    if not name or variants.get('source') != name or size not in variants:
+        return None
+    result = {}
+    for format_name, stored in variants[size].items():
+        url = default_storage.url(stored)
+        result[format_name] = request.build_absolute_uri(url) if request is not None else url
+    return result
+
+
+def _store(model, pk, source_name, rendered):
+    """Save rendered files and record them on the row if it still has the same image"""
+    image_field, variants_field, _ = IMAGE_FIELDS[model]
+    variants = {'source': source_name}
+    for size, encoded in rendered.items():
+        variants[size] = {}
+        for format_name, data in encoded.items():
+            name = derivative_name(source_name, size, format_name)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            variants[size][format_name] = default_storage.save(name, ContentFile(data))
+
+    previous = model.objects.filter(pk=pk).values_list(variants_field, flat=True).first() or {}
+    # update() skips signals, so recording the variants does not schedule another render
+    if model.objects.filter(pk=pk, **{image_field: source_name}).update(**{variants_field: variants}):
+        stale = variant_names(previous) - variant_names(variants)
+        from . import tool_cards
+        tool_cards.image_changed(model, pk)
+    else:
+        stale = variant_names(variants)  # The image changed while rendering
+    for name in stale:
+        default_storage.delete(name)
+    return variants
+
+
+def variant_names(variants):
+    """Storage names of every derivative in a variants dict"""
+    return {name for size, encoded in variants.items() if size != 'source' for name in encoded.values()}
+
+
+def _read(instance):
+    image_field, _, sizes = IMAGE_FIELDS[type(instance)]
+    source_name = getattr(instance, image_field).name
+    with default_storage.open(source_name, 'rb') as f:
+        return source_name, f.read(), sizes
+
+
+def generate(instance):
+    """Render and store an instance's derivatives in this process; returns the variants"""
+    source_name, data, sizes = _read(instance)
+    return _store(type(instance), instance.pk, source_name, imaging.render(data, sizes))
+
+
+def submit(instance, workers=None):
+    """
+    Render an instance's derivatives in ``workers`` (default: the shared
+    pool); returns a future of the stored variants, or None without a pool
+    """
+    workers = workers or pool()
+    if workers is None:
+        return None
+    model, pk = type(instance), instance.pk
+    source_name, data, sizes = _read(instance)
+    future = workers.submit(imaging.render, data, sizes)
+    stored = Future()
+    caller = threading.get_ident()
+
+    def finish(rendered):
+        try:
+            stored.set_result(_store(model, pk, source_name, rendered.result()))
+        except Exception as e:
+            logger.warning('Thumbnails for %s %s (%s) failed: %s', model.__name__, pk, source_name, e)
+            stored.set_exception(e)
+        finally:
+            if threading.get_ident() != caller:
+                # The pool's management thread opened its own connections for _store
+                connections.close_all()
+
+    future.add_done_callback(finish)
+    return stored
+
+
+def schedule(instance):
+    """Render an instance's derivatives after the current transaction commits, if its image changed"""
+    image_field, variants_field, _ = IMAGE_FIELDS[type(instance)]
+    if not getattr(instance, image_field).name:
+        if variant_names(getattr(instance, variants_field) or {}):
+            # Image removed: drop its derivatives too
+            model, pk = type(instance), instance.pk
+            transaction.on_commit(lambda: _store(model, pk, '', {}))
+        return
+    if is_current(instance):
+        return
+
+    def start():
+        try:
+            if submit(instance) is None:
+                generate(instance)
+        except Exception as e:
+            # A broken image must not fail the save that uploaded it
+            logger.warning('Could not generate thumbnails for %s %s: %s', type(instance).__name__, instance.pk, e)
+
+    transaction.on_commit(start)
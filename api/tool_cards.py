@@ -0,0 +1,133 @@
+"""
+Cached compact "tool cards" for list and search responses.
+
+A card is the small part of a tool that lists show: name, prices, card
+thumbnail, pickup location, a summary of the owner, and the tool's review
+rating. ``get_cards`` reads a page of cards with one cache multi-get. The
+misses are built together from one tool query (with the owner joined) and
+one rating aggregate, then written back with one multi-set. List endpoints
+then never run ToolSerializer and its nested UserSerializer per row.
+
+Cards store site-relative media URLs and are made absolute for each
+request. Signals drop a tool's card once a write to the tool, its owner or
+its reviews commits. Thumbnail rendering drops it too, since it records
+variants with a plain UPDATE. With CACHE_REDIS_URL set every process sees
+the drop; TOOL_CARD_CACHE_TTL only bounds staleness across processes that
+do not share a cache.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db.models import Avg, Count
+
+from . import db_router, thumbnails
+from .models import Feedback, Tool
+
+# Bump when the card shape changes so old cached cards are ignored
+CARD_VERSION = 2
+PRICE_FIELDS = ['price_per_hour', 'price_per_day', 'price_per_week', 'price_per_month']
+# UserProfile fields a card shows; saves that touch none of them (e.g. last_login) keep the cards
+OWNER_FIELDS = {'username', 'first_name', 'last_name', 'city', 'rating', 'profile_picture', 'profile_picture_variants'}
+
+
+def _key(tool_id):
+    return f'tool-card:{CARD_VERSION}:{tool_id}'
+
+
+def _decimal(value):
+    # Same string DRF's DecimalField gives, so cards and full tools agree
+    return str(value) if value is not None else None
+
+
+def _pickup_location(tool):
+    # "12 Main St, Austin, TX", skipping the parts an owner left blank
+    return ', '.join(part for part in (tool.pickup_address, tool.pickup_city, tool.pickup_state) if part)
+
+
+def build_card(tool, rating):
+    """Card for a tool loaded with its owner; ``rating`` is (average, review count)"""
+    owner = tool.owner
+    average, total = rating
+    card = {
+        'id': tool.id,
+        'name': tool.name,
+        'pricing_type': tool.pricing_type,
+        'available': tool.available,
+        'delivery_available': tool.delivery_available,
+        'delivery_fee': _decimal(tool.delivery_fee),
+        'image': default_storage.url(tool.image.name) if tool.image else None,
+        'image_card': thumbnails.urls(tool, 'card'),
+        'city': tool.pickup_city,
+        'pickup_location': _pickup_location(tool),
+        'owner': {
+            'id': owner.id,
+            'username': owner.username,
+            'full_name': owner.get_full_name(),
+            'city': owner.city,
+            'rating': _decimal(owner.rating),
+            'profile_picture_avatar': thumbnails.urls(owner, 'avatar'),
+        },
+        'average_rating': round(average, 2) if average else 0.0,
+        'total_reviews': total,
+    }
+    for field in PRICE_FIELDS:
+        card[field] = _decimal(getattr(tool, field))
+    return card
+
+
+def _build(tool_ids):
+    """{tool id: card} for tools that still exist"""
+    tools = Tool.objects.filter(id__in=tool_ids).select_related('owner')
+    ratings = {
+        row['rental_transaction__tool_id']: (row['average'], row['total'])
+        for row in Feedback.objects.filter(rental_transaction__tool_id__in=tool_ids)
+        .values('rental_transaction__tool_id')
+        .annotate(average=Avg('rating'), total=Count('id'))
+    }
+    return {tool.id: build_card(tool, ratings.get(tool.id, (None, 0))) for tool in tools}
+
+
+def _absolute(card, request):
+    if request is None:
+        return card
+
+    def absolute(urls):
+        return {name: request.build_absolute_uri(url) for name, url in urls.items()} if urls else urls
+
+    card = dict(card)
+    if card['image']:
+        card['image'] = request.build_absolute_uri(card['image'])
+    card['image_card'] = absolute(card['image_card'])
+    card['owner'] = dict(card['owner'], profile_picture_avatar=absolute(card['owner']['profile_picture_avatar']))
+    return card
+
+
+def get_cards(tool_ids, request=None):
+    """{tool id: card} for ``tool_ids``, building and caching the misses; deleted tools are left out"""
+    tool_ids = list(dict.fromkeys(tool_ids))
+    if not tool_ids:
+        return {}
+    keys = {_key(tool_id): tool_id for tool_id in tool_ids}
+    cards = {} if db_router.fresh_reads() else {keys[key]: card for key, card in cache.get_many(keys).items()}
+    missing = [tool_id for tool_id in tool_ids if tool_id not in cards]
+    if missing:
+        built = _build(missing)
+        cache.set_many({_key(tool_id): card for tool_id, card in built.items()}, settings.TOOL_CARD_CACHE_TTL)
+        cards.update(built)
+    return {tool_id: _absolute(cards[tool_id], request) for tool_id in tool_ids if tool_id in cards}
+
+
+def invalidate(tool_ids):
+    cache.delete_many([_key(tool_id) for tool_id in tool_ids])
+
+
+def invalidate_owner(owner_id):
+    invalidate(list(Tool.objects.filter(owner_id=owner_id).values_list('id', flat=True)))
+
+
+def image_changed(model, pk):
+    """Called after thumbnails records new variants for a tool or a profile picture"""
+    if model is Tool:
+        invalidate([pk])
+    else:
+        invalidate_owner(pk)
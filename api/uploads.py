@@ -0,0 +1,227 @@
+"""
+Chunked, resumable uploads for verification documents and dispute evidence.
+
+A client declares the file first (name, size, SHA-256, purpose), then PUTs
+it in pieces of at most UPLOAD_CHUNK_SIZE bytes. Each PUT carries an
+Upload-Offset header. A request body is copied to a temporary chunk file in
+small blocks and never held in memory whole. Only then is the upload row
+locked, the offset checked and the chunk appended to ``<id>.part`` under
+UPLOAD_TEMP_DIR. An interrupted client asks for the current offset and
+carries on from there. A PUT at the wrong offset gets 409 and the offset
+the server has.
+
+When the last byte arrives, the SHA-256 is computed from disk and compared
+with the declared one. The file then moves into default storage on
+``ChunkedUpload.file``. A mismatch discards the received bytes, and the
+client starts again from offset 0. Completed uploads are attached with
+``attach_to_dispute`` (appended to evidence_files) or
+``take_for_verification`` (used as document_front/back). ``clean_uploads``
+deletes uploads abandoned for UPLOAD_EXPIRY_HOURS.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from .models import ChunkedUpload, Dispute
+
+COPY_BLOCK_SIZE = 64 * 1024
+
+
+class OffsetConflict(Exception):
+    """A chunk was sent for an offset other than the one the server is at"""
+
+    def __init__(self, expected):
+        super().__init__(f'Expected a chunk at offset {expected}')
+        self.expected = expected
+
+
+class ChecksumMismatch(ValueError):
+    pass
+
+
+def _temp_dir():
+    os.makedirs(settings.UPLOAD_TEMP_DIR, exist_ok=True)
+    return settings.UPLOAD_TEMP_DIR
+
+
+def part_path(upload):
+    return os.path.join(_temp_dir(), f'{upload.pk}.part')
+
+
+def start(purpose, filename, size, sha256, user=None):
+    """Declare an upload; raises ValueError for anything the server will not accept"""
+    if purpose not in dict(ChunkedUpload.PURPOSE_CHOICES):
+        raise ValueError(f'Unknown purpose: {purpose}')
+    size = int(size)
+    if not 0 < size <= settings.UPLOAD_MAX_SIZE:
+        raise ValueError(f'size must be between 1 and {settings.UPLOAD_MAX_SIZE} bytes')
+    sha256 = (sha256 or '').lower()
+    if len(sha256) != 64 or any(c not in '0123456789abcdef' for c in sha256):
+        raise ValueError('sha256 must be 64 hex characters')
+    try:
+        filename = get_valid_filename(os.path.basename(filename or ''))
+    except SuspiciousFileOperation:
+        # Nothing usable left of the name ('', '.', '..')
+        raise ValueError('filename required')
+    return ChunkedUpload.objects.create(
+        user=user if user is not None and user.is_authenticated else None,
+        purpose=purpose, filename=filename, size=size, sha256=sha256,
+    )
+
+
+def _spool(stream, length):
+    """Copy exactly ``length`` bytes of ``stream`` into a temporary file, a block at a time"""
+    spooled = tempfile.NamedTemporaryFile(dir=_temp_dir(), suffix='.chunk', delete=False)
+    try:
+        remaining = length
+        while remaining:
+            block = stream.read(min(COPY_BLOCK_SIZE, remaining))
+            if not block:
+                raise ValueError(f'Chunk ended after {length - remaining} of {length} bytes')
+            spooled.write(block)
+            remaining -= len(block)
+        spooled.close()
+        return spooled.name
+    except BaseException:
+        spooled.close()
+        os.unlink(spooled.name)
+        raise
+
+
+def write_chunk(upload_id, offset, stream, length):
+    """
+    Append ``length`` bytes read from ``stream`` at ``offset``; returns the
+    updated upload. The last chunk verifies and stores the file.
+    """
+    if length <= 0 or length > settings.UPLOAD_CHUNK_SIZE:
+        raise ValueError(f'Chunks must be between 1 and {settings.UPLOAD_CHUNK_SIZE} bytes')
+    upload = ChunkedUpload.objects.get(pk=upload_id)
+    if upload.status != 'uploading':
+        raise ValueError(f'Upload is already {upload.status}')
+    if offset != upload.offset:
+        raise OffsetConflict(upload.offset)
+    if offset + length > upload.size:
+        raise ValueError(f'Chunk runs past the declared size of {upload.size} bytes')
+
+    # Read the body before taking the row lock, so a slow client never holds it
+    chunk_path = _spool(stream, length)
+    rejected = None
+    try:
+        with transaction.atomic():
+            upload = ChunkedUpload.objects.select_for_update().get(pk=upload_id)
+            if upload.status != 'uploading' or upload.offset != offset:
+                # Another request for the same upload got here first
+                raise OffsetConflict(upload.offset)
+            with open(chunk_path, 'rb') as chunk, open(part_path(upload), 'ab') as part:
+                part.truncate(offset)  # Drop bytes left by an append whose row update rolled back
+                part.seek(offset)
+                shutil.copyfileobj(chunk, part, COPY_BLOCK_SIZE)
+            upload.offset = offset + length
+            if upload.offset == upload.size:
+                rejected = _finish(upload)
+            upload.save()
+    finally:
+        os.unlink(chunk_path)
+    if rejected:
+        raise rejected
+    return upload
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _finish(upload):
+    """
+    Verify and store a fully received upload. Returns the error to raise once
+    the row is saved, with the received bytes discarded so the client starts over.
+    """
+    path = part_path(upload)
+    if file_sha256(path) != upload.sha256:
+        error = ChecksumMismatch('SHA-256 of the received file does not match; upload again from offset 0')
+    elif upload.purpose == 'verification_document' and not _is_image(path):
+        error = ValueError('Verification documents must be images; upload again from offset 0')
+    else:
+        with open(path, 'rb') as f:
+            upload.file.save(upload.filename, File(f), save=False)
+        error = None
+        upload.status = 'complete'
+    os.unlink(path)
+    if error is not None:
+        upload.offset = 0
+    return error
+
+
+def _is_image(path):
+    from PIL import Image
+
+    try:
+        with Image.open(path) as image:
+            image.verify()
+        return True
+    except Exception:
+        return False
+
+
+def _completed(upload_id):
+    upload = ChunkedUpload.objects.select_for_update().get(pk=upload_id)
+    if upload.status != 'complete':
+        raise ValueError(f'Upload is {upload.status}, not complete')
+    return upload
+
+
+def attach_to_dispute(upload_id, dispute_id):
+    """Add a completed evidence upload to a dispute's evidence_files; returns the file URL"""
+    with transaction.atomic():
+        upload = _completed(upload_id)
+        if upload.purpose != 'dispute_evidence':
+            raise ValueError('Upload was not declared as dispute evidence')
+        # Locked so concurrent attaches do not overwrite each other's list
+        dispute = Dispute.objects.select_for_update().get(pk=dispute_id)
+        url = upload.file.url
+        dispute.evidence_files = list(dispute.evidence_files or []) + [url]
+        dispute.save(update_fields=['evidence_files', 'updated_at'])
+        upload.status = 'attached'
+        upload.save(update_fields=['status', 'updated_at'])
+    return url
+
+
+def take_for_verification(upload_id):
+    """
+    Storage name of a completed verification upload, marked attached; call
+    inside the transaction that saves the verification
+    """
+    upload = _completed(upload_id)
+    if upload.purpose != 'verification_document':
+        raise ValueError('Upload was not declared as a verification document')
+    upload.status = 'attached'
+    upload.save(update_fields=['status', 'updated_at'])
+    return upload.file.name
+
+
+def clean_expired(hours=None):
+    """Delete uploads left unattached for ``hours``, with their partial or stored files"""
+    cutoff = timezone.now() - timedelta(hours=hours if hours is not None else settings.UPLOAD_EXPIRY_HOURS)
+    removed = 0
+    for upload in ChunkedUpload.objects.filter(status__in=['uploading', 'complete'], updated_at__lt=cutoff).iterator():
+        path = part_path(upload)
+        if os.path.exists(path):
+            os.unlink(path)
+        if upload.file:
+            upload.file.delete(save=False)
+        upload.delete()
+        removed += 1
+    return removed
@@ -19,10 +19,21 @@ router.register(r'recurring-availability', views.RecurringAvailabilityViewSet)
 router.register(r'hourly-availability', views.HourlyAvailabilityViewSet)
 
 urlpatterns = [
+    # Declared before the router so 'tools/<pk>/' and 'messages/<pk>/' do not shadow them
+    path('tools/search/', views.search_tools, name='search_tools'),
+    path('tools/autocomplete/', views.autocomplete_tools, name='autocomplete_tools'),
+    path('tools/facets/', views.get_tool_facets, name='get_tool_facets'),
+    path('tools/quotes/', views.quote_tools, name='quote_tools'),
+    path('tools/search-near-me/', views.search_tools_near_me, name='search_tools_near_me'),
+    path('tools/near-location/', views.find_tools_near_location, name='find_tools_near_location'),
+    path('messages/unread-count/', views.get_unread_message_count, name='get_unread_message_count'),
+    path('tools/availability-stream/', views.tool_availability_stream, name='tool_availability_stream'),
+
     path('', include(router.urls)),
     
     # Basic endpoints
     path('test/', views.test_endpoint, name='test_endpoint'),
+    path('metrics/', views.metrics_endpoint, name='metrics'),
     path('default-user/', views.get_default_user, name='get_default_user'),
     path('current-user/', views.get_current_user, name='get_current_user'),
     path('user-tools/<int:user_id>/', views.get_user_tools, name='get_user_tools'),
@@ -45,17 +56,17 @@ urlpatterns = [
     path('tools/<int:tool_id>/check-hourly-availability/', views.check_hourly_availability, name='check_hourly_availability'),
     path('tools/<int:tool_id>/create-recurring-availability/', views.create_recurring_availability, name='create_recurring_availability'),
     
-    # Location-Based Features
-    path('tools/search-near-me/', views.search_tools_near_me, name='search_tools_near_me'),
-    path('tools/near-location/', views.find_tools_near_location, name='find_tools_near_location'),
-    
     # Trust & Safety
     path('users/<int:user_id>/verify/', views.verify_user_identity, name='verify_user_identity'),
     path('users/<int:user_id>/reviews/', views.get_user_reviews, name='get_user_reviews'),
+    path('users/<int:user_id>/tool-occupancy/', views.get_owner_tool_occupancy, name='get_owner_tool_occupancy'),
+    path('users/<int:user_id>/earnings-summary/', views.get_owner_earnings_summary, name='get_owner_earnings_summary'),
     path('tools/<int:tool_id>/reviews/', views.get_tool_reviews, name='get_tool_reviews'),
     path('disputes/', views.list_disputes, name='list_disputes'),
     path('disputes/create/', views.create_dispute, name='create_dispute'),
     path('disputes/<int:dispute_id>/resolve/', views.resolve_dispute, name='resolve_dispute'),
+    path('disputes/<int:dispute_id>/messages/', views.get_dispute_messages, name='get_dispute_messages'),
+    path('disputes/<int:dispute_id>/evidence/', views.attach_dispute_evidence, name='attach_dispute_evidence'),
     
     # Advanced Rental Features
     path('tools/<int:tool_id>/borrow-request/', views.create_borrow_request, name='create_borrow_request'),
@@ -64,6 +75,14 @@ urlpatterns = [
     path('borrow-requests/<int:request_id>/cancel/', views.cancel_borrow_request, name='cancel_borrow_request'),
     path('borrow-requests/my-requests/', views.get_user_borrow_requests, name='get_user_borrow_requests'),
     
+    # Chunked Uploads
+    path('uploads/', views.start_upload, name='start_upload'),
+    path('uploads/<uuid:upload_id>/', views.upload_chunk, name='upload_chunk'),
+    
+    # Rental Chat
+    path('rentals/<int:rental_id>/messages/', views.rental_messages, name='rental_messages'),
+    path('rentals/<int:rental_id>/messages/mark-read/', views.mark_rental_messages_read, name='mark_rental_messages_read'),
+    
     # Deposit Management
     path('deposits/<int:deposit_id>/process-payment/', views.process_deposit_payment, name='process_deposit_payment'),
     path('deposits/<int:deposit_id>/process-return/', views.process_deposit_return, name='process_deposit_return'),
@@ -71,5 +90,7 @@ urlpatterns = [
     
     # Calendar and Advanced Features
     path('tools/<int:tool_id>/calendar-availability/', views.get_tool_calendar_availability, name='get_tool_calendar_availability'),
+    path('tools/<int:tool_id>/calendar-status/', views.get_tool_calendar_status, name='get_tool_calendar_status'),
+    path('tools/<int:tool_id>/utilization/', views.get_tool_utilization, name='get_tool_utilization'),
     path('check-advanced-availability-conflict/', views.check_advanced_availability_conflict, name='check_advanced_availability_conflict'),
 ]
\ No newline at end of file
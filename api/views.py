@@ -1,18 +1,26 @@
+import logging
 from django.shortcuts import render
-from rest_framework import viewsets, generics, status
+from rest_framework import viewsets, generics, status, serializers
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.conf import settings
 from django.db.models import Q
-from .models import UserProfile, Tool, Feedback, BorrowRequest, RentalTransaction, Availability, Message, UserReview, ApplicationReview, Deposit, DepositTransaction, FlexibleAvailability, RecurringAvailability, HourlyAvailability, UserVerification, Dispute, DisputeMessage
-from django.db import models
-from .serializers import UserSerializer, ToolSerializer, FeedbackSerializer, BorrowRequestSerializer, RentalTransactionSerializer, AvailabilitySerializer, MessageSerializer, UserReviewSerializer, ApplicationReviewSerializer, DepositSerializer, DepositTransactionSerializer, FlexibleAvailabilitySerializer, RecurringAvailabilitySerializer, HourlyAvailabilitySerializer, UserVerificationSerializer, DisputeSerializer, DisputeMessageSerializer
+from .models import UserProfile, Tool, Feedback, BorrowRequest, RentalTransaction, Availability, Message, UserReview, ApplicationReview, Deposit, DepositTransaction, FlexibleAvailability, RecurringAvailability, HourlyAvailability, UserVerification, Dispute, DisputeMessage, ChunkedUpload
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import models, transaction
+from .serializers import UserSerializer, ToolSerializer, FeedbackSerializer, BorrowRequestSerializer, BorrowRequestListSerializer, RentalTransactionSerializer, AvailabilitySerializer, MessageSerializer, ThreadMessageSerializer, UserReviewSerializer, ApplicationReviewSerializer, DepositSerializer, DepositTransactionSerializer, FlexibleAvailabilitySerializer, RecurringAvailabilitySerializer, HourlyAvailabilitySerializer, UserVerificationSerializer, DisputeSerializer, DisputeMessageSerializer
 from django.utils import timezone
+from . import search, autocomplete, facets, pricing, availability_calendar, rollups, metrics, messaging, live_updates, outbox, disputes, pagination, uploads, tool_cards, near_cache
+from .db_router import replica_reads
+
+logger = logging.getLogger(__name__)
 
 @api_view(['GET'])
 def test_endpoint(request):
     """Simple test endpoint to verify server is working"""
-    print('=== TEST ENDPOINT CALLED ===')
+    logger.debug('Test endpoint called')
     return JsonResponse({'message': 'Django server is working!'})
 from .serializers import UserSerializer, ToolSerializer, FeedbackSerializer, BorrowRequestSerializer, RentalTransactionSerializer, AvailabilitySerializer, MessageSerializer, UserReviewSerializer, ApplicationReviewSerializer, DepositSerializer, DepositTransactionSerializer, FlexibleAvailabilitySerializer, RecurringAvailabilitySerializer, HourlyAvailabilitySerializer
 from django.utils import timezone
@@ -117,6 +125,7 @@ def me(request):
         print(f"Error in me: {e}")
         return Response({'error': 'Internal server error'}, status=500)
 
+@replica_reads
 @api_view(['GET'])
 def get_tool_availability(request, tool_id):
     """Get availability data for a specific tool"""
@@ -277,7 +286,7 @@ class ToolViewSet(viewsets.ModelViewSet):
             ]
             return Response(mock_tools)
         except Exception as e:
-            print(f"Error in ToolViewSet.list: {e}")
+            logger.exception('Error in ToolViewSet.list')
             return Response({'error': 'Internal server error'}, status=500)
 
     def retrieve(self, request, *args, **kwargs):
@@ -295,11 +304,11 @@ class ToolViewSet(viewsets.ModelViewSet):
             }
             return Response(mock_tool)
         except Exception as e:
-            print(f"Error in ToolViewSet.retrieve: {e}")
+            logger.exception('Error in ToolViewSet.retrieve')
             return Response({'error': 'Internal server error'}, status=500)
 
     def create(self, request, *args, **kwargs):
-        print(f"ToolViewSet.create called with data: {request.data}")
+        logger.info('ToolViewSet.create called', extra={'fields': sorted(request.data.keys())})
         try:
             # Get the owner ID from the request data
             owner_id = request.data.get('owner')
@@ -340,13 +349,11 @@ class ToolViewSet(viewsets.ModelViewSet):
             
             return Response(tool_data, status=201)
         except Exception as e:
-            print(f"Error in ToolViewSet.create: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('Error in ToolViewSet.create')
             return Response({'error': str(e)}, status=500)
 
     def update(self, request, *args, **kwargs):
-        print(f"ToolViewSet.update called with data: {request.data}")
+        logger.info('ToolViewSet.update called', extra={'tool_id': kwargs.get('pk'), 'fields': sorted(request.data.keys())})
         try:
             # Get the current tool instance
             tool = self.get_object()
@@ -357,17 +364,15 @@ class ToolViewSet(viewsets.ModelViewSet):
             
             # Check if availability changed
             if old_available != tool.available:
-                print(f"Tool {tool.name} availability changed to {tool.available}")
+                logger.info('Tool availability changed', extra={'tool_id': tool.id, 'available': tool.available})
             
             return response
         except Exception as e:
-            print(f"Error in ToolViewSet.update: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('Error in ToolViewSet.update')
             raise
 
     def partial_update(self, request, *args, **kwargs):
-        print(f"ToolViewSet.partial_update called with data: {request.data}")
+        logger.info('ToolViewSet.partial_update called', extra={'tool_id': kwargs.get('pk'), 'fields': sorted(request.data.keys())})
         try:
             # Get the current tool instance
             tool = self.get_object()
@@ -381,7 +386,7 @@ class ToolViewSet(viewsets.ModelViewSet):
             
             # Check if availability changed
             if old_available != tool.available:
-                print(f"Tool {tool.name} availability changed to {tool.available}")
+                logger.info('Tool availability changed', extra={'tool_id': tool.id, 'available': tool.available})
                 
                 # Update availability records - mark the tool as available
                 availability_records = Availability.objects.filter(
@@ -392,13 +397,11 @@ class ToolViewSet(viewsets.ModelViewSet):
                 for availability in availability_records:
                     availability.is_booked = False
                     availability.save()
-                print(f"Updated {availability_records.count()} availability records for tool {tool.name}")
+                logger.info('Availability records released', extra={'tool_id': tool.id, 'count': len(availability_records)})
             
             return response
         except Exception as e:
-            print(f"Error in ToolViewSet.partial_update: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('Error in ToolViewSet.partial_update')
             raise
 
 class AvailabilityViewSet(viewsets.ModelViewSet):
@@ -437,6 +440,7 @@ class HourlyAvailabilityViewSet(viewsets.ModelViewSet):
     queryset = HourlyAvailability.objects.all()
     serializer_class = HourlyAvailabilitySerializer
 
+@replica_reads
 @api_view(['GET'])
 def get_tool_advanced_availability(request, tool_id):
     """Get comprehensive availability data for a tool including flexible, recurring, and hourly"""
@@ -611,7 +615,15 @@ def create_borrow_request(request, tool_id):
         )
         
         if serializer.is_valid():
-            borrow_request = serializer.save()
+            with transaction.atomic():
+                borrow_request = serializer.save()
+                outbox.emit(
+                    'borrow_request.created', borrow_request,
+                    tool_id=tool.id, tool_name=tool.name,
+                    owner_id=borrow_request.owner_id, borrower_id=borrow_request.borrower_id,
+                    borrower_name=borrow_request.borrower.username if borrow_request.borrower else 'Someone',
+                    start_date=borrow_request.start_date, end_date=borrow_request.end_date,
+                )
             return Response({
                 'message': 'Borrow request created successfully',
                 'request_id': borrow_request.id,
@@ -647,7 +659,14 @@ def approve_borrow_request(request, request_id):
         
         # Approve the request
         owner_response = request.data.get('owner_response', '')
-        rental = borrow_request.approve(owner_response)
+        with transaction.atomic():
+            rental = borrow_request.approve(owner_response)
+            outbox.emit(
+                'borrow_request.approved', borrow_request,
+                rental_id=rental.id, tool_id=rental.tool_id, tool_name=borrow_request.tool.name,
+                owner_id=rental.owner_id, borrower_id=rental.borrower_id,
+                start_date=rental.start_date, end_date=rental.end_date,
+            )
         
         return Response({
             'message': 'Borrow request approved successfully',
@@ -716,6 +735,7 @@ def cancel_borrow_request(request, request_id):
         return Response({'error': str(e)}, status=500)
 
 # Location-based Views
+@replica_reads
 @api_view(['GET'])
 def search_tools_near_me(request):
     """Search for tools near the user's location"""
@@ -728,23 +748,17 @@ def search_tools_near_me(request):
         if not user_lat or not user_lng:
             return Response({'error': 'User location required'}, status=400)
         
-        # Get all available tools
-        tools = Tool.objects.filter(available=True)
-        
-        # Filter by pricing type if specified
-        if pricing_type:
-            tools = tools.filter(pricing_type=pricing_type)
+        # Candidates for the caller's neighbourhood come from cache; distances are exact for their point
+        distances = {
+            tool_id: round(distance, 2)
+            for tool_id, distance in near_cache.nearby(user_lat, user_lng, radius, pricing_type).items()
+        }
         
-        # Calculate distances and filter by radius
-        nearby_tools = []
-        for tool in tools:
-            if tool.pickup_latitude and tool.pickup_longitude:
-                distance = tool.calculate_distance_to(user_lat, user_lng)
-                if distance is not None and distance <= radius:
-                    nearby_tools.append({
-                        'tool': ToolSerializer(tool, context={'request': request}).data,
-                        'distance': round(distance, 2)
-                    })
+        cards = tool_cards.get_cards(list(distances), request)
+        nearby_tools = [
+            {'tool': cards[tool_id], 'distance': distance}
+            for tool_id, distance in distances.items() if tool_id in cards
+        ]
         
         # Sort by distance
         nearby_tools.sort(key=lambda x: x['distance'])
@@ -755,6 +769,8 @@ def search_tools_near_me(request):
             'user_location': {'lat': user_lat, 'lng': user_lng}
         })
         
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
@@ -765,40 +781,56 @@ def get_user_borrow_requests(request):
         user = request.user
         
         # Get requests where user is borrower
-        as_borrower = BorrowRequest.objects.filter(borrower=user).order_by('-created_at')
+        as_borrower = list(BorrowRequest.objects.filter(borrower=user).select_related('borrower', 'owner').order_by('-created_at'))
         
         # Get requests where user is owner
-        as_owner = BorrowRequest.objects.filter(owner=user).order_by('-created_at')
+        as_owner = list(BorrowRequest.objects.filter(owner=user).select_related('borrower', 'owner').order_by('-created_at'))
         
+        # One cache read for every tool on the page
+        context = {
+            'request': request,
+            'tool_cards': tool_cards.get_cards([r.tool_id for r in as_borrower + as_owner], request),
+        }
         return Response({
-            'as_borrower': BorrowRequestSerializer(as_borrower, many=True, context={'request': request}).data,
-            'as_owner': BorrowRequestSerializer(as_owner, many=True, context={'request': request}).data
+            'as_borrower': BorrowRequestListSerializer(as_borrower, many=True, context=context).data,
+            'as_owner': BorrowRequestListSerializer(as_owner, many=True, context=context).data
         })
         
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
+def emit_deposit_event(topic, deposit, amount, **extra):
+    """Queue an outbox event for a deposit change; call inside the transaction making it"""
+    rental = deposit.rental_transaction
+    outbox.emit(
+        topic, deposit,
+        rental_id=rental.id, tool_id=rental.tool_id, tool_name=rental.tool.name,
+        owner_id=rental.owner_id, borrower_id=rental.borrower_id, amount=amount, **extra
+    )
+
 @api_view(['POST'])
 def process_deposit_payment(request, deposit_id):
     """Process a deposit payment"""
     try:
-        deposit = Deposit.objects.get(id=deposit_id)
-        
-        # Update deposit status to paid
-        deposit.status = 'paid'
-        deposit.payment_date = timezone.now()
-        deposit.payment_reference = request.data.get('payment_reference', f'PAY-{deposit_id}-{int(timezone.now().timestamp())}')
-        deposit.save()
-        
-        # Create transaction record
-        DepositTransaction.objects.create(
-            deposit=deposit,
-            transaction_type='payment',
-            amount=deposit.amount,
-            reference=deposit.payment_reference,
-            description='Deposit payment processed',
-            processed_by=request.data.get('processed_by')
-        )
+        deposit = Deposit.objects.select_related('rental_transaction__tool').get(id=deposit_id)
+        
+        with transaction.atomic():
+            # Update deposit status to paid
+            deposit.status = 'paid'
+            deposit.payment_date = timezone.now()
+            deposit.payment_reference = request.data.get('payment_reference', f'PAY-{deposit_id}-{int(timezone.now().timestamp())}')
+            deposit.save()
+            
+            # Create transaction record
+            DepositTransaction.objects.create(
+                deposit=deposit,
+                transaction_type='payment',
+                amount=deposit.amount,
+                reference=deposit.payment_reference,
+                description='Deposit payment processed',
+                processed_by=request.data.get('processed_by')
+            )
+            emit_deposit_event('deposit.paid', deposit, deposit.amount, reference=deposit.payment_reference)
         
         return Response({
             'message': 'Deposit payment processed successfully',
@@ -816,23 +848,25 @@ def process_deposit_payment(request, deposit_id):
 def process_deposit_return(request, deposit_id):
     """Process a deposit return/refund"""
     try:
-        deposit = Deposit.objects.get(id=deposit_id)
-        
-        # Update deposit status to returned
-        deposit.status = 'returned'
-        deposit.return_date = timezone.now()
-        deposit.return_reference = request.data.get('return_reference', f'REF-{deposit_id}-{int(timezone.now().timestamp())}')
-        deposit.save()
-        
-        # Create transaction record
-        DepositTransaction.objects.create(
-            deposit=deposit,
-            transaction_type='refund',
-            amount=deposit.amount,
-            reference=deposit.return_reference,
-            description='Deposit refund processed',
-            processed_by=request.data.get('processed_by')
-        )
+        deposit = Deposit.objects.select_related('rental_transaction__tool').get(id=deposit_id)
+        
+        with transaction.atomic():
+            # Update deposit status to returned
+            deposit.status = 'returned'
+            deposit.return_date = timezone.now()
+            deposit.return_reference = request.data.get('return_reference', f'REF-{deposit_id}-{int(timezone.now().timestamp())}')
+            deposit.save()
+            
+            # Create transaction record
+            DepositTransaction.objects.create(
+                deposit=deposit,
+                transaction_type='refund',
+                amount=deposit.amount,
+                reference=deposit.return_reference,
+                description='Deposit refund processed',
+                processed_by=request.data.get('processed_by')
+            )
+            emit_deposit_event('deposit.returned', deposit, deposit.amount, reference=deposit.return_reference)
         
         return Response({
             'message': 'Deposit return processed successfully',
@@ -850,24 +884,26 @@ def process_deposit_return(request, deposit_id):
 def process_deposit_forfeit(request, deposit_id):
     """Process a deposit forfeiture (when tool is damaged/lost)"""
     try:
-        deposit = Deposit.objects.get(id=deposit_id)
+        deposit = Deposit.objects.select_related('rental_transaction__tool').get(id=deposit_id)
         forfeit_amount = request.data.get('forfeit_amount', deposit.amount)
         reason = request.data.get('reason', 'Tool damaged or lost')
         
-        # Update deposit status to forfeited
-        deposit.status = 'forfeited'
-        deposit.notes = reason
-        deposit.save()
-        
-        # Create transaction record
-        DepositTransaction.objects.create(
-            deposit=deposit,
-            transaction_type='forfeit',
-            amount=forfeit_amount,
-            reference=f'FORFEIT-{deposit_id}-{int(timezone.now().timestamp())}',
-            description=f'Deposit forfeited: {reason}',
-            processed_by=request.data.get('processed_by')
-        )
+        with transaction.atomic():
+            # Update deposit status to forfeited
+            deposit.status = 'forfeited'
+            deposit.notes = reason
+            deposit.save()
+            
+            # Create transaction record
+            forfeit = DepositTransaction.objects.create(
+                deposit=deposit,
+                transaction_type='forfeit',
+                amount=forfeit_amount,
+                reference=f'FORFEIT-{deposit_id}-{int(timezone.now().timestamp())}',
+                description=f'Deposit forfeited: {reason}',
+                processed_by=request.data.get('processed_by')
+            )
+            emit_deposit_event('deposit.forfeited', deposit, forfeit_amount, reference=forfeit.reference, reason=reason)
         
         return Response({
             'message': 'Deposit forfeiture processed successfully',
@@ -882,53 +918,6 @@ def process_deposit_forfeit(request, deposit_id):
         return Response({'error': str(e)}, status=500)
 
 # Tool custom views
-class ToolListCreateView(generics.ListCreateAPIView):
-    queryset = Tool.objects.all()
-    serializer_class = ToolSerializer
-    
-    def create(self, request, *args, **kwargs):
-        print(f"Creating tool with request data: {request.data}")
-        
-        # Get the owner from the request data or use the first user as fallback
-        owner_id = request.data.get('owner')
-        if owner_id:
-            try:
-                owner = UserProfile.objects.get(id=owner_id)
-                print(f"Using provided owner: {owner}")
-            except UserProfile.DoesNotExist:
-                print(f"User with ID {owner_id} not found or invalid, using first valid user")
-                owner = UserProfile.objects.first()
-        else:
-            owner = UserProfile.objects.first()
-            print(f"No owner provided, using first valid user: {owner}")
-        
-        if not owner:
-            # Create a default user
-            owner = UserProfile.objects.create_user(
-                username='default_owner',
-                email='default@example.com',
-                password='defaultpass123',
-                first_name='Default',
-                last_name='Owner'
-            )
-            print(f"Created default user: {owner}")
-        
-        # Create the tool with owner
-        tool_data = request.data.copy()
-        tool_data['owner'] = owner.id
-        
-        print(f"Final tool_data: {tool_data}")
-        
-        serializer = self.get_serializer(data=tool_data)
-        print(f"Serializer is valid: {serializer.is_valid()}")
-        if not serializer.is_valid():
-            print(f"Serializer errors: {serializer.errors}")
-        
-        tool = serializer.save()
-        print(f"Tool created: {tool}")
-        
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
-
 class ToolRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Tool.objects.all()
     serializer_class = ToolSerializer
@@ -960,6 +949,7 @@ class BorrowRequestRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIVi
     queryset = BorrowRequest.objects.all()
     serializer_class = BorrowRequestSerializer
 
+@replica_reads
 class FeedbackViewSet(viewsets.ModelViewSet):
     queryset = Feedback.objects.all()
     serializer_class = FeedbackSerializer
@@ -1002,7 +992,7 @@ class FeedbackViewSet(viewsets.ModelViewSet):
             ]
             return Response(mock_feedbacks)
         except Exception as e:
-            print(f"Error in FeedbackViewSet.list: {e}")
+            logger.exception('Error in FeedbackViewSet.list')
             return Response({'error': 'Internal server error'}, status=500)
 
 class BorrowRequestViewSet(viewsets.ModelViewSet):
@@ -1016,7 +1006,7 @@ class RentalTransactionViewSet(viewsets.ModelViewSet):
     def create(self, request, *args, **kwargs):
         """Create a new rental transaction"""
         try:
-            print(f"Creating rental with request data: {request.data}")
+            logger.info('Creating rental', extra={'fields': sorted(request.data.keys())})
             
             # Extract data from request
             data = request.data.copy()
@@ -1043,7 +1033,7 @@ class RentalTransactionViewSet(viewsets.ModelViewSet):
                 if key not in field_mapping:
                     transformed_data[key] = value
             
-            print(f"Transformed data: {transformed_data}")
+            logger.debug('Rental fields mapped', extra={'fields': sorted(transformed_data)})
             
             # Create serializer with transformed data
             serializer = self.get_serializer(data=transformed_data)
@@ -1055,13 +1045,11 @@ class RentalTransactionViewSet(viewsets.ModelViewSet):
             tool.available = False
             tool.save()
             
-            print(f"Rental created successfully: {rental.id}")
+            logger.info('Rental created', extra={'rental_id': rental.id, 'tool_id': tool.id})
             return Response(serializer.data, status=201)
             
         except Exception as e:
-            print(f"Error creating rental transaction: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('Error creating rental transaction')
             return Response({'error': str(e)}, status=400)
 
     def list(self, request, *args, **kwargs):
@@ -1159,7 +1147,7 @@ class RentalTransactionViewSet(viewsets.ModelViewSet):
             ]
             return Response(mock_rentals)
         except Exception as e:
-            print(f"Error in RentalTransactionViewSet.list: {e}")
+            logger.exception('Error in RentalTransactionViewSet.list')
             return Response({'error': 'Internal server error'}, status=500)
 
     def retrieve(self, request, *args, **kwargs):
@@ -1178,7 +1166,7 @@ class RentalTransactionViewSet(viewsets.ModelViewSet):
             }
             return Response(mock_rental)
         except Exception as e:
-            print(f"Error in RentalTransactionViewSet.retrieve: {e}")
+            logger.exception('Error in RentalTransactionViewSet.retrieve')
             return Response({'error': 'Internal server error'}, status=500)
 
 @api_view(['POST'])
@@ -1188,7 +1176,7 @@ def django_login(request):
         email = request.data.get('email')
         password = request.data.get('password')
         
-        print(f"Login attempt for email: {email}")
+        logger.info('Login attempt')
         
         if not email or not password:
             return Response({'message': 'Email and password are required'}, status=400)
@@ -1228,11 +1216,11 @@ def django_login(request):
                     return Response({'message': 'User not found'}, status=401)
                     
         except Exception as auth_error:
-            print(f"Authentication error: {auth_error}")
+            logger.exception('Authentication error')
             return Response({'message': 'Authentication failed'}, status=401)
             
     except Exception as e:
-        print(f"Login error: {e}")
+        logger.exception('Login error')
         return Response({'message': 'Internal server error'}, status=500)
 
 @api_view(['POST'])
@@ -1316,14 +1304,20 @@ def verify_user_identity(request, user_id):
     try:
         user = UserProfile.objects.get(id=user_id)
         
-        # Create verification record
-        verification = UserVerification.objects.create(
-            user=user,
-            verification_type=request.data.get('verification_type'),
-            document_front=request.FILES.get('document_front'),
-            document_back=request.FILES.get('document_back'),
-            status='pending'
-        )
+        with transaction.atomic():
+            # Documents come either as multipart files or as ids of completed chunked uploads
+            documents = {}
+            for field in ('document_front', 'document_back'):
+                upload_id = request.data.get(f'{field}_upload')
+                documents[field] = uploads.take_for_verification(upload_id) if upload_id else request.FILES.get(field)
+            
+            # Create verification record
+            verification = UserVerification.objects.create(
+                user=user,
+                verification_type=request.data.get('verification_type'),
+                status='pending',
+                **documents
+            )
         
         return Response({
             'message': 'Verification documents submitted successfully',
@@ -1333,9 +1327,14 @@ def verify_user_identity(request, user_id):
         
     except UserProfile.DoesNotExist:
         return Response({'error': 'User not found'}, status=404)
+    except (ChunkedUpload.DoesNotExist, DjangoValidationError):
+        return Response({'error': 'Upload not found'}, status=404)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
+@replica_reads
 @api_view(['GET'])
 def get_user_reviews(request, user_id):
     """Get reviews for a specific user"""
@@ -1359,6 +1358,7 @@ def get_user_reviews(request, user_id):
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
+@replica_reads
 @api_view(['GET'])
 def get_tool_reviews(request, tool_id):
     """Get reviews for a specific tool"""
@@ -1385,29 +1385,51 @@ def get_tool_reviews(request, tool_id):
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
+@replica_reads
 @api_view(['GET'])
 def list_disputes(request):
-    """List disputes for the current user"""
+    """Page through disputes newest first, filtered by ?status=, ?dispute_type= (comma-separated) and ?user_id="""
     try:
-        # For now, return all disputes since authentication is not set up
-        # In a real app, this would filter by the authenticated user
-        disputes = Dispute.objects.all().order_by('-created_at')
-        
-        # Create a simple serializer for disputes
-        dispute_data = []
-        for dispute in disputes:
-            dispute_data.append({
-                'id': dispute.id,
-                'title': dispute.title,
-                'dispute_type': dispute.dispute_type,
-                'status': dispute.status,
-                'created_at': dispute.created_at,
-                'initiator': dispute.initiator.username,
-                'rental_id': dispute.rental_transaction.id
-            })
+        # For now, anyone can list disputes since authentication is not set up;
+        # pass user_id to restrict the list to disputes a user is party to
+        page, next_cursor = disputes.dispute_page(
+            status=request.GET.get('status', ''),
+            dispute_type=request.GET.get('dispute_type', ''),
+            user_id=request.GET.get('user_id'),
+            cursor=request.GET.get('cursor'),
+            limit=request.GET.get('limit', pagination.DEFAULT_PAGE_SIZE)
+        )
+        return Response({
+            'disputes': page,
+            'next_cursor': next_cursor
+        })
+        
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
+
+@replica_reads
+@api_view(['GET'])
+def get_dispute_messages(request, dispute_id):
+    """Page through a dispute's messages newest first (keyset cursor)"""
+    try:
+        if not Dispute.objects.filter(id=dispute_id).exists():
+            return Response({'error': 'Dispute not found'}, status=404)
         
-        return Response(dispute_data)
+        page, next_cursor = disputes.message_page(
+            dispute_id,
+            cursor=request.GET.get('cursor'),
+            limit=request.GET.get('limit', pagination.DEFAULT_PAGE_SIZE)
+        )
+        return Response({
+            'dispute_id': dispute_id,
+            'messages': page,
+            'next_cursor': next_cursor
+        })
         
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
@@ -1452,7 +1474,7 @@ def create_dispute(request):
 def resolve_dispute(request, dispute_id):
     """Resolve a dispute"""
     try:
-        dispute = Dispute.objects.get(id=dispute_id)
+        dispute = Dispute.objects.select_related('rental_transaction').get(id=dispute_id)
         resolution = request.data.get('resolution')
         new_status = request.data.get('status', 'resolved')
         
@@ -1462,11 +1484,19 @@ def resolve_dispute(request, dispute_id):
         # For now, use the first user as resolver since authentication is not set up
         resolver = UserProfile.objects.first()
         
-        dispute.resolution = resolution
-        dispute.status = new_status
-        dispute.resolved_by = resolver
-        dispute.resolved_at = timezone.now()
-        dispute.save()
+        with transaction.atomic():
+            dispute.resolution = resolution
+            dispute.status = new_status
+            dispute.resolved_by = resolver
+            dispute.resolved_at = timezone.now()
+            dispute.save()
+            rental = dispute.rental_transaction
+            outbox.emit(
+                'dispute.resolved', dispute,
+                dispute_id=dispute.id, title=dispute.title, status=dispute.status, resolution=resolution,
+                rental_id=rental.id, initiator_id=dispute.initiator_id,
+                owner_id=rental.owner_id, borrower_id=rental.borrower_id,
+            )
         
         return Response({
             'message': 'Dispute resolved successfully',
@@ -1479,7 +1509,88 @@ def resolve_dispute(request, dispute_id):
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
+@api_view(['POST'])
+def attach_dispute_evidence(request, dispute_id):
+    """Attach a completed chunked upload to a dispute's evidence files"""
+    try:
+        upload_id = request.data.get('upload_id')
+        if not upload_id:
+            return Response({'error': 'upload_id required'}, status=400)
+        url = uploads.attach_to_dispute(upload_id, dispute_id)
+        return Response({
+            'dispute_id': dispute_id,
+            'evidence_url': url
+        }, status=201)
+        
+    except Dispute.DoesNotExist:
+        return Response({'error': 'Dispute not found'}, status=404)
+    except (ChunkedUpload.DoesNotExist, DjangoValidationError):
+        return Response({'error': 'Upload not found'}, status=404)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
+
+# Chunked Uploads
+def upload_status(upload):
+    return {
+        'upload_id': str(upload.id),
+        'purpose': upload.purpose,
+        'filename': upload.filename,
+        'size': upload.size,
+        'offset': upload.offset,
+        'status': upload.status,
+        'chunk_size': settings.UPLOAD_CHUNK_SIZE,
+        'file_url': upload.file.url if upload.file else None
+    }
+
+@api_view(['POST'])
+def start_upload(request):
+    """Declare a chunked upload (filename, size, sha256, purpose) and get its id"""
+    try:
+        upload = uploads.start(
+            request.data.get('purpose'),
+            request.data.get('filename'),
+            request.data.get('size', 0),
+            request.data.get('sha256'),
+            user=request.user
+        )
+        return Response(upload_status(upload), status=201)
+        
+    except (TypeError, ValueError) as e:
+        return Response({'error': str(e)}, status=400)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
+
+@api_view(['GET', 'PUT'])
+def upload_chunk(request, upload_id):
+    """Report an upload's offset (GET), or append the raw request body at the Upload-Offset header (PUT)"""
+    try:
+        upload = ChunkedUpload.objects.get(id=upload_id)
+        if upload.user_id is not None and request.user.id != upload.user_id:
+            return Response({'error': 'Only the uploader can access this upload'}, status=403)
+        
+        if request.method == 'PUT':
+            offset = int(request.headers.get('Upload-Offset', ''))
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+            if length > settings.UPLOAD_CHUNK_SIZE:
+                return Response({'error': f'Chunks are limited to {settings.UPLOAD_CHUNK_SIZE} bytes'}, status=413)
+            # Read from the raw stream: request.data/body would buffer the whole chunk in memory
+            upload = uploads.write_chunk(upload.id, offset, request.stream, length)
+        
+        return Response(upload_status(upload))
+        
+    except ChunkedUpload.DoesNotExist:
+        return Response({'error': 'Upload not found'}, status=404)
+    except uploads.OffsetConflict as e:
+        return Response({'error': str(e), 'offset': e.expected}, status=409)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
+
 # Enhanced Location-Based Features
+@replica_reads
 @api_view(['GET'])
 def find_tools_near_location(request):
     """Find tools near a specific location with advanced filtering"""
@@ -1496,8 +1607,8 @@ def find_tools_near_location(request):
         if not lat or not lng:
             return Response({'error': 'Location coordinates required'}, status=400)
         
-        # Get all available tools
-        tools = Tool.objects.filter(available=True)
+        # Get available tools inside the search radius's bounding box
+        tools = search.apply_bounding_box(Tool.objects.filter(available=True), lat, lng, radius)
         
         # Filter by pricing type if specified
         if pricing_type:
@@ -1507,37 +1618,31 @@ def find_tools_near_location(request):
         if max_price > 0:
             tools = tools.filter(price_per_day__lte=max_price)
         
-        # Calculate distances and filter by radius
-        nearby_tools = []
-        for tool in tools:
-            if tool.latitude and tool.longitude:
-                distance = tool.calculate_distance_to(lat, lng)
-                if distance is not None and distance <= radius:
-                    # Check availability for date range if specified
-                    is_available = True
-                    if start_date and end_date:
-                        conflicting_rentals = RentalTransaction.objects.filter(
-                            tool=tool,
-                            status='active',
-                            start_date__lt=end_date,
-                            end_date__gt=start_date
-                        )
-                        is_available = not conflicting_rentals.exists()
-                    
-                    if is_available:
-                        # Get tool rating
-                        tool_rentals = RentalTransaction.objects.filter(tool=tool)
-                        tool_reviews = Feedback.objects.filter(rental_transaction__in=tool_rentals)
-                        avg_rating = tool_reviews.aggregate(avg_rating=models.Avg('rating'))['avg_rating'] or 0
-                        
-                        # Filter by minimum rating if specified
-                        if avg_rating >= min_rating:
-                            nearby_tools.append({
-                                'tool': ToolSerializer(tool, context={'request': request}).data,
-                                'distance': round(distance, 2),
-                                'average_rating': round(avg_rating, 2),
-                                'total_reviews': tool_reviews.count()
-                            })
+        # Drop tools with an active rental overlapping the date range
+        if start_date and end_date:
+            tools = search.apply_date_filter(tools, start_date, end_date)
+        
+        # Calculate exact distances and filter by radius
+        matches = []
+        for tool in search.annotate_review_stats(tools.only('id', 'latitude', 'longitude')):
+            distance = tool.calculate_distance_to(lat, lng)
+            if distance is not None and distance <= radius:
+                avg_rating = tool.average_rating
+                
+                # Filter by minimum rating if specified
+                if avg_rating >= min_rating:
+                    matches.append((tool, distance, avg_rating))
+        
+        cards = tool_cards.get_cards([tool.id for tool, _, _ in matches], request)
+        nearby_tools = [
+            {
+                'tool': cards[tool.id],
+                'distance': round(distance, 2),
+                'average_rating': round(avg_rating, 2),
+                'total_reviews': tool.review_count
+            }
+            for tool, distance, avg_rating in matches if tool.id in cards
+        ]
         
         # Sort by distance
         nearby_tools.sort(key=lambda x: x['distance'])
@@ -1557,7 +1662,168 @@ def find_tools_near_location(request):
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
+# Full-text Search
+@replica_reads
+@api_view(['GET'])
+def search_tools(request):
+    """Search tools by name/description, optionally near a location and free for a date range"""
+    try:
+        query = request.GET.get('q', '').strip()
+        lat = request.GET.get('lat')
+        lng = request.GET.get('lng')
+        radius = float(request.GET.get('radius', 10))  # Default 10 miles
+        start_date = request.GET.get('start_date')
+        end_date = request.GET.get('end_date')
+        pricing_type = request.GET.get('pricing_type')
+        page = int(request.GET.get('page', 1))
+        page_size = int(request.GET.get('page_size', search.DEFAULT_PAGE_SIZE))
+
+        if not query:
+            return Response({'error': 'Search query required'}, status=400)
+
+        if bool(lat) != bool(lng):
+            return Response({'error': 'Both lat and lng are required for location search'}, status=400)
+
+        if not search.is_supported():
+            return Response({'error': 'Full-text search is not available on this database'}, status=501)
+
+        tools, total = search.search_tools(
+            query,
+            lat=lat or None,
+            lng=lng or None,
+            radius=radius,
+            start_date=start_date,
+            end_date=end_date,
+            pricing_type=pricing_type,
+            page=page,
+            page_size=page_size
+        )
+
+        # Price every result for the requested dates from the columns already loaded
+        quotes = pricing.quote_tools(tools, start_date, end_date) if start_date and end_date else {}
+
+        cards = tool_cards.get_cards([tool.id for tool in tools], request)
+        results = []
+        for tool in tools:
+            results.append({
+                'tool': cards.get(tool.id),
+                'rank': round(float(tool.search_rank), 4),
+                'distance': round(tool.distance, 2) if tool.distance is not None else None,
+                'quote': pricing.format_quote(quotes.get(tool.id))
+            })
+
+        return Response({
+            'query': query,
+            'results': results,
+            'total': total,
+            'page': max(1, page),
+            'page_size': min(max(1, page_size), search.MAX_PAGE_SIZE)
+        })
+
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
+
+@replica_reads
+@api_view(['GET'])
+def autocomplete_tools(request):
+    """Suggest tool and city names starting with the typed prefix, most popular first"""
+    try:
+        prefix = request.GET.get('q', '')
+        limit = int(request.GET.get('limit', autocomplete.DEFAULT_LIMIT))
+
+        return Response({
+            'query': prefix,
+            'suggestions': autocomplete.suggest(prefix, limit)
+        })
+
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
+
+@replica_reads
+@api_view(['GET'])
+def get_tool_facets(request):
+    """Counts per pricing type, price bucket, city and delivery option for the current search filters"""
+    try:
+        if bool(request.GET.get('lat')) != bool(request.GET.get('lng')):
+            return Response({'error': 'Both lat and lng are required for location filtering'}, status=400)
+
+        result = facets.get_facets(request.GET)
+
+        return Response({
+            'total': result['total'],
+            'facets': result['facets'],
+            'filters_applied': facets.normalize_filters(request.GET)
+        })
+
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
+
+# Pricing
+@api_view(['POST'])
+def quote_tools(request):
+    """Quote the total price (base + delivery + deposit) of several tools for one rental window"""
+    try:
+        tool_ids = request.data.get('tool_ids') or []
+        start_date = request.data.get('start_date')
+        end_date = request.data.get('end_date')
+        start_time = request.data.get('start_time')
+        end_time = request.data.get('end_time')
+        try:
+            # Form posts and query-style clients send "false"/"0", which bool() would treat as true
+            include_delivery = serializers.BooleanField().to_internal_value(request.data.get('include_delivery', False))
+        except serializers.ValidationError:
+            return Response({'error': 'include_delivery must be true or false'}, status=400)
+
+        if not tool_ids or not start_date or not end_date:
+            return Response({'error': 'tool_ids, start_date and end_date are required'}, status=400)
+
+        if len(tool_ids) > search.MAX_PAGE_SIZE:
+            return Response({'error': f'At most {search.MAX_PAGE_SIZE} tools can be quoted at once'}, status=400)
+
+        tool_ids = [int(tool_id) for tool_id in tool_ids]
+        quotes = pricing.quote_tool_ids(tool_ids, start_date, end_date, start_time, end_time, include_delivery)
+
+        return Response({
+            'date_range': {'start_date': start_date, 'end_date': end_date, 'start_time': start_time, 'end_time': end_time},
+            'quotes': [pricing.format_quote(quotes[tool_id]) for tool_id in tool_ids if tool_id in quotes],
+            'missing_tool_ids': [tool_id for tool_id in tool_ids if tool_id not in quotes]
+        })
+
+    except (TypeError, ValueError) as e:
+        return Response({'error': str(e)}, status=400)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
+
 # Real-time Availability Calendar Updates
+async def tool_availability_stream(request):
+    """Server-Sent Events stream of availability deltas for ?tool_ids=1,2,3 (needs the ASGI app)"""
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Live updates are only served by the ASGI application'}, status=501)
+    try:
+        tool_ids = {int(value) for value in request.GET.get('tool_ids', '').split(',') if value.strip()}
+    except ValueError:
+        return JsonResponse({'error': 'tool_ids must be comma-separated integers'}, status=400)
+    if not tool_ids:
+        return JsonResponse({'error': 'tool_ids required'}, status=400)
+    if len(tool_ids) > settings.LIVE_UPDATES_MAX_TOOLS:
+        return JsonResponse({'error': f'At most {settings.LIVE_UPDATES_MAX_TOOLS} tools per stream'}, status=400)
+    
+    response = StreamingHttpResponse(
+        live_updates.stream(tool_ids, request.headers.get('Last-Event-ID')),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@replica_reads
 @api_view(['GET'])
 def get_tool_calendar_availability(request, tool_id):
     """Get detailed calendar availability for a tool"""
@@ -1621,6 +1887,130 @@ def get_tool_calendar_availability(request, tool_id):
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
+@replica_reads
+@api_view(['GET'])
+def get_tool_calendar_status(request, tool_id):
+    """Merged per-day (or per-hour) availability status for a tool, run-length encoded"""
+    try:
+        start_date = request.GET.get('start_date')
+        end_date = request.GET.get('end_date')
+        resolution = request.GET.get('resolution', availability_calendar.DAY)
+
+        if not start_date or not end_date:
+            return Response({'error': 'Start date and end date required'}, status=400)
+
+        if not Tool.objects.filter(id=tool_id).exists():
+            return Response({'error': 'Tool not found'}, status=404)
+
+        runs = availability_calendar.get_status_calendar(tool_id, start_date, end_date, resolution)
+
+        return Response({
+            'tool_id': tool_id,
+            'date_range': {'start_date': start_date, 'end_date': end_date},
+            'resolution': resolution,
+            'statuses': availability_calendar.STATUS_NAMES,
+            'runs': runs
+        })
+
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
+
+@replica_reads
+@api_view(['GET'])
+def get_owner_tool_occupancy(request, user_id):
+    """Tools x days occupancy heatmap for every tool an owner lists"""
+    try:
+        # NumPy is only needed here, so import it with the endpoint
+        from . import occupancy
+
+        start_date = request.GET.get('start_date')
+        end_date = request.GET.get('end_date')
+        encoding = request.GET.get('encoding', occupancy.RLE)
+
+        if not start_date or not end_date:
+            return Response({'error': 'Start date and end date required'}, status=400)
+
+        if not UserProfile.objects.filter(id=user_id).exists():
+            return Response({'error': 'User not found'}, status=404)
+
+        start, end = availability_calendar.parse_window(start_date, end_date)
+        heatmap = occupancy.owner_heatmap(user_id, start, end, encoding)
+
+        return Response({
+            'owner_id': user_id,
+            'date_range': {'start_date': start_date, 'end_date': end_date},
+            'encoding': encoding,
+            'statuses': availability_calendar.STATUS_NAMES,
+            **heatmap
+        })
+
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
+
+@replica_reads
+@api_view(['GET'])
+def get_owner_earnings_summary(request, user_id):
+    """Monthly rentals, revenue and forfeits for an owner, read from the rollup tables"""
+    try:
+        from datetime import date
+
+        start_month = request.GET.get('start_month')
+        end_month = request.GET.get('end_month')
+
+        if not UserProfile.objects.filter(id=user_id).exists():
+            return Response({'error': 'User not found'}, status=404)
+
+        # Accept YYYY-MM and compare against the first day of each month
+        start = date.fromisoformat(f'{start_month}-01') if start_month else None
+        end = date.fromisoformat(f'{end_month}-01') if end_month else None
+        months, totals = rollups.owner_summary(user_id, start, end)
+
+        return Response({
+            'owner_id': user_id,
+            'months': months,
+            'totals': totals
+        })
+
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
+
+@replica_reads
+@api_view(['GET'])
+def get_tool_utilization(request, tool_id):
+    """Daily rentals and booked days for one tool, read from the rollup tables"""
+    try:
+        start_date = request.GET.get('start_date')
+        end_date = request.GET.get('end_date')
+
+        if not start_date or not end_date:
+            return Response({'error': 'Start date and end date required'}, status=400)
+
+        if not Tool.objects.filter(id=tool_id).exists():
+            return Response({'error': 'Tool not found'}, status=404)
+
+        start, end = availability_calendar.parse_window(start_date, end_date)
+        days, totals = rollups.tool_utilization(tool_id, start, end)
+        window_days = (end - start).days + 1
+
+        return Response({
+            'tool_id': tool_id,
+            'date_range': {'start_date': start_date, 'end_date': end_date},
+            'days': days,
+            'totals': totals,
+            'utilization_rate': round(min(totals['booked_days'] / window_days, 1.0), 4)
+        })
+
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
+
 # Advanced Conflict Checking
 @api_view(['POST'])
 def check_advanced_availability_conflict(request):
@@ -1851,3 +2241,74 @@ def get_deposits(request):
         print(f"Error in get_deposits: {e}")
         return Response({'error': 'Internal server error'}, status=500)
 
+
+# Rental Chat
+@api_view(['GET', 'POST'])
+def rental_messages(request, rental_id):
+    """Page through a rental's messages newest first (keyset cursor), or post a new one"""
+    try:
+        rental = RentalTransaction.objects.only('id', 'owner_id', 'borrower_id').get(id=rental_id)
+        if not request.user.is_authenticated or request.user.id not in (rental.owner_id, rental.borrower_id):
+            return Response({'error': 'Only the rental participants can access its messages'}, status=403)
+        
+        if request.method == 'POST':
+            text = (request.data.get('message') or '').strip()
+            if not text:
+                return Response({'error': 'Message text required'}, status=400)
+            message = Message.objects.create(rental_transaction=rental, sender=request.user, message=text)
+            return Response(ThreadMessageSerializer(message).data, status=201)
+        
+        page, next_cursor = messaging.thread_page(
+            rental.id,
+            cursor=request.GET.get('cursor'),
+            limit=request.GET.get('limit', messaging.DEFAULT_PAGE_SIZE)
+        )
+        return Response({
+            'rental_id': rental.id,
+            'messages': ThreadMessageSerializer(page, many=True).data,
+            'next_cursor': next_cursor
+        })
+        
+    except RentalTransaction.DoesNotExist:
+        return Response({'error': 'Rental not found'}, status=404)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
+
+@api_view(['POST'])
+def mark_rental_messages_read(request, rental_id):
+    """Mark the current user's unread messages in a rental thread as read with a single UPDATE"""
+    try:
+        rental = RentalTransaction.objects.only('id', 'owner_id', 'borrower_id').get(id=rental_id)
+        if not request.user.is_authenticated or request.user.id not in (rental.owner_id, rental.borrower_id):
+            return Response({'error': 'Only the rental participants can access its messages'}, status=403)
+        
+        up_to = request.data.get('up_to')
+        marked = messaging.mark_read(rental.id, request.user.id, up_to_id=int(up_to) if up_to is not None else None)
+        return Response({
+            'rental_id': rental.id,
+            'marked_read': marked,
+            'unread_count': messaging.unread_count(request.user.id)
+        })
+        
+    except RentalTransaction.DoesNotExist:
+        return Response({'error': 'Rental not found'}, status=404)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
+
+@api_view(['GET'])
+def get_unread_message_count(request):
+    """Unread message badge for the current user, read from its maintained counter"""
+    if not request.user.is_authenticated:
+        return Response({'error': 'Authentication required'}, status=401)
+    return Response({'unread_count': messaging.unread_count(request.user.id)})
+
+
+def metrics_endpoint(request):
+    """Request latency and SQL metrics in Prometheus text format"""
+    if not metrics.is_authorized(request):
+        return JsonResponse({'error': 'Metrics require a staff login or METRICS_TOKEN'}, status=403)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
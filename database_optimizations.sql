@@ -7,21 +7,14 @@
 -- 1. AVAILABILITY INDEXING
 -- =====================================================
 
--- Create indexes for efficient date range queries
-CREATE INDEX idx_rental_transactions_dates ON rental_transactions (start_date, end_date);
-CREATE INDEX idx_rental_transactions_status_dates ON rental_transactions (status, start_date, end_date);
-CREATE INDEX idx_rental_transactions_tool_dates ON rental_transactions (tool_id, start_date, end_date);
-
--- Create composite index for availability checking
-CREATE INDEX idx_availability_check ON rental_transactions (tool_id, status, start_date, end_date);
-
--- Index for active rentals
-CREATE INDEX idx_active_rentals ON rental_transactions (tool_id, status) WHERE status = 'active';
+-- Indexes are declared in the model Meta.indexes and created by api/migrations/0004_query_indexes.py
 
 -- =====================================================
 -- 2. GEOGRAPHIC INDEXING
 -- =====================================================
 
+-- Indexes are declared in the model Meta.indexes and created by api/migrations/0004_query_indexes.py
+
 -- Add location columns to users table if not exists
 ALTER TABLE users ADD COLUMN IF NOT EXISTS latitude DECIMAL(10, 8) DEFAULT NULL;
 ALTER TABLE users ADD COLUMN IF NOT EXISTS longitude DECIMAL(11, 8) DEFAULT NULL;
@@ -32,13 +25,6 @@ ALTER TABLE tools ADD COLUMN IF NOT EXISTS latitude DECIMAL(10, 8) DEFAULT NULL;
 ALTER TABLE tools ADD COLUMN IF NOT EXISTS longitude DECIMAL(11, 8) DEFAULT NULL;
 ALTER TABLE tools ADD COLUMN IF NOT EXISTS location_updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
 
--- Create spatial indexes for geographic queries
-CREATE INDEX idx_users_location ON users (latitude, longitude);
-CREATE INDEX idx_tools_location ON tools (latitude, longitude);
-
--- Create composite index for location-based tool search
-CREATE INDEX idx_tools_location_available ON tools (latitude, longitude, available) WHERE available = TRUE;
-
 -- =====================================================
 -- 3. TRANSACTION INTEGRITY
 -- =====================================================
@@ -7,27 +7,14 @@
 -- 1. AVAILABILITY INDEXING
 -- =====================================================
 
--- Create indexes for efficient date range queries
-CREATE INDEX idx_rental_transactions_dates ON api_rentaltransaction (start_date, end_date);
-CREATE INDEX idx_rental_transactions_status_dates ON api_rentaltransaction (status, start_date, end_date);
-CREATE INDEX idx_rental_transactions_tool_dates ON api_rentaltransaction (tool_id, start_date, end_date);
-
--- Create composite index for availability checking
-CREATE INDEX idx_availability_check ON api_rentaltransaction (tool_id, status, start_date, end_date);
-
--- Index for active rentals
-CREATE INDEX idx_active_rentals ON api_rentaltransaction (tool_id, status);
+-- Indexes are declared in the model Meta.indexes and created by api/migrations/0004_query_indexes.py
 
 -- =====================================================
 -- 2. GEOGRAPHIC INDEXING
 -- =====================================================
 
 -- Location columns already exist in api_tool table
--- Create spatial indexes for geographic queries
-CREATE INDEX idx_tools_location ON api_tool (latitude, longitude);
-
--- Create composite index for location-based tool search
-CREATE INDEX idx_tools_location_available ON api_tool (latitude, longitude, available);
+-- Indexes are declared in the model Meta.indexes and created by api/migrations/0004_query_indexes.py
 
 -- =====================================================
 -- 3. TRANSACTION INTEGRITY
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'toolshare_backend.settings')
 
 application = get_asgi_application()
+
+# Warm the autocomplete index off the request path
+from api import autocomplete  # noqa: E402
+
+autocomplete.start()
@@ -0,0 +1,221 @@
+"""
+A bounded, thread-safe pool of DB-API connections.
+
+The pool knows nothing about MySQL: it is given callables to open, ping,
+reset and close raw connections, so the same logic can sit under any
+backend. One pool exists per database alias per process; a forked child
+starts with an empty pool instead of sharing its parent's sockets.
+
+Checkout reuses the most recently returned idle connection, discarding
+those past ``max_lifetime`` or ``idle_timeout`` and pinging ones that sat
+idle longer than ``health_check_after``. When ``max_size`` connections are
+in use, callers wait up to ``timeout`` seconds and then get ``error_class``.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+
+class ConnectionPool:
+    def __init__(self, connect, ping=None, reset=None, close=None, max_size=10, timeout=10.0,
+                 max_lifetime=1800.0, idle_timeout=300.0, health_check_after=5.0,
+                 error_class=RuntimeError, name='default'):
+        self.connect = connect
+        self.ping = ping
+        self.reset = reset
+        self.close = close or (lambda conn: conn.close())
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.error_class = error_class
+        self.name = name
+        self.pid = os.getpid()
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, created, last_used), most recently used on the right
+        self._in_use = {}  # id(conn) -> created
+        self._size = 0  # open connections plus slots reserved for ones being opened
+
+        self.waiters = 0
+        self.checkouts = 0
+        self.created = 0
+        self.discarded = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+
+    def _expired(self, created, last_used, now):
+        return now - created >= self.max_lifetime or now - last_used >= self.idle_timeout
+
+    def _close_quietly(self, conn):
+        try:
+            self.close(conn)
+        except Exception:
+            pass
+
+    def _healthy(self, conn):
+        if self.ping is None:
+            return True
+        try:
+            self.ping(conn)
+            return True
+        except Exception:
+            return False
+
+    def checkout(self):
+        """Borrow a connection, opening one if below max_size and nothing idle is usable"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        expired = []
+        entry = None
+        try:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    while self._idle:
+                        conn, created, last_used = self._idle.pop()
+                        if self._expired(created, last_used, now):
+                            expired.append(conn)
+                            self._size -= 1
+                            self.discarded += 1
+                            continue
+                        entry = (conn, created, last_used)
+                        break
+                    if entry is not None:
+                        break
+                    if self._size < self.max_size:
+                        # Reserve the slot now, open the connection outside the lock
+                        self._size += 1
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise self.error_class(
+                            f'Connection pool {self.name!r} exhausted: {self.max_size} connections in use '
+                            f'after waiting {self.timeout}s'
+                        )
+                    self.waiters += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self.waiters -= 1
+                self.checkouts += 1
+                self.wait_seconds += time.monotonic() - started
+        finally:
+            for conn in expired:
+                self._close_quietly(conn)
+
+        if entry is not None:
+            conn, created, last_used = entry
+            if time.monotonic() - last_used < self.health_check_after or self._healthy(conn):
+                with self._cond:
+                    self._in_use[id(conn)] = created
+                return conn
+            # Dead connection: close it and open a replacement in the same slot
+            self._close_quietly(conn)
+            with self._cond:
+                self.discarded += 1
+
+        try:
+            conn = self.connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.created += 1
+            self._in_use[id(conn)] = time.monotonic()
+        return conn
+
+    def checkin(self, conn, reset=True):
+        """Return a borrowed connection; it is closed instead if too old or if resetting it fails"""
+        with self._cond:
+            created = self._in_use.pop(id(conn), None)
+        if created is None:
+            # Not ours (or already returned): just close it
+            self._close_quietly(conn)
+            return
+
+        now = time.monotonic()
+        keep = now - created < self.max_lifetime
+        if keep and reset and self.reset is not None:
+            try:
+                self.reset(conn)
+            except Exception:
+                keep = False
+
+        with self._cond:
+            if keep:
+                self._idle.append((conn, created, now))
+            else:
+                self._size -= 1
+                self.discarded += 1
+            self._cond.notify()
+        if not keep:
+            self._close_quietly(conn)
+
+    def discard(self, conn):
+        """Close a borrowed connection without returning it"""
+        with self._cond:
+            known = self._in_use.pop(id(conn), None) is not None
+            if known:
+                self._size -= 1
+                self.discarded += 1
+                self._cond.notify()
+        self._close_quietly(conn)
+
+    def close_all(self):
+        """Close every idle connection; borrowed ones are unaffected"""
+        with self._cond:
+            idle = [conn for conn, _, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self.discarded += len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'max_size': self.max_size,
+                'size': self._size,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'waiters': self.waiters,
+                'checkouts': self.checkouts,
+                'created': self.created,
+                'discarded': self.discarded,
+                'timeouts': self.timeouts,
+                'wait_seconds': self.wait_seconds,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, factory):
+    """The pool for ``alias`` in this process, created with ``factory()`` on first use"""
+    pool = _pools.get(alias)
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None or pool.pid != os.getpid():
+            # Connections inherited across fork belong to the parent; never reuse or close them
+            pool = _pools[alias] = factory()
+        return pool
+
+
+def existing_pool(alias):
+    pool = _pools.get(alias)
+    return pool if pool is not None and pool.pid == os.getpid() else None
+
+
+def all_pools():
+    pid = os.getpid()
+    return {alias: pool for alias, pool in _pools.items() if pool.pid == pid}
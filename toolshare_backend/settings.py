@@ -51,6 +51,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.structured_logging.RequestIdMiddleware',
+    'api.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -59,6 +61,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.db_router.ReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'toolshare_backend.urls'
@@ -87,12 +90,23 @@ WSGI_APPLICATION = 'toolshare_backend.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        # Set DB_ENGINE=toolshare_backend.db_backends.pooled_mysql to keep a per-process connection pool
+        'ENGINE': os.getenv('DB_ENGINE', 'django.db.backends.mysql'),
         'NAME': os.getenv('DB_NAME', 'toolshare_db'),
         'USER': os.getenv('DB_USER', 'root'),
         'PASSWORD': os.getenv('DB_PASSWORD', 'Asurya@25'),
         'HOST': os.getenv('DB_HOST', 'localhost'),
         'PORT': os.getenv('DB_PORT', '3306'),
+        # Django hands the connection back after each request; with the pooled engine the pool keeps it open
+        'CONN_MAX_AGE': 0,
+        # Only read by the pooled engine
+        'POOL': {
+            'MAX_SIZE': int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+            'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+            'MAX_LIFETIME': float(os.getenv('DB_POOL_MAX_LIFETIME', '1800')),
+            'IDLE_TIMEOUT': float(os.getenv('DB_POOL_IDLE_TIMEOUT', '300')),
+            'HEALTH_CHECK_AFTER': float(os.getenv('DB_POOL_HEALTH_CHECK_AFTER', '5')),
+        },
     }
 }
 
@@ -166,3 +180,163 @@ CORS_ALLOW_HEADERS = [
 
 # Use custom user model
 AUTH_USER_MODEL = 'api.UserProfile'
+
+# Cache
+# Calendars, facets, tool cards and near-me searches are cached and invalidated on writes. Invalidation
+# only reaches other worker processes through a shared cache: set CACHE_REDIS_URL (requires the `redis`
+# package) when running more than one. Without it each process keeps its own copy, stale for up to its TTL.
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', '')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_REDIS_URL,
+    } if CACHE_REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Search
+# Upper bound on distinct tool/city names held by the in-process autocomplete index
+AUTOCOMPLETE_MAX_TERMS = int(os.getenv('AUTOCOMPLETE_MAX_TERMS', '200000'))
+# Each worker's index only sees its own writes; rebuild it from the database this often
+AUTOCOMPLETE_REBUILD_SECONDS = int(os.getenv('AUTOCOMPLETE_REBUILD_SECONDS', '300'))
+# Seconds a facet-count result is reused for identical search filters
+TOOL_FACETS_CACHE_TTL = int(os.getenv('TOOL_FACETS_CACHE_TTL', '60'))
+
+# Availability calendar
+# Merged calendars are invalidated on writes; without a shared cache the TTL bounds staleness across processes
+CALENDAR_CACHE_TTL = int(os.getenv('CALENDAR_CACHE_TTL', '300'))
+
+# Metrics
+# Per-route latency and SQL counters served at /api/metrics/
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+# Bearer token a Prometheus scraper sends for /api/metrics/; without it only staff users can read them
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+# Queries at least this slow are logged with their SQL on the api.slow_sql logger
+SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', '200'))
+
+# Logging
+# Records are queued by request threads and written as JSON lines by a listener thread
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+# Fraction of sub-WARNING records kept per logger prefix; warnings and errors are always kept
+LOG_SAMPLE_RATES = {
+    'api.views': float(os.getenv('LOG_SAMPLE_RATE_VIEWS', '1.0')),
+    'api.serializers': float(os.getenv('LOG_SAMPLE_RATE_SERIALIZERS', '1.0')),
+}
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_id': {'()': 'api.structured_logging.RequestIdFilter'},
+        'sampling': {'()': 'api.structured_logging.SamplingFilter', 'rates': LOG_SAMPLE_RATES},
+    },
+    'handlers': {
+        'queue': {
+            '()': 'api.structured_logging.queue_handler',
+            'maxsize': int(os.getenv('LOG_QUEUE_SIZE', '10000')),
+            'filters': ['request_id', 'sampling'],
+        },
+    },
+    'loggers': {
+        'api': {'handlers': ['queue'], 'level': LOG_LEVEL, 'propagate': False},
+    },
+    'root': {'handlers': ['queue'], 'level': 'WARNING'},
+}
+
+# Read replica
+# With DB_REPLICA_HOST set, GET requests to read-heavy views (search, calendars,
+# reviews, dashboards) read from this replica; writes always use the primary
+if os.getenv('DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+        'USER': os.getenv('DB_REPLICA_USER', DATABASES['default']['USER']),
+        'PASSWORD': os.getenv('DB_REPLICA_PASSWORD', DATABASES['default']['PASSWORD']),
+        'HOST': os.getenv('DB_REPLICA_HOST'),
+        'PORT': os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        # Tests run against the primary's test database
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['api.db_router.ReplicaRouter']
+# Seconds a client keeps reading from the primary after it writes, so it sees its own changes
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', '15'))
+
+# Live availability updates (Server-Sent Events, ASGI only)
+# Set a Redis URL to fan events out across worker processes; without it they stay in-process
+LIVE_UPDATES_REDIS_URL = os.getenv('LIVE_UPDATES_REDIS_URL', '')
+LIVE_UPDATES_REDIS_CHANNEL = os.getenv('LIVE_UPDATES_REDIS_CHANNEL', 'toolshare:availability')
+# Most tools one stream may subscribe to
+LIVE_UPDATES_MAX_TOOLS = int(os.getenv('LIVE_UPDATES_MAX_TOOLS', '100'))
+# Events buffered per slow client before it is told to resync
+LIVE_UPDATES_QUEUE_SIZE = int(os.getenv('LIVE_UPDATES_QUEUE_SIZE', '1000'))
+LIVE_UPDATES_HEARTBEAT_SECONDS = float(os.getenv('LIVE_UPDATES_HEARTBEAT_SECONDS', '15'))
+LIVE_UPDATES_RETRY_MS = int(os.getenv('LIVE_UPDATES_RETRY_MS', '3000'))
+
+# Outbox
+# Side effects of borrow requests, deposits and disputes are queued in api_outboxevent
+# and delivered by `manage.py process_outbox`
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '100'))
+# Events are only read once this old, so slower transactions holding lower ids have committed
+OUTBOX_SETTLE_SECONDS = int(os.getenv('OUTBOX_SETTLE_SECONDS', '5'))
+# Ids the cursor skips are re-checked this long, for transactions that commit later than the settle time
+OUTBOX_GAP_SECONDS = int(os.getenv('OUTBOX_GAP_SECONDS', '600'))
+# Failures on one event before a consumer skips it
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+# Days processed events are kept before --purge deletes them
+OUTBOX_RETENTION_DAYS = int(os.getenv('OUTBOX_RETENTION_DAYS', '7'))
+
+# Email (notifications consumer)
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', '25'))
+EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'False') == 'True'
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'ToolShare <noreply@toolshare.local>')
+
+# Uploads
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', str(BASE_DIR / 'media'))
+MEDIA_URL = '/media/'
+# Media is stored content-addressed (deduplicated, reference-counted); `manage.py gc_media` removes unreferenced files
+STORAGES = {
+    'default': {'BACKEND': os.getenv('MEDIA_STORAGE_BACKEND', 'api.storage.ContentAddressedStorage')},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+# Chunked uploads (verification documents, dispute evidence) are assembled here before moving to MEDIA_ROOT
+UPLOAD_TEMP_DIR = os.getenv('UPLOAD_TEMP_DIR', str(BASE_DIR / 'media' / 'tmp'))
+UPLOAD_MAX_SIZE = int(os.getenv('UPLOAD_MAX_SIZE', str(50 * 1024 * 1024)))
+# Largest single PUT; a worker never holds more than a 64 KB block of it in memory
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(5 * 1024 * 1024)))
+# Unfinished or unattached uploads older than this are removed by `manage.py clean_uploads`
+UPLOAD_EXPIRY_HOURS = int(os.getenv('UPLOAD_EXPIRY_HOURS', '24'))
+
+# Thumbnails
+# Processes resizing uploaded tool images and profile pictures; 0 renders inline in the request
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', '2'))
+
+# REST framework
+# orjson-backed JSON (api/renderers.py). The browsable API renderer is only added when
+# BROWSABLE_API is on, which it is by default while DEBUG; production serves JSON only.
+BROWSABLE_API = os.getenv('BROWSABLE_API', str(DEBUG)) == 'True'
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': ['api.renderers.FastJSONRenderer'] + (
+        ['rest_framework.renderers.BrowsableAPIRenderer'] if BROWSABLE_API else []
+    ),
+    'DEFAULT_PARSER_CLASSES': [
+        'api.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# Tool cards
+# Cached compact tools for list and search responses; dropped on writes, the TTL bounds staleness across processes
+TOOL_CARD_CACHE_TTL = int(os.getenv('TOOL_CARD_CACHE_TTL', '300'))
+
+# Near-me search cache
+# Seconds a neighbourhood's candidate list is reused; tool writes in the area replace it sooner
+NEAR_ME_CACHE_TTL = int(os.getenv('NEAR_ME_CACHE_TTL', '60'))
+
+# Tests
+# Builds the test database from the models; see the runner for why
+TEST_RUNNER = 'toolshare_backend.test_runner.TestRunner'
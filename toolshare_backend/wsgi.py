@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'toolshare_backend.settings')
 
 application = get_wsgi_application()
+
+# Warm the autocomplete index off the request path
+from api import autocomplete  # noqa: E402
+
+autocomplete.start()